@@ -3,6 +3,10 @@ window.ActivationManager = {
   // API配置 - 将在配置文件加载后更新
   API_BASE_URL: 'http://localhost:5001/api',
   API_KEY: 'mozibang_api_secret_2024',
+  // 权益令牌验签公钥（kid -> JWK），来自 activation_config.js
+  ENTITLEMENT_PUBLIC_KEYS: {},
+  // 拉取权益撤销列表的最小间隔（毫秒）
+  REVOCATION_SYNC_INTERVAL: 15 * 60 * 1000,
   
   // 初始化配置
   init() {
@@ -10,6 +14,7 @@ window.ActivationManager = {
       const config = window.ActivationConfig.getCurrentConfig();
       this.API_BASE_URL = config.API_BASE_URL;
       this.API_KEY = config.API_KEY;
+      this.ENTITLEMENT_PUBLIC_KEYS = window.ActivationConfig.ENTITLEMENT_PUBLIC_KEYS || {};
       console.log('ActivationManager配置已更新:', config);
     }
   },
@@ -48,7 +53,8 @@ window.ActivationManager = {
         
         await chrome.storage.local.set({ 
           proStatus: proData,
-          activationData: result.data
+          activationData: result.data,
+          entitlementToken: result.data.entitlement_token || null
         });
         
         console.log('激活成功，Pro状态已保存:', proData);
@@ -76,9 +82,112 @@ window.ActivationManager = {
     }
   },
   
-  // 验证Pro状态
-  async verifyProStatus(userEmail) {
+  // base64url 解码为字节
+  base64UrlDecode(value) {
+    const base64 = value.replace(/-/g, '+').replace(/_/g, '/');
+    const binary = atob(base64 + '='.repeat((4 - base64.length % 4) % 4));
+    return Uint8Array.from(binary, c => c.charCodeAt(0));
+  },
+  
+  // 验证权益令牌的 ES256 签名，成功返回声明，否则返回 null
+  async verifyEntitlementToken(token) {
+    try {
+      const [headerB64, claimsB64, signatureB64] = token.split('.');
+      const decoder = new TextDecoder();
+      const header = JSON.parse(decoder.decode(this.base64UrlDecode(headerB64)));
+      const jwk = this.ENTITLEMENT_PUBLIC_KEYS[header.kid];
+      if (header.alg !== 'ES256' || !jwk) {
+        return null;
+      }
+      
+      const key = await crypto.subtle.importKey(
+        'jwk', { kty: 'EC', crv: 'P-256', x: jwk.x, y: jwk.y }, { name: 'ECDSA', namedCurve: 'P-256' }, false, ['verify']
+      );
+      const valid = await crypto.subtle.verify(
+        { name: 'ECDSA', hash: 'SHA-256' }, key,
+        this.base64UrlDecode(signatureB64), new TextEncoder().encode(`${headerB64}.${claimsB64}`)
+      );
+      return valid ? JSON.parse(decoder.decode(this.base64UrlDecode(claimsB64))) : null;
+    } catch (error) {
+      console.error('权益令牌验签失败:', error);
+      return null;
+    }
+  },
+  
+  // 增量拉取权益撤销列表（按 REVOCATION_SYNC_INTERVAL 节流），返回 { email: 撤销次数 }
+  async syncRevocations() {
+    const stored = await chrome.storage.local.get(['revocationRevisions', 'revisionsSyncedAt', 'revisionsSince']);
+    const revocations = stored.revocationRevisions || {};
+    if (stored.revisionsSyncedAt && Date.now() - stored.revisionsSyncedAt < this.REVOCATION_SYNC_INTERVAL) {
+      return revocations;
+    }
+    
     try {
+      const response = await fetch(`${this.API_BASE_URL}/entitlements/revocations?since=${stored.revisionsSince || 0}`, {
+        headers: { 'X-API-Key': this.API_KEY }
+      });
+      const result = await response.json();
+      if (response.ok && result.success) {
+        for (const item of result.data.revocations) {
+          revocations[item.user_email] = Math.max(revocations[item.user_email] || 0, item.revision);
+        }
+        await chrome.storage.local.set({
+          revocationRevisions: revocations,
+          revisionsSyncedAt: Date.now(),
+          revisionsSince: result.data.server_time
+        });
+      }
+    } catch (error) {
+      // 离线时沿用上次的撤销列表，令牌仍受 refresh_after 限制
+      console.warn('拉取权益撤销列表失败:', error);
+    }
+    return revocations;
+  },
+  
+  // 获取仍在刷新窗口内、签名有效且未被撤销的本地权益令牌，返回 null 表示需要请求服务端
+  async getLocalEntitlement(userEmail) {
+    const result = await chrome.storage.local.get(['entitlementToken', 'proStatus']);
+    if (!result.entitlementToken || !result.proStatus) {
+      return null;
+    }
+    
+    const claims = await this.verifyEntitlementToken(result.entitlementToken);
+    const now = Math.floor(Date.now() / 1000);
+    if (!claims || claims.sub !== userEmail || now >= claims.refresh_after || now >= claims.exp) {
+      return null;
+    }
+    
+    // 按撤销次数比较：同一秒内撤销后重新激活签发的令牌仍然有效
+    const revocations = await this.syncRevocations();
+    if ((revocations[userEmail] || 0) > (claims.rev || 0)) {
+      await chrome.storage.local.remove(['entitlementToken']);
+      return null;
+    }
+    
+    return { claims, proStatus: result.proStatus };
+  },
+  
+  // 验证Pro状态（刷新窗口内直接使用本地令牌，forceRefresh 为 true 时强制请求服务端）
+  async verifyProStatus(userEmail, forceRefresh = false) {
+    try {
+      if (!forceRefresh) {
+        const local = await this.getLocalEntitlement(userEmail);
+        if (local) {
+          return {
+            success: true,
+            fromCache: true,
+            data: {
+              is_pro: true,
+              pro_type: local.claims.pro_type,
+              is_lifetime: local.claims.is_lifetime,
+              expires_at: local.proStatus.expiresAt,
+              activated_at: local.proStatus.activatedAt,
+              is_expired: false
+            }
+          };
+        }
+      }
+      
       const response = await fetch(`${this.API_BASE_URL}/verify-pro`, {
         method: 'POST',
         headers: {
@@ -105,10 +214,13 @@ window.ActivationManager = {
             lastLogin: result.data.last_login
           };
           
-          await chrome.storage.local.set({ proStatus: proData });
+          await chrome.storage.local.set({
+            proStatus: proData,
+            entitlementToken: result.data.entitlement_token || null
+          });
         } else {
           // 清除本地Pro状态
-          await chrome.storage.local.remove(['proStatus', 'activationData']);
+          await chrome.storage.local.remove(['proStatus', 'activationData', 'entitlementToken']);
         }
         
         return {
@@ -150,7 +262,7 @@ window.ActivationManager = {
       // 检查是否过期（非永久版本）
       if (proData.expiresAt && new Date(proData.expiresAt) < new Date()) {
         // 已过期，清除Pro状态
-        await chrome.storage.local.remove(['proStatus', 'activationData']);
+        await chrome.storage.local.remove(['proStatus', 'activationData', 'entitlementToken']);
         return {
           isPro: false,
           plan: 'free',
@@ -180,7 +292,7 @@ window.ActivationManager = {
   // 清除Pro状态
   async clearProStatus() {
     try {
-      await chrome.storage.local.remove(['proStatus', 'activationData']);
+      await chrome.storage.local.remove(['proStatus', 'activationData', 'entitlementToken']);
       console.log('Pro状态已清除');
       return true;
     } catch (error) {
@@ -193,6 +305,7 @@ window.ActivationManager = {
   getErrorMessage(code, defaultMessage) {
     const errorMessages = {
       'INVALID_CODE': '激活码无效或不存在',
+      'INVALID_CODE_FORMAT': '激活码格式错误，请检查是否输错',
       'CODE_ALREADY_USED': '激活码已被使用',
       'CODE_EXPIRED': '激活码已过期',
       'INVALID_CODE_TYPE': '激活码类型无效',
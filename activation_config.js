@@ -2,6 +2,12 @@
 // 部署后需要更新这些配置
 
 window.ActivationConfig = {
+  // 权益令牌验签公钥（kid -> JWK），由服务端执行 python entitlement_tokens.py genkey k1 生成；
+  // 只填写公钥，私钥只配置在服务端的 ENTITLEMENT_SIGNING_KEYS。轮换密钥时保留旧公钥
+  ENTITLEMENT_PUBLIC_KEYS: {
+    // k1: { kty: 'EC', crv: 'P-256', x: '...', y: '...' }
+  },
+  
   // 开发环境配置
   development: {
     API_BASE_URL: 'http://localhost:5001/api',
@@ -63,6 +69,7 @@ if (window.ActivationManager) {
   const config = window.ActivationConfig.getCurrentConfig();
   window.ActivationManager.API_BASE_URL = config.API_BASE_URL;
   window.ActivationManager.API_KEY = config.API_KEY;
+  window.ActivationManager.ENTITLEMENT_PUBLIC_KEYS = window.ActivationConfig.ENTITLEMENT_PUBLIC_KEYS;
   
   console.log('激活码API配置已更新:', config);
 }
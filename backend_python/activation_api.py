@@ -12,16 +12,23 @@ import hashlib
 import json
 import datetime
 import uuid
-import logging
 from functools import wraps
+from write_behind import WriteBehindBuffer
+from metrics import setup_metrics
+from query_profiler import mysql_cursor_class
+from structured_logging import get_logger, setup_logging
+from code_generator import normalize_code, check_code_format, require_signing_keys
 
-# 配置日志
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# 结构化日志（后台线程写出）
+log = get_logger('mozibang.mysql_api')
 
 app = Flask(__name__)
+setup_logging(app)
 CORS(app)  # 允许跨域请求
 
+# 激活码校验位只用专用的签名密钥，未配置时拒绝启动
+require_signing_keys()
+
 # 数据库配置
 DB_CONFIG = {
     'host': 'localhost',
@@ -31,18 +38,40 @@ DB_CONFIG = {
     'charset': 'utf8mb4'
 }
 
+# 带计时的游标（慢查询记录到 query_profiler）
+ProfiledCursor = mysql_cursor_class()
+
 # API密钥配置（用于验证请求来源）
 API_SECRET_KEY = "mozibang_api_secret_2024"  # 生产环境请使用更安全的密钥
 
 def get_db_connection():
     """获取数据库连接"""
     try:
-        connection = pymysql.connect(**DB_CONFIG)
+        connection = pymysql.connect(**DB_CONFIG, cursorclass=ProfiledCursor)
         return connection
     except Exception as e:
-        logger.error(f"数据库连接失败: {e}")
+        log.error('db_connect_error', error=str(e))
         return None
 
+def flush_last_login(entries):
+    """批量写入用户最后登录时间"""
+    connection = get_db_connection()
+    if not connection:
+        raise RuntimeError('Database connection failed')
+    try:
+        with connection.cursor() as cursor:
+            cursor.executemany("""
+                UPDATE user_pro_status 
+                SET last_login = %s 
+                WHERE user_email = %s
+            """, [(last_login, user_email) for user_email, last_login in entries])
+        connection.commit()
+    finally:
+        connection.close()
+
+# 最后登录时间写回缓冲，verify-pro 不再逐次写库
+last_login_buffer = WriteBehindBuffer('last_login', flush_last_login)
+
 def verify_api_key(f):
     """验证API密钥的装饰器"""
     @wraps(f)
@@ -57,6 +86,9 @@ def verify_api_key(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# 请求指标，/metrics 需API密钥（MySQL查询不经过SQLite连接池，数据库耗时恒为0）
+setup_metrics(app, verify_api_key, buffers={'last_login': last_login_buffer.stats})
+
 def generate_user_token(user_email):
     """生成用户访问令牌"""
     timestamp = str(datetime.datetime.now().timestamp())
@@ -85,7 +117,7 @@ def activate_code():
                 'code': 'INVALID_DATA'
             }), 400
         
-        activation_code = data.get('activation_code', '').strip()
+        activation_code = normalize_code(data.get('activation_code', ''))
         user_email = data.get('user_email', '').strip()
         user_name = data.get('user_name', '').strip()
         
@@ -96,6 +128,14 @@ def activate_code():
                 'code': 'MISSING_REQUIRED_FIELDS'
             }), 400
         
+        # 新格式激活码先核对校验位，输错或伪造的不查库
+        if not check_code_format(activation_code):
+            return jsonify({
+                'success': False,
+                'error': 'Invalid activation code format, please check for typos',
+                'code': 'INVALID_CODE_FORMAT'
+            }), 400
+        
         connection = get_db_connection()
         if not connection:
             return jsonify({
@@ -116,6 +156,7 @@ def activate_code():
                 code_info = cursor.fetchone()
                 
                 if not code_info:
+                    log.info('activation_rejected', user_email=user_email, error_code='INVALID_CODE')
                     return jsonify({
                         'success': False,
                         'error': 'Invalid activation code',
@@ -126,6 +167,7 @@ def activate_code():
                 
                 # 检查激活码是否已被使用
                 if is_used:
+                    log.info('activation_rejected', user_email=user_email, error_code='CODE_ALREADY_USED')
                     return jsonify({
                         'success': False,
                         'error': 'Activation code has already been used',
@@ -136,6 +178,7 @@ def activate_code():
                 
                 # 检查激活码是否过期
                 if expires_at and expires_at < datetime.datetime.now():
+                    log.info('activation_rejected', user_email=user_email, error_code='CODE_EXPIRED')
                     return jsonify({
                         'success': False,
                         'error': 'Activation code has expired',
@@ -209,6 +252,8 @@ def activate_code():
                       request.remote_addr, request.headers.get('User-Agent', ''), now))
                 
                 connection.commit()
+                log.info('activation_success', user_email=user_email, activation_code=activation_code,
+                         code_type=code_type)
                 
                 # 生成用户访问令牌
                 user_token = generate_user_token(user_email)
@@ -227,9 +272,9 @@ def activate_code():
                     }
                 })
                 
-        except Exception as e:
+        except Exception:
             connection.rollback()
-            logger.error(f"激活过程中发生错误: {e}")
+            log.exception('activation_error', user_email=user_email)
             return jsonify({
                 'success': False,
                 'error': 'Activation failed',
@@ -239,8 +284,8 @@ def activate_code():
         finally:
             connection.close()
             
-    except Exception as e:
-        logger.error(f"激活接口错误: {e}")
+    except Exception:
+        log.exception('activation_request_error')
         return jsonify({
             'success': False,
             'error': 'Internal server error',
@@ -289,6 +334,7 @@ def verify_pro_status():
                 user_info = cursor.fetchone()
                 
                 if not user_info:
+                    log.info('verify_pro', user_email=user_email, is_pro=False)
                     return jsonify({
                         'success': True,
                         'data': {
@@ -308,13 +354,9 @@ def verify_pro_status():
                     is_expired = True
                     is_pro = False
                 
-                # 更新最后登录时间
-                cursor.execute("""
-                    UPDATE user_pro_status 
-                    SET last_login = %s 
-                    WHERE user_email = %s
-                """, (datetime.datetime.now(), user_email))
-                connection.commit()
+                # 更新最后登录时间（写回缓冲，定期批量写入）
+                last_login_buffer.record(user_email, datetime.datetime.now())
+                log.info('verify_pro', user_email=user_email, is_pro=bool(is_pro and not is_expired))
                 
                 return jsonify({
                     'success': True,
@@ -335,8 +377,8 @@ def verify_pro_status():
         finally:
             connection.close()
             
-    except Exception as e:
-        logger.error(f"验证Pro状态错误: {e}")
+    except Exception:
+        log.exception('verify_pro_error')
         return jsonify({
             'success': False,
             'error': 'Internal server error',
@@ -409,8 +451,8 @@ def get_user_stats():
         finally:
             connection.close()
             
-    except Exception as e:
-        logger.error(f"获取用户统计错误: {e}")
+    except Exception:
+        log.exception('user_stats_error')
         return jsonify({
             'success': False,
             'error': 'Internal server error',
@@ -492,6 +534,7 @@ def revoke_pro_status():
                           request.headers.get('User-Agent', ''), reason, datetime.datetime.now()))
                 
                 connection.commit()
+                log.info('pro_status_revoked', user_email=user_email, reason=reason)
                 
                 return jsonify({
                     'success': True,
@@ -506,8 +549,8 @@ def revoke_pro_status():
         finally:
             connection.close()
             
-    except Exception as e:
-        logger.error(f"撤销Pro状态错误: {e}")
+    except Exception:
+        log.exception('revoke_error')
         return jsonify({
             'success': False,
             'error': 'Internal server error',
@@ -16,10 +16,16 @@ import uuid
 import os
 from functools import wraps
 from statistics_report import ActivationStatistics
+from query_profiler import mysql_cursor_class, profiler_bp
+from code_generator import generate_activation_code, require_signing_keys
 
 app = Flask(__name__)
 app.secret_key = 'mozibang-admin-secret-key-2024'  # 生产环境应使用环境变量
 CORS(app)
+app.register_blueprint(profiler_bp)
+
+# 激活码校验位只用专用的签名密钥，未配置时拒绝启动
+require_signing_keys()
 
 # 添加moment模板过滤器和全局函数
 @app.template_filter('moment')
@@ -48,6 +54,10 @@ DB_CONFIG = {
     'charset': 'utf8mb4'
 }
 
+# 带计时的游标（慢查询记录到 query_profiler）
+ProfiledCursor = mysql_cursor_class()
+ProfiledDictCursor = mysql_cursor_class(pymysql.cursors.DictCursor)
+
 # 管理员账号配置（简单实现，生产环境应使用数据库）
 ADMIN_USERS = {
     'admin': 'admin123',  # 用户名: 密码
@@ -56,7 +66,7 @@ ADMIN_USERS = {
 
 def get_db_connection():
     """获取数据库连接"""
-    return pymysql.connect(**DB_CONFIG)
+    return pymysql.connect(**DB_CONFIG, cursorclass=ProfiledCursor)
 
 def login_required(f):
     """登录验证装饰器"""
@@ -67,13 +77,6 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def generate_activation_code():
-    """生成激活码"""
-    # 生成格式: MOZIBANG-PRO-XXXX-XXXX
-    part1 = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(4))
-    part2 = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(4))
-    return f"MOZIBANG-PRO-{part1}-{part2}"
-
 def generate_batch_id():
     """生成批次ID"""
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
@@ -86,7 +89,7 @@ def dashboard():
     """管理后台首页"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        cursor = conn.cursor(ProfiledDictCursor)
         
         # 获取统计数据
         stats = {}
@@ -156,7 +159,7 @@ def codes_list():
     
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        cursor = conn.cursor(ProfiledDictCursor)
         
         # 获取激活码列表
         cursor.execute("""
@@ -217,7 +220,7 @@ def generate_codes():
             # 生成激活码
             generated_codes = []
             for i in range(count):
-                code = generate_activation_code()
+                code = generate_activation_code(code_type)
                 cursor.execute("""
                     INSERT INTO activation_codes (code, code_type, batch_id, notes)
                     VALUES (%s, %s, %s, %s)
@@ -245,7 +248,7 @@ def users_list():
     """Pro用户列表页面"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        cursor = conn.cursor(ProfiledDictCursor)
         
         cursor.execute("""
             SELECT ups.*, ac.code as activation_code_used
@@ -301,7 +304,7 @@ def api_statistics():
     """获取统计数据API"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        cursor = conn.cursor(ProfiledDictCursor)
         
         # 按日期统计激活数量（最近30天）
         cursor.execute("""
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - ASGI 入口
+把 sqlite_activation_api 的 Flask 应用挂到 ASGI 事件循环上，接口和响应格式完全相同：
+- 请求体在事件循环里异步读完再交给线程池，慢速上传的客户端不占用线程；
+- 视图函数（SQLite 访问）在固定大小的线程池中执行，默认与连接池大小一致，不会排队等连接；
+- 小响应在同一次线程调用中读完直接发送，流式响应（导出等）逐块在线程池中生成；
+- 排队请求超过 ASGI_MAX_PENDING 时直接返回 503，避免过载时无限堆积。
+
+运行（依赖见 requirements-asgi.txt）:
+    uvicorn asgi_app:app --host 0.0.0.0 --port $PORT
+    gunicorn asgi_app:app -k uvicorn.workers.UvicornWorker -w 4 --bind 0.0.0.0:$PORT
+"""
+
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import registry
+from sqlite_pool import POOL_MAX_SIZE
+
+# 执行视图函数的线程数（默认等于SQLite连接池大小）
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', POOL_MAX_SIZE))
+# 允许同时等待线程的请求数，超过后返回503（0 表示不限制）
+ASGI_MAX_PENDING = int(os.environ.get('ASGI_MAX_PENDING', 1000))
+# 请求体上限（字节）
+ASGI_MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES', 10 * 1024 * 1024))
+# 首次调用中最多缓冲的响应字节数，超过后改为逐块发送
+RESPONSE_BUFFER_BYTES = 64 * 1024
+
+
+def _error_response(status, message, error_code):
+    body = json.dumps({'success': False, 'message': message, 'error_code': error_code},
+                      separators=(',', ':'), sort_keys=True).encode()
+    return status, [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())], body
+
+
+class ASGIBridge:
+    """在线程池中运行 WSGI 应用的 ASGI 应用"""
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS, max_pending=ASGI_MAX_PENDING,
+                 max_body_bytes=ASGI_MAX_BODY_BYTES):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.max_pending = max_pending
+        self.max_body_bytes = max_body_bytes
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._busy = 0
+        self._requests = 0
+        self._rejected = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self._handle_http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._handle_lifespan(receive, send)
+        elif scope['type'] == 'websocket':
+            # 不提供 WebSocket：握手阶段直接关闭，服务器向客户端返回 403
+            await receive()
+            await send({'type': 'websocket.close', 'code': 1000})
+        else:
+            raise NotImplementedError(f"unsupported ASGI scope type: {scope['type']}")
+
+    async def _handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # 等待仍在执行的视图完成；写回缓冲和日志队列由各自的 atexit 刷新
+                await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        """读完请求体；客户端断开返回 None，超过上限返回 False"""
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.max_body_bytes:
+                return False
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+
+    async def _handle_http(self, scope, receive, send):
+        body = await self._read_body(receive)
+        if body is None:
+            return
+        if body is False:
+            await self._send_complete(send, *_error_response(
+                413, f'Request body too large (max {self.max_body_bytes} bytes)', 'REQUEST_TOO_LARGE'))
+            return
+
+        with self._lock:
+            if self.max_pending and self._pending >= self.max_pending:
+                self._rejected += 1
+                rejected = True
+            else:
+                self._pending += 1
+                self._requests += 1
+                rejected = False
+        if rejected:
+            await self._send_complete(send, *_error_response(503, 'Server busy, please retry', 'SERVER_BUSY'))
+            return
+
+        loop = asyncio.get_running_loop()
+        environ = self._build_environ(scope, body)
+        try:
+            status, headers, chunks, iterator = await loop.run_in_executor(self.executor, self._run_wsgi, environ)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        if iterator is None:
+            await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+            return
+        # 流式响应：已缓冲的部分先发出，其余逐块在线程池中生成
+        try:
+            for chunk in chunks:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterator, 'close'):
+                await loop.run_in_executor(self.executor, iterator.close)
+
+    async def _send_complete(self, send, status, headers, body):
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def _build_environ(self, scope, body):
+        root_path = scope.get('root_path', '')
+        path = scope['path']
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client')
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+            'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]) if server[1] is not None else '80',
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0] if client else '',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for raw_name, raw_value in scope['headers']:
+            name = raw_name.decode('latin-1').upper().replace('-', '_')
+            value = raw_value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+                continue
+            if name == 'CONTENT_LENGTH':
+                continue
+            key = f'HTTP_{name}'
+            if key in environ:
+                value = environ[key] + ('; ' if name == 'COOKIE' else ',') + value
+            environ[key] = value
+        return environ
+
+    def _run_wsgi(self, environ):
+        """
+        在线程池中调用 WSGI 应用，返回 (状态码, 响应头, 已读出的块, 剩余迭代器或None)
+        """
+        with self._lock:
+            self._busy += 1
+        try:
+            response = {}
+            written = []
+
+            def start_response(status, headers, exc_info=None):
+                if exc_info and response:
+                    raise exc_info[1].with_traceback(exc_info[2])
+                response['status'] = int(status.split(' ', 1)[0])
+                response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+                return written.append
+
+            result = self.wsgi_app(environ, start_response)
+            chunks = written
+            size = sum(len(chunk) for chunk in chunks)
+            iterator = iter(result)
+            for chunk in iterator:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > RESPONSE_BUFFER_BYTES:
+                    return response['status'], response['headers'], chunks, _ClosingIterator(iterator, result)
+            if hasattr(result, 'close'):
+                result.close()
+            return response['status'], response['headers'], chunks, None
+        finally:
+            with self._lock:
+                self._busy -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'threads': self.threads,
+                'busy': self._busy,
+                'pending': self._pending,
+                'requests': self._requests,
+                'rejected': self._rejected,
+            }
+
+
+class _ClosingIterator:
+    """继续迭代流式响应，结束时调用原始可迭代对象的 close()"""
+
+    def __init__(self, iterator, result):
+        self._iterator = iterator
+        self._result = result
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def close(self):
+        if hasattr(self._result, 'close'):
+            self._result.close()
+
+
+def _asgi_collector(bridge):
+    def collect():
+        stats = bridge.stats()
+        yield ('mozibang_asgi_threads', 'gauge', 'Worker threads running views', [((), stats['threads'])])
+        yield ('mozibang_asgi_threads_busy', 'gauge', 'Threads currently running a view', [((), stats['busy'])])
+        yield ('mozibang_asgi_pending', 'gauge', 'Requests dispatched or waiting for a thread',
+               [((), stats['pending'])])
+        yield ('mozibang_asgi_rejected_total', 'counter', 'Requests rejected with 503 because too many were pending',
+               [((), stats['rejected'])])
+    return collect
+
+
+def create_asgi_app(wsgi_app, **kwargs):
+    bridge = ASGIBridge(wsgi_app, **kwargs)
+    registry.add_collector(_asgi_collector(bridge))
+    return bridge
+
+
+from sqlite_activation_api import app as flask_app  # noqa: E402
+
+app = create_asgi_app(flask_app)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5001)))
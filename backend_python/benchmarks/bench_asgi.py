@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ASGI 压测入口，BENCH_DB_PATH 指向已准备好的基准测试数据库
+    BENCH_DB_PATH=/tmp/bench.db gunicorn --pythonpath benchmarks,. -k uvicorn.workers.UvicornWorker bench_asgi:app
+"""
+
+import importlib
+import os
+
+from common import load_api
+
+load_api(os.environ['BENCH_DB_PATH'])
+
+# asgi_app 包装 load_api 已指向基准数据库的 Flask 应用，必须在其之后导入
+app = importlib.import_module('asgi_app').app
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+连接池基准测试：对比每次请求新建连接与进程内连接池下 /api/verify_pro 的吞吐量
+
+用法（在 backend_python 目录下）:
+    python benchmarks/bench_connection_pool.py --requests 5000 --concurrency 4
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import API_HEADERS, bench_email, prepare_database, print_result, run_load
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite连接池基准测试')
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--json', dest='json_path', help='结果写入JSON文件')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='mozibang_bench_')
+    db_path = os.path.join(tmpdir, 'bench.db')
+    api = prepare_database(db_path, users=args.users)
+    client = api.app.test_client()
+
+    def verify(i):
+        email = bench_email(random.randrange(args.users))
+        resp = client.post('/api/verify_pro', headers=API_HEADERS, data=json.dumps({'user_email': email}))
+        return resp.status_code == 200
+
+    pooled_get_db_connection = api.get_db_connection
+
+    def unpooled_get_db_connection():
+        conn = sqlite3.connect(api.DB_PATH)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    print(f"📊 /api/verify_pro 基准测试: {args.requests} 次请求, 并发 {args.concurrency}")
+
+    api.get_db_connection = unpooled_get_db_connection
+    before = run_load(verify, args.requests, args.concurrency)
+    print_result('每次请求新建连接', before)
+
+    api.get_db_connection = pooled_get_db_connection
+    after = run_load(verify, args.requests, args.concurrency)
+    print_result('进程内连接池', after)
+
+    speedup = round(after['requests_per_sec'] / before['requests_per_sec'], 2) if before['requests_per_sec'] else None
+    print(f"  提升: {speedup}x")
+
+    results = {
+        'benchmark': 'connection_pool',
+        'unpooled': before,
+        'pooled': after,
+        'speedup': speedup,
+        'pool_stats': api.get_pool(db_path).stats(),
+    }
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ 结果已写入: {args.json_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+激活API压测：准备大规模SQLite数据库后，按不同并发度压测各接口，
+输出吞吐量和 p50/p95/p99 延迟，--json 写出机器可读结果用于回归对比。
+
+驱动方式（--mode 可逗号分隔多个，结束时并排对比）：
+    testclient  进程内 Flask test client（不含网络和WSGI服务器开销）
+    gunicorn    启动 gunicorn 同步 worker（与 Procfile 的部署方式相同），通过 HTTP 请求
+    asgi        启动 gunicorn + uvicorn worker 运行 asgi_app，通过 HTTP 请求
+
+--slow-clients N 在压测期间保持 N 个慢速上传请求体的连接，模拟弱网客户端占用 worker 的情况。
+
+用法（在 backend_python 目录下）:
+    python benchmarks/bench_load.py --codes 1000000 --users 200000 --requests 2000 --concurrency 1,8,32
+    python benchmarks/bench_load.py --mode gunicorn --workers 4 --scenarios verify_pro,check --json result.json
+    python benchmarks/bench_load.py --mode gunicorn,asgi --scenarios verify_pro --slow-clients 8
+    python benchmarks/bench_load.py --db /tmp/bench.db --reuse   # 复用已准备好的数据库
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# 压测时不输出每个请求的访问日志
+os.environ.setdefault('LOG_ACCESS', '0')
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+from common import (
+    API_HEADERS, BACKEND_DIR, bench_code, bench_email, load_api, print_result, run_load, seed_database
+)
+
+ADMIN_LOGIN = {'username': 'admin', 'password': 'admin123'}
+
+# 场景：方法、路径、请求体生成函数、是否需要管理员登录
+SCENARIOS = {
+    'activate': ('POST', '/api/activate', 'activate_body', False),
+    'check': ('POST', '/api/check', 'check_body', False),
+    'verify_pro': ('POST', '/api/verify_pro', 'verify_body', False),
+    'stats': ('GET', '/api/stats', None, False),
+    'admin_codes': ('GET', '/admin/codes', None, True),
+    'admin_users': ('GET', '/admin/users', None, True),
+}
+DEFAULT_SCENARIOS = 'activate,check,verify_pro,stats,admin_codes,admin_users'
+MODES = ('testclient', 'gunicorn', 'asgi')
+
+
+class Workload:
+    """根据数据规模生成请求体；activate 每次消耗一个未使用的激活码"""
+
+    def __init__(self, codes, users, first_unused=None):
+        self.codes = codes
+        self.users = users
+        self._next_unused = users if first_unused is None else first_unused
+        self._lock = threading.Lock()
+
+    def unused_remaining(self):
+        with self._lock:
+            return self.codes - self._next_unused
+
+    def activate_body(self, i):
+        with self._lock:
+            n = self._next_unused
+            self._next_unused += 1
+        return {'activation_code': bench_code(n), 'user_email': f'load_{n}@example.com'}
+
+    def check_body(self, i):
+        return {'code': bench_code(random.randrange(self.codes))}
+
+    def verify_body(self, i):
+        # 九成已存在的用户，一成不存在的邮箱
+        if random.random() < 0.9:
+            return {'user_email': bench_email(random.randrange(self.users))}
+        return {'user_email': f'missing_{random.randrange(10 ** 9)}@example.com'}
+
+
+def _ok(status, admin):
+    # 404（激活码不存在）和业务上的 4xx 拒绝也是正常响应，只把5xx和连接失败算作错误；
+    # 管理页面被重定向到登录页说明会话无效，同样算错误
+    if admin and 300 <= status < 400:
+        return False
+    return status < 500
+
+
+def make_testclient_driver(api):
+    """进程内驱动：每个线程一个 test client，需要登录的场景直接写入会话"""
+    local = threading.local()
+
+    def client(admin):
+        attr = 'admin_client' if admin else 'client'
+        c = getattr(local, attr, None)
+        if c is None:
+            c = api.app.test_client()
+            if admin:
+                with c.session_transaction() as sess:
+                    sess['admin_user'] = ADMIN_LOGIN['username']
+            setattr(local, attr, c)
+        return c
+
+    def request(method, path, body, admin):
+        resp = client(admin).open(path, method=method, headers=API_HEADERS,
+                                  data=json.dumps(body) if body is not None else None)
+        return resp.status_code
+
+    return request
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, db_path, workers, threads, port, asgi_threads=None):
+    """启动 gunicorn（同步 worker 或 uvicorn worker）并等待 /api/health 可用，返回进程对象"""
+    env = dict(os.environ, BENCH_DB_PATH=db_path, JOB_RUNNER_IN_WEB='0')
+    cmd = [
+        sys.executable, '-m', 'gunicorn',
+        '--pythonpath', f'{BENCH_DIR},{BACKEND_DIR}',
+        '-w', str(workers),
+        '-b', f'127.0.0.1:{port}', '--log-level', 'warning',
+    ]
+    if mode == 'asgi':
+        if asgi_threads:
+            env['ASGI_THREADS'] = str(asgi_threads)
+        cmd += ['-k', 'uvicorn.workers.UvicornWorker', 'bench_asgi:app']
+    else:
+        cmd += ['--threads', str(threads), 'bench_wsgi:app']
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with code {proc.returncode}')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/health')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f'{mode} server did not become ready within 30s')
+
+
+def _admin_cookie(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    body = '&'.join(f'{k}={v}' for k, v in ADMIN_LOGIN.items())
+    conn.request('POST', '/admin/login', body=body,
+                 headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    resp = conn.getresponse()
+    resp.read()
+    cookie = resp.getheader('Set-Cookie', '')
+    conn.close()
+    if not cookie:
+        raise RuntimeError('admin login failed')
+    return cookie.split(';', 1)[0]
+
+
+def make_http_driver(port):
+    """HTTP驱动：每个线程一个长连接（sync worker 会关闭连接，http.client 自动重连）"""
+    local = threading.local()
+    cookie = _admin_cookie(port)
+
+    def request(method, path, body, admin):
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        headers = dict(API_HEADERS)
+        if admin:
+            headers['Cookie'] = cookie
+        try:
+            conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            return resp.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            local.conn = None
+            raise
+
+    return request
+
+
+class SlowClients:
+    """
+    保持 N 个连接，每个连接按 interval 逐字节发送 verify_pro 的请求体，发完后重新开始；
+    同步 worker 在读请求体期间被整个占住，ASGI 服务器只占用事件循环上的一个协程
+    """
+
+    def __init__(self, port, count, interval=0.05, body_bytes=64):
+        self.port = port
+        self.count = count
+        self.interval = interval
+        self.body_bytes = body_bytes
+        self.completed = 0
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _request_bytes(self, n):
+        body = json.dumps({'user_email': f'slow_{n}@example.com'}).ljust(self.body_bytes).encode()
+        head = (f'POST /api/verify_pro HTTP/1.1\r\nHost: 127.0.0.1\r\n'
+                f'X-API-Key: {API_HEADERS["X-API-Key"]}\r\nContent-Type: application/json\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n').encode()
+        return head, body
+
+    def _run(self, n):
+        while not self._stop.is_set():
+            head, body = self._request_bytes(n)
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=60) as sock:
+                    sock.sendall(head)
+                    for i in range(len(body)):
+                        if self._stop.wait(self.interval):
+                            return
+                        sock.sendall(body[i:i + 1])
+                    while sock.recv(65536):
+                        pass
+                self.completed += 1
+            except OSError:
+                self._stop.wait(self.interval)
+
+    def __enter__(self):
+        for n in range(self.count):
+            t = threading.Thread(target=self._run, args=(n,), daemon=True)
+            t.start()
+            self._threads.append(t)
+        # 等所有慢连接都已建立并开始发送
+        time.sleep(min(1.0, self.interval * 3))
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        for t in self._threads:
+            t.join(5)
+
+
+def run_scenarios(mode, request, workload, scenarios, concurrencies, total):
+    results = []
+    for name in scenarios:
+        method, path, body_name, admin = SCENARIOS[name]
+        body_fn = getattr(workload, body_name) if body_name else None
+        for concurrency in concurrencies:
+            requests = total
+            if name == 'activate':
+                requests = min(total, workload.unused_remaining())
+                if requests <= 0:
+                    print(f"  ⚠️ 未使用的激活码已耗尽，跳过 activate (c={concurrency})")
+                    continue
+
+            def fire(i):
+                return _ok(request(method, path, body_fn(i) if body_fn else None, admin), admin)
+
+            # 预热，避免把建连和首次编译计入结果（activate 会消耗激活码，不预热）
+            if name != 'activate':
+                for i in range(min(20, requests)):
+                    fire(i)
+            result = run_load(fire, requests, concurrency)
+            result.update({'mode': mode, 'scenario': name, 'method': method, 'path': path})
+            print_result(f'{mode}/{name} c={concurrency}', result)
+            results.append(result)
+    return results
+
+
+def print_comparison(results, modes):
+    """多个驱动方式时按场景和并发度并排输出吞吐量和 p99"""
+    rows = {}
+    for r in results:
+        rows.setdefault((r['scenario'], r['concurrency']), {})[r['mode']] = r
+    print("\n📊 对比 (req/s / p99 ms)")
+    print('  ' + f"{'scenario':<14}{'c':>5}" + ''.join(f"{m:>24}" for m in modes))
+    for (scenario, concurrency), by_mode in rows.items():
+        cells = []
+        for m in modes:
+            r = by_mode.get(m)
+            cells.append(f"{r['requests_per_sec']:>12} / {r['p99_ms']:>8}" if r else f"{'-':>23}")
+        print('  ' + f"{scenario:<14}{concurrency:>5}" + ''.join(f" {c:>23}" for c in cells))
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _dataset_size(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        codes = conn.execute('SELECT COUNT(*) FROM activation_codes').fetchone()[0]
+        users = conn.execute('SELECT COUNT(*) FROM pro_users').fetchone()[0]
+    finally:
+        conn.close()
+    return codes, users
+
+
+def main():
+    parser = argparse.ArgumentParser(description='激活API压测')
+    parser.add_argument('--codes', type=int, default=100000, help='激活码数量')
+    parser.add_argument('--users', type=int, default=20000, help='Pro用户数量（同时是已使用的激活码数）')
+    parser.add_argument('--db', help='数据库路径（默认临时目录）')
+    parser.add_argument('--reuse', action='store_true', help='数据库已存在时不重新写入数据')
+    parser.add_argument('--mode', default='testclient',
+                        help='逗号分隔: testclient,gunicorn,asgi（both = testclient,gunicorn）')
+    parser.add_argument('--scenarios', default=DEFAULT_SCENARIOS, help='逗号分隔: ' + ','.join(SCENARIOS))
+    parser.add_argument('--concurrency', default='1,4,16', help='逗号分隔的并发线程数')
+    parser.add_argument('--requests', type=int, default=1000, help='每个场景、每个并发度的请求数')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker 数')
+    parser.add_argument('--threads', type=int, default=1, help='每个 gunicorn 同步 worker 的线程数')
+    parser.add_argument('--asgi-threads', type=int, help='每个 ASGI worker 的视图线程数（默认 ASGI_THREADS）')
+    parser.add_argument('--slow-clients', type=int, default=0, help='HTTP 模式下同时保持的慢速客户端数')
+    parser.add_argument('--slow-interval', type=float, default=0.05, help='慢速客户端每发送一个字节的间隔（秒）')
+    parser.add_argument('--json', dest='json_path', help='结果写入JSON文件')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(unknown)}')
+    concurrencies = [int(c) for c in args.concurrency.split(',')]
+    modes = []
+    for name in args.mode.split(','):
+        for m in (('testclient', 'gunicorn') if name.strip() == 'both' else (name.strip(),)):
+            if m not in MODES:
+                parser.error(f'unknown mode: {m}')
+            if m not in modes:
+                modes.append(m)
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='mozibang_bench_'), 'bench.db')
+    if args.reuse and os.path.exists(db_path):
+        api = load_api(db_path)
+        codes, users = _dataset_size(db_path)
+        print(f"📁 复用数据库 {db_path}: {codes} 个激活码, {users} 个Pro用户")
+    else:
+        started = time.perf_counter()
+        api = seed_database(db_path, codes=args.codes, users=args.users)
+        codes, users = args.codes, args.users
+        print(f"📁 已写入 {codes} 个激活码, {users} 个Pro用户 ({time.perf_counter() - started:.1f}s): {db_path}")
+
+    # 激活码从第一个未使用的序号开始分配；复用数据库时跳过已被之前的压测消耗的部分
+    conn = sqlite3.connect(db_path)
+    consumed = conn.execute(
+        "SELECT COUNT(*) FROM activation_codes WHERE batch_name = 'bench' AND is_used = 1"
+    ).fetchone()[0]
+    conn.close()
+    workload = Workload(codes, users, first_unused=max(users, consumed))
+
+    results = []
+    for mode in modes:
+        if mode == 'testclient':
+            print("🚀 进程内 test client")
+            results += run_scenarios(mode, make_testclient_driver(api), workload,
+                                     scenarios, concurrencies, args.requests)
+            continue
+        port = _free_port()
+        if mode == 'asgi':
+            print(f"🚀 asgi: {args.workers} uvicorn workers, 端口 {port}")
+        else:
+            print(f"🚀 gunicorn: {args.workers} workers x {args.threads} threads, 端口 {port}")
+        proc = start_server(mode, db_path, args.workers, args.threads, port, args.asgi_threads)
+        try:
+            request = make_http_driver(port)
+            if args.slow_clients:
+                with SlowClients(port, args.slow_clients, args.slow_interval) as slow:
+                    results += run_scenarios(mode, request, workload, scenarios, concurrencies, args.requests)
+                print(f"  慢速客户端完成请求: {slow.completed}")
+            else:
+                results += run_scenarios(mode, request, workload, scenarios, concurrencies, args.requests)
+        finally:
+            proc.terminate()
+            proc.wait(10)
+    if len(modes) > 1:
+        print_comparison(results, modes)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'benchmark': 'load',
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'git_commit': _git_commit(),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'dataset': {'codes': codes, 'users': users},
+                'config': {
+                    'modes': modes,
+                    'requests': args.requests,
+                    'concurrency': concurrencies,
+                    'workers': args.workers,
+                    'threads': args.threads,
+                    'asgi_threads': args.asgi_threads,
+                    'slow_clients': args.slow_clients,
+                    'slow_interval': args.slow_interval,
+                },
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"✅ 结果已写入: {args.json_path}")
+
+
+if __name__ == '__main__':
+    main()
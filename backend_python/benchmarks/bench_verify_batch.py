@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量验证基准测试：逐个调用 /api/verify_pro 与一次 /api/verify_pro/batch 的耗时对比
+
+用法（在 backend_python 目录下）:
+    python benchmarks/bench_verify_batch.py --emails 2000 --users 10000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import API_HEADERS, bench_email, prepare_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量验证基准测试')
+    parser.add_argument('--emails', type=int, default=2000, help='每轮验证的邮箱数')
+    parser.add_argument('--users', type=int, default=10000, help='数据库中的Pro用户数')
+    parser.add_argument('--json', dest='json_path', help='结果写入JSON文件')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='mozibang_bench_')
+    db_path = os.path.join(tmpdir, 'bench.db')
+    api = prepare_database(db_path, users=args.users)
+    client = api.app.test_client()
+
+    # 一半存在的用户，一半不存在的邮箱
+    emails = [bench_email(random.randrange(args.users)) for _ in range(args.emails // 2)]
+    emails += [f'missing_{i}@example.com' for i in range(args.emails - len(emails))]
+    random.shuffle(emails)
+
+    print(f"📊 验证 {len(emails)} 个邮箱")
+
+    api.pro_status_cache.clear()
+    started = time.perf_counter()
+    for email in emails:
+        client.post('/api/verify_pro', headers=API_HEADERS, data=json.dumps({'user_email': email}))
+    loop_elapsed = time.perf_counter() - started
+    print(f"  逐个调用 /api/verify_pro:     {loop_elapsed * 1000:10.1f} ms")
+
+    api.pro_status_cache.clear()
+    started = time.perf_counter()
+    resp = client.post('/api/verify_pro/batch', headers=API_HEADERS, data=json.dumps({'user_emails': emails}))
+    batch_elapsed = time.perf_counter() - started
+    print(f"  一次 /api/verify_pro/batch:  {batch_elapsed * 1000:10.1f} ms  (HTTP {resp.status_code})")
+
+    speedup = round(loop_elapsed / batch_elapsed, 1) if batch_elapsed else None
+    print(f"  提升: {speedup}x")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'benchmark': 'verify_batch',
+                'emails': len(emails),
+                'loop_ms': round(loop_elapsed * 1000, 3),
+                'batch_ms': round(batch_elapsed * 1000, 3),
+                'speedup': speedup,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"✅ 结果已写入: {args.json_path}")
+
+
+if __name__ == '__main__':
+    main()
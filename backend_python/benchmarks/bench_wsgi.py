@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+gunicorn 压测入口，BENCH_DB_PATH 指向已准备好的基准测试数据库
+    BENCH_DB_PATH=/tmp/bench.db gunicorn --pythonpath benchmarks,. bench_wsgi:app
+"""
+
+import os
+
+from common import load_api
+
+app = load_api(os.environ['BENCH_DB_PATH']).app
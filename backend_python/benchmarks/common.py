@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试公共工具
+负责准备临时SQLite数据库、加载Flask应用以及统计吞吐量和延迟
+"""
+
+import os
+import sys
+import sqlite3
+import statistics
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# 压测流量都来自本机同一个IP，默认关闭兑换限流（需要时显式设置 RATE_LIMIT_ENABLED=1）
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+# 应用没有激活码签名密钥时拒绝启动，基准测试使用固定的测试密钥
+os.environ.setdefault('CODE_SIGNING_KEYS', '1:mozibang-benchmark-code-key')
+
+
+def _ensure_benchmark_signing_key():
+    """API 没有权益令牌私钥时拒绝启动；基准测试临时生成一个，写入环境变量供子进程共用"""
+    if os.environ.get('ENTITLEMENT_SIGNING_KEYS'):
+        return
+    import base64
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    der = ec.generate_private_key(ec.SECP256R1()).private_bytes(
+        serialization.Encoding.DER, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    os.environ['ENTITLEMENT_SIGNING_KEYS'] = 'bench:' + base64.urlsafe_b64encode(der).rstrip(b'=').decode('ascii')
+
+
+_ensure_benchmark_signing_key()
+
+API_KEY = os.environ.get('API_SECRET_KEY', 'mozibang_api_secret_2024')
+API_HEADERS = {'X-API-Key': API_KEY, 'Content-Type': 'application/json'}
+
+
+def load_api(db_path):
+    """加载 sqlite_activation_api 并指向基准测试数据库"""
+    import sqlite_activation_api
+    import auto_create_pro_users
+    import statistics_report
+
+    sqlite_activation_api.DB_PATH = db_path
+    auto_create_pro_users.DB_PATH = db_path
+    statistics_report.DB_PATH = db_path
+    return sqlite_activation_api
+
+
+def prepare_database(db_path, users=1000):
+    """创建表结构并写入 users 条活跃Pro用户"""
+    api = load_api(db_path)
+    api.init_database()
+
+    import auto_create_pro_users
+    auto_create_pro_users.create_pro_users_table()
+
+    conn = sqlite3.connect(db_path)
+    conn.executemany("""
+        INSERT OR IGNORE INTO users (email, token, pro_status, pro_activated_at, pro_expires_at, activation_code)
+        VALUES (?, ?, 'active', CURRENT_TIMESTAMP, NULL, ?)
+    """, [(bench_email(i), f'bench-token-{i}', f'BENCH-{i:08d}') for i in range(users)])
+    conn.commit()
+    conn.close()
+    return api
+
+
+def seed_database(db_path, codes=100000, users=20000, chunk_size=50000):
+    """
+    创建表结构并批量写入 codes 个激活码和 users 个Pro用户：
+    前 users 个激活码已被对应用户使用，其余未使用；users / pro_users 各一行
+    """
+    if users > codes:
+        raise ValueError('users must not exceed codes')
+    api = load_api(db_path)
+    api.init_database()
+
+    import auto_create_pro_users
+    auto_create_pro_users.create_pro_users_table()
+
+    code_types = ('pro_lifetime', 'pro_1year', 'pro_6month')
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA synchronous = OFF')
+    for start in range(0, codes, chunk_size):
+        stop = min(start + chunk_size, codes)
+        conn.executemany("""
+            INSERT OR IGNORE INTO activation_codes (code, code_type, batch_name, is_used, used_by, used_at)
+            VALUES (?, ?, 'bench', ?, ?, CASE WHEN ? THEN CURRENT_TIMESTAMP END)
+        """, [
+            (bench_code(i), code_types[i % 3], i < users, bench_email(i) if i < users else None, i < users)
+            for i in range(start, stop)
+        ])
+        conn.commit()
+    for start in range(0, users, chunk_size):
+        stop = min(start + chunk_size, users)
+        conn.executemany("""
+            INSERT OR IGNORE INTO users (email, token, pro_status, pro_activated_at, pro_expires_at, activation_code)
+            VALUES (?, ?, 'active', CURRENT_TIMESTAMP, NULL, ?)
+        """, [(bench_email(i), f'bench-token-{i}', bench_code(i)) for i in range(start, stop)])
+        conn.executemany("""
+            INSERT OR IGNORE INTO pro_users (user_email, pro_type, activation_code, expires_at, is_lifetime)
+            VALUES (?, ?, ?, CASE WHEN ? THEN NULL ELSE datetime('now', '+180 days') END, ?)
+        """, [
+            (bench_email(i), code_types[i % 3], bench_code(i), i % 3 == 0, i % 3 == 0)
+            for i in range(start, stop)
+        ])
+        conn.commit()
+    # pro_users 表在 init_database 之后才创建，补装它的计数触发器（与服务运行一段时间后的状态一致）
+    import stats_counters
+    stats_counters.ensure_schema(conn)
+    conn.execute('PRAGMA optimize')
+    conn.close()
+    return api
+
+
+def bench_email(i):
+    return f'bench_user_{i}@example.com'
+
+
+def bench_code(i):
+    """第 i 个基准测试激活码（16位，与正式激活码等长）"""
+    return f'BENCH{i:011d}'
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load(request_fn, total, concurrency=1):
+    """
+    以 concurrency 个线程共执行 total 次 request_fn(i)
+    返回吞吐量与延迟分位数（毫秒）
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        local = []
+        local_errors = 0
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            started = time.perf_counter()
+            try:
+                ok = request_fn(i)
+            except Exception:
+                ok = False
+            local.append((time.perf_counter() - started) * 1000)
+            if ok is False:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors.append(local_errors)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'concurrency': concurrency,
+        'errors': sum(errors),
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_sec': round(total / elapsed, 1) if elapsed else 0,
+        'mean_ms': round(statistics.mean(latencies), 3) if latencies else 0,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+    }
+
+
+def print_result(name, result):
+    print(f"  {name:<28} {result['requests_per_sec']:>10} req/s  "
+          f"p50 {result['p50_ms']:>8}ms  p95 {result['p95_ms']:>8}ms  "
+          f"p99 {result['p99_ms']:>8}ms  errors {result['errors']}")
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+激活码兑换并发压力测试：多个进程 x 多个线程同时兑换同一批激活码，验证每个激活码恰好被兑换一次。
+
+两组竞争：
+    同码竞争   每个激活码被所有线程用不同邮箱同时兑换，只能有一个成功，其余为 INVALID_CODE
+    同用户竞争 每个邮箱同时兑换多个不同激活码，只能有一个成功，其余为 ALREADY_PRO_USER
+
+结束后检查数据库：成功响应与 activation_codes / users / pro_users 一一对应，
+统计计数与源表重新计算的结果一致，且没有 5xx（写锁重试耗尽）。有任何不一致时退出码为 1。
+
+用法（在 backend_python 目录下）:
+    python benchmarks/stress_redemption.py --processes 4 --threads 8 --codes 200 --users 100
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+os.environ.setdefault('LOG_ACCESS', '0')
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+from common import API_HEADERS, bench_code, load_api, seed_database
+
+
+def _contested_code_requests(worker, codes):
+    # 同码竞争：所有线程按相同顺序兑换第 0..codes-1 个激活码
+    return [(i, bench_code(i), f'w{worker}_c{i}@example.com') for i in range(codes)]
+
+
+def _contested_user_requests(worker, codes, users, per_user):
+    # 同用户竞争：第 u 个邮箱可用的激活码为 codes + u*per_user 起的 per_user 个，每个线程取其中一个
+    requests = []
+    for u in range(users):
+        i = codes + u * per_user + worker % per_user
+        requests.append((i, bench_code(i), f'contested_{u}@example.com'))
+    return requests
+
+
+def run_worker(db_path, process_index, threads, codes, users, per_user, start_event, results):
+    """子进程：threads 个线程，每个线程用自己的 test client 依次发起兑换请求"""
+    import redemption
+
+    api = load_api(db_path)
+    outcomes = []
+    lock = threading.Lock()
+
+    def thread_main(thread_index):
+        worker = process_index * threads + thread_index
+        client = api.app.test_client()
+        plan = _contested_code_requests(worker, codes) + _contested_user_requests(worker, codes, users, per_user)
+        local = []
+        start_event.wait()
+        for i, code, email in plan:
+            resp = client.post('/api/activate', headers=API_HEADERS,
+                               data=json.dumps({'activation_code': code, 'user_email': email}))
+            body = resp.get_json(silent=True) or {}
+            local.append((i, email, resp.status_code, body.get('error_code')))
+        with lock:
+            outcomes.extend(local)
+
+    pool = [threading.Thread(target=thread_main, args=(t,)) for t in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put((outcomes, redemption.stats()))
+
+
+def verify(db_path, outcomes, codes, users, per_user):
+    """返回发现的问题列表"""
+    import stats_counters
+
+    problems = []
+    status_counts = Counter(status for _, _, status, _ in outcomes)
+    if any(status >= 500 for status in status_counts):
+        problems.append(f'server errors: {dict(status_counts)}')
+
+    winners = defaultdict(list)
+    for i, email, status, error_code in outcomes:
+        if status == 200:
+            winners[i].append(email)
+        elif error_code not in ('INVALID_CODE', 'ALREADY_PRO_USER'):
+            problems.append(f'unexpected response for code #{i}: {status} {error_code}')
+
+    conn = sqlite3.connect(db_path)
+    try:
+        for i in range(codes):
+            if len(winners.get(i, [])) != 1:
+                problems.append(f'code #{i} redeemed {len(winners.get(i, []))} times: {winners.get(i)}')
+        for u in range(users):
+            email = f'contested_{u}@example.com'
+            redeemed = [i for i in range(codes + u * per_user, codes + (u + 1) * per_user) if i in winners]
+            if len(redeemed) != 1:
+                problems.append(f'{email} redeemed {len(redeemed)} codes')
+
+        for i, emails in winners.items():
+            if len(emails) != 1:
+                continue
+            code = bench_code(i)
+            row = conn.execute("SELECT is_used, used_by FROM activation_codes WHERE code = ?", (code,)).fetchone()
+            if row != (1, emails[0]):
+                problems.append(f'activation_codes row for {code} is {row}, response winner {emails[0]}')
+            pro_rows = conn.execute("SELECT user_email FROM pro_users WHERE activation_code = ?", (code,)).fetchall()
+            if pro_rows != [(emails[0],)]:
+                problems.append(f'pro_users rows for {code}: {pro_rows}')
+            user_rows = conn.execute(
+                "SELECT email FROM users WHERE activation_code = ? AND pro_status = 'active'", (code,)
+            ).fetchall()
+            if user_rows != [(emails[0],)]:
+                problems.append(f'users rows for {code}: {user_rows}')
+
+        used = conn.execute("SELECT COUNT(*) FROM activation_codes WHERE is_used = 1").fetchone()[0]
+        if used != len(winners):
+            problems.append(f'{used} codes marked used, {len(winners)} successful responses')
+
+        # 触发器维护的计数应与源表重新计算的结果一致
+        def snapshot():
+            return set(conn.execute(
+                "SELECT scope, bucket, state, value FROM stats_counters WHERE value != 0"
+            ).fetchall())
+        before = snapshot()
+        stats_counters.rebuild(conn)
+        after = snapshot()
+        if before != after:
+            problems.append(f'stats_counters drifted: {sorted(before ^ after)}')
+    finally:
+        conn.close()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='激活码兑换并发压力测试')
+    parser.add_argument('--processes', type=int, default=4, help='进程数')
+    parser.add_argument('--threads', type=int, default=8, help='每个进程的线程数')
+    parser.add_argument('--codes', type=int, default=200, help='同码竞争的激活码数')
+    parser.add_argument('--users', type=int, default=100, help='同用户竞争的邮箱数')
+    parser.add_argument('--per-user', type=int, default=4, help='同用户竞争时每个邮箱争抢的激活码数')
+    parser.add_argument('--db', help='数据库路径（默认临时目录）')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='mozibang_stress_'), 'stress.db')
+    if os.path.exists(db_path):
+        parser.error(f'{db_path} already exists; the stress test needs a fresh database')
+    total_codes = args.codes + args.users * args.per_user
+    seed_database(db_path, codes=total_codes, users=0)
+    print(f"📁 {db_path}: {total_codes} 个未使用激活码")
+
+    ctx = multiprocessing.get_context('spawn')
+    start_event = ctx.Event()
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=run_worker, args=(db_path, p, args.threads, args.codes, args.users,
+                                             args.per_user, start_event, results))
+        for p in range(args.processes)
+    ]
+    for p in procs:
+        p.start()
+    # 等子进程完成导入和建连后同时开始
+    time.sleep(3)
+    started = time.perf_counter()
+    start_event.set()
+
+    outcomes = []
+    engine_stats = Counter()
+    for _ in procs:
+        worker_outcomes, worker_stats = results.get()
+        outcomes.extend(worker_outcomes)
+        engine_stats.update({k: v for k, v in worker_stats.items() if k != 'max_retries'})
+    elapsed = time.perf_counter() - started
+    for p in procs:
+        p.join()
+
+    print(f"🚀 {args.processes} 进程 x {args.threads} 线程, {len(outcomes)} 次兑换请求, "
+          f"{elapsed:.1f}s ({len(outcomes) / elapsed:.0f} req/s)")
+    print(f"  响应: {dict(Counter((s, e) for _, _, s, e in outcomes))}")
+    print(f"  兑换引擎: {dict(engine_stats)}")
+
+    problems = verify(db_path, outcomes, args.codes, args.users, args.per_user)
+    if problems:
+        print(f"❌ 发现 {len(problems)} 个问题:")
+        for problem in problems[:50]:
+            print(f"  - {problem}")
+        sys.exit(1)
+    print("✅ 每个激活码恰好兑换一次，每个用户恰好成功一次，统计计数一致")
+
+
+if __name__ == '__main__':
+    main()
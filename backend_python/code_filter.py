@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - 激活码存在性 Bloom 过滤器
+/api/check 和 /api/activate 先查内存中的 Bloom 过滤器，确定不存在的激活码直接拒绝，不再访问 SQLite。
+
+- 启动时在后台线程中加载持久化文件（校验通过时）或全表扫描构建，完成前所有查询都放行到数据库；
+- 本进程生成的激活码提交后立即加入（add_many），同时改写数据库旁的版本文件（<数据库>.codes-version），
+  未调用 configure() 的进程（管理后台、独立 worker）也按写入连接的数据库路径改写；
+- 其他进程（管理后台、后台任务、其他 worker）写入的激活码按 id 增量补入：未命中时只读一次版本文件
+  （不访问 SQLite），版本变化说明有新激活码，等待同步完成后再下结论；版本未变时直接拒绝，
+  另外最多每 CODE_FILTER_SYNC_INTERVAL 秒由一次未命中顺带补入没有通知的写入，
+  同步出错或该次同步正由其他线程执行时放行到数据库；
+- 在应用之外写入 activation_codes 的脚本提交后需调用 notify_codes_added(数据库路径)
+  （或改写版本文件的内容），否则新激活码最多要等一个同步间隔才能通过过滤器；
+- 删除的激活码留在过滤器中只会造成误判为"可能存在"，仍由数据库给出最终结果；
+- 元素数超过容量时在后台按两倍容量重建，期间继续使用旧过滤器。
+"""
+
+import atexit
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+
+from sqlite_bootstrap import connect
+from structured_logging import get_logger
+
+CODE_FILTER_ENABLED = os.environ.get('CODE_FILTER_ENABLED', '1') == '1'
+CODE_FILTER_FP_RATE = float(os.environ.get('CODE_FILTER_FP_RATE', 0.001))
+CODE_FILTER_MIN_CAPACITY = int(os.environ.get('CODE_FILTER_MIN_CAPACITY', 1000000))
+CODE_FILTER_SYNC_INTERVAL = float(os.environ.get('CODE_FILTER_SYNC_INTERVAL', 1))
+CODE_FILTER_SAVE_INTERVAL = float(os.environ.get('CODE_FILTER_SAVE_INTERVAL', 300))
+# 持久化文件路径，默认在数据库文件旁边（<数据库>.bloom）
+CODE_FILTER_PATH = os.environ.get('CODE_FILTER_PATH', '')
+
+_MAGIC = b'MZBF'
+_VERSION = 1
+# 魔数, 版本, 位数, 哈希函数个数, 元素数, 已包含的最大id, 最大id对应激活码的长度
+_HEADER = struct.Struct('<4sHQIQQH')
+
+log = get_logger('mozibang.code_filter')
+
+# 过滤器内容与版本文件对应不上（刚从持久化文件加载）时的版本标记
+_STALE = object()
+
+
+def _version_path(db_path):
+    return f'{db_path}.codes-version'
+
+
+def notify_codes_added(db_path):
+    """写入激活码的事务提交后调用：改写版本文件，各进程的过滤器在下一次未命中时同步"""
+    path = _version_path(db_path)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(os.urandom(8).hex())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log.warning('code_filter_notify_error', error=str(e))
+
+
+def database_path(conn):
+    """连接对应的主数据库文件路径（内存数据库为空字符串）"""
+    return conn.execute("PRAGMA database_list").fetchone()[2]
+
+
+class BloomFilter:
+    """按期望元素数和误判率确定位数和哈希函数个数，双重哈希生成各个位置"""
+
+    def __init__(self, capacity, fp_rate=CODE_FILTER_FP_RATE, num_bits=None, num_hashes=None, bits=None):
+        self.capacity = capacity
+        self.num_bits = num_bits or max(8, int(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.num_hashes = num_hashes or max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        m = self.num_bits
+        # 生成器：不存在的激活码通常在前一两个位置就能判定，不必算完所有位置
+        return ((h1 + i * h2) % m for i in range(self.num_hashes))
+
+    def add(self, item):
+        bits = self.bits
+        for pos in self._positions(item):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        for pos in self._positions(item):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class CodeFilter:
+    """
+    进程级激活码过滤器
+    might_contain() 返回 False 表示激活码一定不存在；未就绪、已禁用或出错时返回 True
+    """
+
+    def __init__(self, enabled=CODE_FILTER_ENABLED, sync_interval=CODE_FILTER_SYNC_INTERVAL):
+        self.enabled = enabled
+        self.sync_interval = sync_interval
+        self._db_path_getter = None
+        self._filter = None
+        self._high_water = 0
+        self._high_water_code = ''
+        # id <= _high_water 的行数（持久化文件的校验依据；add_many 加入的激活码不计入）
+        self._covered = 0
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        # 最近一次同步开始前读到的版本文件内容；此前通知过的激活码都已在过滤器中
+        self._synced_version = None
+        self._next_sync = 0.0
+        self._last_save = 0.0
+        self._dirty = False
+        self._started = False
+        self._building = False
+        self._metrics = {
+            'lookups': 0,
+            'rejected': 0,
+            'syncs': 0,
+            'synced_codes': 0,
+            'rebuilds': 0,
+            'loaded_from_disk': False,
+            'build_seconds': None,
+            'errors': 0,
+        }
+
+    def configure(self, db_path_getter):
+        """设置数据库路径的获取函数（延迟读取，测试和基准可以在导入后修改路径）"""
+        self._db_path_getter = db_path_getter
+
+    def _db_path(self):
+        return self._db_path_getter() if self._db_path_getter else None
+
+    def _file_path(self):
+        return CODE_FILTER_PATH or f'{self._db_path()}.bloom'
+
+    @property
+    def ready(self):
+        return self._filter is not None
+
+    def start(self):
+        """在后台线程中加载或构建过滤器（只启动一次，失败后保持放行）"""
+        if not self.enabled or self._db_path_getter is None or self._started:
+            return
+        self._started = True
+        self._building = True
+        threading.Thread(target=self._initialize, name='code-filter-build', daemon=True).start()
+
+    def _initialize(self):
+        try:
+            started = time.perf_counter()
+            conn = connect(self._db_path())
+            try:
+                if not self._load(conn):
+                    self._build(conn)
+            finally:
+                conn.close()
+            self._metrics['build_seconds'] = round(time.perf_counter() - started, 3)
+            log.info('code_filter_ready', codes=self._filter.count, num_bits=self._filter.num_bits,
+                     loaded_from_disk=self._metrics['loaded_from_disk'],
+                     seconds=self._metrics['build_seconds'])
+        except Exception as e:
+            self._count('errors')
+            log.error('code_filter_build_error', error=str(e))
+        finally:
+            self._building = False
+
+    def _build(self, conn, capacity=None):
+        """全表扫描构建新过滤器后替换旧的"""
+        if capacity is None:
+            total = conn.execute("SELECT COUNT(*) FROM activation_codes").fetchone()[0]
+            capacity = max(CODE_FILTER_MIN_CAPACITY, total * 2)
+        bloom = BloomFilter(capacity)
+        version = self._read_version()
+        high_water, high_water_code, covered = 0, '', 0
+        cursor = conn.execute("SELECT id, code FROM activation_codes ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            for _, code in rows:
+                bloom.add(code)
+            high_water, high_water_code = rows[-1]
+            covered += len(rows)
+        with self._write_lock:
+            # 构建期间其他线程增量补入的激活码由下一次同步（id > high_water）补齐
+            self._filter = bloom
+            self._high_water, self._high_water_code = high_water, high_water_code
+            self._covered = covered
+            self._synced_version = version
+            self._next_sync = time.monotonic() + self.sync_interval
+        self._count('rebuilds')
+        self.save()
+
+    def _load(self, conn):
+        """加载持久化文件；与数据库对不上（重建过数据库、删除过激活码等）时返回 False"""
+        path = self._file_path()
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return False
+            magic, version, num_bits, num_hashes, count, high_water, code_len = _HEADER.unpack(header)
+            if magic != _MAGIC or version != _VERSION:
+                return False
+            high_water_code = f.read(code_len).decode()
+            bits = bytearray(f.read())
+        if len(bits) != (num_bits + 7) // 8:
+            return False
+
+        # 校验：id <= high_water 的行数与记录一致，且该 id 仍是同一个激活码
+        row = conn.execute("SELECT code FROM activation_codes WHERE id = ?", (high_water,)).fetchone()
+        if high_water and (row is None or row[0] != high_water_code):
+            return False
+        existing = conn.execute("SELECT COUNT(*) FROM activation_codes WHERE id <= ?", (high_water,)).fetchone()[0]
+        if existing != count:
+            return False
+
+        capacity = max(1, round(num_bits * (math.log(2) ** 2) / -math.log(CODE_FILTER_FP_RATE)))
+        bloom = BloomFilter(capacity, num_bits=num_bits, num_hashes=num_hashes, bits=bits)
+        bloom.count = count
+        with self._write_lock:
+            self._filter = bloom
+            self._high_water, self._high_water_code = high_water, high_water_code
+            self._covered = count
+            # 文件保存之后其他进程写入的激活码在第一次未命中时补入
+            self._synced_version = _STALE
+        self._metrics['loaded_from_disk'] = True
+        self._last_save = time.monotonic()
+        return True
+
+    def save(self):
+        """原子写入持久化文件（先写临时文件再替换）"""
+        bloom = self._filter
+        if bloom is None or self._db_path_getter is None:
+            return
+        path = self._file_path()
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with self._write_lock:
+                code = self._high_water_code.encode()
+                header = _HEADER.pack(_MAGIC, _VERSION, bloom.num_bits, bloom.num_hashes,
+                                      self._covered, self._high_water, len(code))
+                data = bytes(bloom.bits)
+                self._dirty = False
+            with open(tmp_path, 'wb') as f:
+                f.write(header)
+                f.write(code)
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._last_save = time.monotonic()
+        except OSError as e:
+            self._count('errors')
+            log.warning('code_filter_save_error', error=str(e))
+
+    def add_many(self, codes, db_path=None):
+        """
+        本进程新生成的激活码（已提交）立即加入并通知其他进程；未就绪时由同步补齐
+        db_path 为写入的数据库，未给出时使用 configure() 设置的路径
+        """
+        db_path = db_path or self._db_path()
+        if db_path:
+            notify_codes_added(db_path)
+        if self._filter is None:
+            return
+        with self._write_lock:
+            for code in codes:
+                self._filter.add(code)
+            self._dirty = True
+
+    def sync(self, connection_factory):
+        """按 id 增量补入其他进程写入的激活码"""
+        conn = connection_factory()
+        try:
+            rows = conn.execute(
+                "SELECT id, code FROM activation_codes WHERE id > ? ORDER BY id", (self._high_water,)
+            ).fetchall()
+        finally:
+            conn.close()
+        self._count('syncs')
+        if rows:
+            with self._write_lock:
+                for _, code in rows:
+                    self._filter.add(code)
+                self._high_water, self._high_water_code = rows[-1]
+                self._covered += len(rows)
+                self._dirty = True
+            with self._metrics_lock:
+                self._metrics['synced_codes'] += len(rows)
+        bloom = self._filter
+        if bloom.count > bloom.capacity and not self._building:
+            self._building = True
+            threading.Thread(target=self._rebuild_larger, name='code-filter-rebuild', daemon=True).start()
+        elif self._dirty and time.monotonic() - self._last_save >= CODE_FILTER_SAVE_INTERVAL:
+            self.save()
+
+    def _rebuild_larger(self):
+        try:
+            conn = connect(self._db_path())
+            try:
+                self._build(conn, capacity=self._filter.count * 2)
+            finally:
+                conn.close()
+        except Exception as e:
+            self._count('errors')
+            log.error('code_filter_build_error', error=str(e))
+        finally:
+            self._building = False
+
+    def _read_version(self):
+        try:
+            with open(_version_path(self._db_path()), 'rb') as f:
+                return f.read(64)
+        except OSError:
+            return None
+
+    def _count(self, name):
+        with self._metrics_lock:
+            self._metrics[name] += 1
+
+    def _sync_checked(self, connection_factory):
+        """同步一次（调用方持有 _sync_lock），失败返回 False"""
+        self._next_sync = time.monotonic() + self.sync_interval
+        version = self._read_version()
+        try:
+            self.sync(connection_factory)
+        except Exception as e:
+            self._count('errors')
+            log.warning('code_filter_sync_error', error=str(e))
+            return False
+        self._synced_version = version
+        return True
+
+    def might_contain(self, code, connection_factory):
+        """
+        激活码是否可能存在；过滤器中没有时，只有版本文件变化（其他进程生成了激活码）
+        或到了同步间隔才访问数据库，同步失败时放行到数据库
+        """
+        bloom = self._filter
+        if bloom is None or not self.enabled:
+            # 第一次查询时才开始构建，此时数据库已经初始化
+            self.start()
+            return True
+        self._count('lookups')
+        if code in bloom:
+            return True
+        if self._read_version() != self._synced_version:
+            # 有新通知：等待同步完成再下结论，并发的未命中共用同一次同步
+            with self._sync_lock:
+                if self._read_version() != self._synced_version and not self._sync_checked(connection_factory):
+                    return True
+        elif time.monotonic() >= self._next_sync:
+            # 兜底：按间隔补入没有通知的写入；其他线程正在同步时不等待，放行到数据库
+            if not self._sync_lock.acquire(blocking=False):
+                return True
+            try:
+                if not self._sync_checked(connection_factory):
+                    return True
+            finally:
+                self._sync_lock.release()
+        if code in self._filter:
+            return True
+        self._count('rejected')
+        return False
+
+    def stats(self):
+        bloom = self._filter
+        with self._metrics_lock:
+            stats = dict(self._metrics)
+        stats.update(enabled=self.enabled, ready=bloom is not None, building=self._building,
+                     sync_interval=self.sync_interval)
+        if bloom is not None:
+            stats.update({
+                'codes': self._covered,
+                'inserted': bloom.count,
+                'capacity': bloom.capacity,
+                'num_bits': bloom.num_bits,
+                'num_hashes': bloom.num_hashes,
+                'memory_bytes': len(bloom.bits),
+                'high_water_id': self._high_water,
+                'estimated_fp_rate': round((1 - math.exp(-bloom.num_hashes * bloom.count / bloom.num_bits))
+                                           ** bloom.num_hashes, 6),
+            })
+        return stats
+
+
+# 进程级单例
+code_filter = CodeFilter()
+
+
+@atexit.register
+def _save_on_exit():
+    if code_filter._dirty:
+        code_filter.save()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - 每日汇总
+daily_rollup 表按 (日期, 激活码类型) 保存激活次数、当日激活用户数、撤销数和到期数，
+由 pro_users 上的触发器在写入事务内增量维护；趋势图只需读取几百行汇总数据。
+
+字段含义：
+    activations   当日发生的激活次数（新增或重新激活都计一次）
+    unique_users  当前激活时间落在当日的用户数（同一用户重新激活会从旧日期移到新日期）
+    revocations   当日撤销次数
+    expirations   到期时间落在当日的用户数
+
+触发器安装前的历史数据可回填（按当前 pro_users 行重建，历史上的重复激活无法还原）：
+    python daily_rollup.py backfill
+"""
+
+import os
+import sys
+
+_ready_paths = set()
+
+
+def _upsert_sql(day_expr, type_expr, condition, **deltas):
+    """生成按 (day, code_type) 累加的语句，condition 为假时不写入"""
+    columns = ['activations', 'unique_users', 'revocations', 'expirations']
+    values = ', '.join(str(deltas.get(column, 0)) for column in columns)
+    updates = ', '.join(f"{column} = {column} + ({deltas[column]})" for column in columns if column in deltas)
+    return f"""
+        INSERT INTO daily_rollup (day, code_type, {', '.join(columns)})
+        SELECT DATE({day_expr}), {type_expr}, {values}
+        WHERE {condition}
+        ON CONFLICT(day, code_type) DO UPDATE SET {updates};
+    """
+
+
+# pro_users 上的汇总触发器
+ROLLUP_TRIGGERS = {
+    'trg_rollup_pro_users_insert': f"""
+        AFTER INSERT ON pro_users
+        BEGIN
+            {_upsert_sql('NEW.activated_at', 'NEW.pro_type', 'NEW.activated_at IS NOT NULL',
+                         activations=1, unique_users=1)}
+            {_upsert_sql('NEW.expires_at', 'NEW.pro_type', 'NEW.expires_at IS NOT NULL', expirations=1)}
+        END
+    """,
+    'trg_rollup_pro_users_delete': f"""
+        AFTER DELETE ON pro_users
+        BEGIN
+            {_upsert_sql('OLD.activated_at', 'OLD.pro_type', 'OLD.activated_at IS NOT NULL', unique_users=-1)}
+            {_upsert_sql('OLD.expires_at', 'OLD.pro_type', 'OLD.expires_at IS NOT NULL', expirations=-1)}
+        END
+    """,
+    # 重新激活或升级：用户从旧日期/类型移到新日期/类型，激活时间变化时计一次激活
+    'trg_rollup_pro_users_activate': f"""
+        AFTER UPDATE OF activated_at, pro_type ON pro_users
+        WHEN OLD.activated_at IS NOT NEW.activated_at OR OLD.pro_type IS NOT NEW.pro_type
+        BEGIN
+            {_upsert_sql('OLD.activated_at', 'OLD.pro_type', 'OLD.activated_at IS NOT NULL', unique_users=-1)}
+            {_upsert_sql('NEW.activated_at', 'NEW.pro_type', 'NEW.activated_at IS NOT NULL',
+                         activations='(CASE WHEN OLD.activated_at IS NOT NEW.activated_at THEN 1 ELSE 0 END)',
+                         unique_users=1)}
+        END
+    """,
+    'trg_rollup_pro_users_expiry': f"""
+        AFTER UPDATE OF expires_at, pro_type ON pro_users
+        WHEN OLD.expires_at IS NOT NEW.expires_at OR OLD.pro_type IS NOT NEW.pro_type
+        BEGIN
+            {_upsert_sql('OLD.expires_at', 'OLD.pro_type', 'OLD.expires_at IS NOT NULL', expirations=-1)}
+            {_upsert_sql('NEW.expires_at', 'NEW.pro_type', 'NEW.expires_at IS NOT NULL', expirations=1)}
+        END
+    """,
+    'trg_rollup_pro_users_revoke': f"""
+        AFTER UPDATE OF is_active ON pro_users
+        WHEN OLD.is_active AND NOT NEW.is_active
+        BEGIN
+            {_upsert_sql("COALESCE(NEW.revoked_at, 'now')", 'NEW.pro_type', '1', revocations=1)}
+        END
+    """,
+}
+
+
+def _table_exists(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+
+def _trigger_exists(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def _backfill(conn):
+    conn.execute("DELETE FROM daily_rollup")
+    conn.execute("""
+        INSERT INTO daily_rollup (day, code_type, activations, unique_users)
+        SELECT DATE(activated_at), pro_type, COUNT(*), COUNT(*)
+        FROM pro_users
+        WHERE activated_at IS NOT NULL
+        GROUP BY 1, 2
+    """)
+    conn.execute("""
+        INSERT INTO daily_rollup (day, code_type, expirations)
+        SELECT DATE(expires_at), pro_type, COUNT(*)
+        FROM pro_users
+        WHERE expires_at IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT(day, code_type) DO UPDATE SET expirations = excluded.expirations
+    """)
+    conn.execute("""
+        INSERT INTO daily_rollup (day, code_type, revocations)
+        SELECT DATE(COALESCE(revoked_at, updated_at)), pro_type, COUNT(*)
+        FROM pro_users
+        WHERE NOT is_active AND COALESCE(revoked_at, updated_at) IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT(day, code_type) DO UPDATE SET revocations = excluded.revocations
+    """)
+
+
+def ensure_schema(conn, db_path=None):
+    """
+    创建汇总表；pro_users 存在且触发器尚未安装时安装触发器并回填一次。
+    init_database() 和借出连接时调用，触发器必须在第一次激活之前就位，回填无法还原历史上的重复激活和撤销
+    """
+    if db_path is not None and db_path in _ready_paths:
+        return
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_rollup (
+            day TEXT NOT NULL,
+            code_type TEXT NOT NULL,
+            activations INTEGER NOT NULL DEFAULT 0,
+            unique_users INTEGER NOT NULL DEFAULT 0,
+            revocations INTEGER NOT NULL DEFAULT 0,
+            expirations INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, code_type)
+        ) WITHOUT ROWID
+    """)
+    if not _table_exists(conn, 'pro_users'):
+        conn.commit()
+        return
+    installed = _trigger_exists(conn, 'trg_rollup_pro_users_insert')
+    if not installed:
+        # 多个 worker 同时启动时只有一个安装并回填，其余拿到写锁后重新检查
+        conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if not _trigger_exists(conn, 'trg_rollup_pro_users_insert'):
+                for name, body in ROLLUP_TRIGGERS.items():
+                    conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+                _backfill(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    conn.commit()
+    if db_path is not None:
+        _ready_paths.add(db_path)
+
+
+def backfill(conn):
+    """按 pro_users 当前数据重建汇总表（单个事务）"""
+    ensure_schema(conn)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        _backfill(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def daily_trend(conn, days=30):
+    """
+    最近 days 天（含今天）的每日汇总，按日期倒序，只返回有数据的日期
+    每项包含各类型的明细 by_code_type
+    """
+    rows = conn.execute("""
+        SELECT day, code_type, activations, unique_users, revocations, expirations
+        FROM daily_rollup
+        WHERE day >= DATE('now', ?) AND day <= DATE('now')
+        ORDER BY day DESC, code_type
+    """, (f'-{int(days)} days',)).fetchall()
+
+    trend = []
+    for row in rows:
+        if not (row[2] or row[3] or row[4] or row[5]):
+            continue
+        if not trend or trend[-1]['date'] != row[0]:
+            trend.append({
+                'date': row[0],
+                'activations': 0,
+                'unique_users': 0,
+                'revocations': 0,
+                'expirations': 0,
+                'by_code_type': {},
+            })
+        day = trend[-1]
+        day['activations'] += row[2]
+        day['unique_users'] += row[3]
+        day['revocations'] += row[4]
+        day['expirations'] += row[5]
+        day['by_code_type'][row[1]] = {
+            'activations': row[2],
+            'unique_users': row[3],
+            'revocations': row[4],
+            'expirations': row[5],
+        }
+    return trend
+
+
+if __name__ == '__main__':
+    from sqlite_bootstrap import connect
+
+    db_path = os.environ.get('DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mozibang_activation.db'))
+    if len(sys.argv) < 2 or sys.argv[1] != 'backfill':
+        print("用法: python daily_rollup.py backfill")
+        sys.exit(1)
+
+    conn = connect(db_path)
+    if not _table_exists(conn, 'pro_users'):
+        print("❌ pro_users 表不存在")
+        sys.exit(1)
+    backfill(conn)
+    count = conn.execute("SELECT COUNT(*) FROM daily_rollup").fetchone()[0]
+    print(f"✅ 每日汇总已回填: {count} 行")
+    conn.close()
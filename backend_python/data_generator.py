@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - 合成数据生成
+按接近生产的分布批量写入激活码、用户和Pro用户，用于在百万级数据上衡量各项性能优化：
+- 激活码类型按 --mix 比例（默认 永久20% / 一年50% / 半年30%），创建时间集中在近期；
+- 约 --used-ratio 的激活码在创建后若干天内被使用，生成对应的 users / pro_users 行，
+  到期时间按类型计算，早期激活的期限用户自然过期；
+- 少量未使用激活码被禁用（--disabled-ratio），少量Pro用户被撤销（--revoked-ratio）。
+同一 --seed 生成的数据完全相同。
+
+SQLite 写入时关闭同步、加大缓存，先删除统计触发器和二级索引，写完后重建索引，
+重新安装触发器并按新数据重建统计计数和每日汇总。
+MySQL 写入 activation_api.py 使用的 activation_codes / user_pro_status / activation_logs 表。
+
+用法:
+    python data_generator.py sqlite --codes 1000000 --seed 42
+    python data_generator.py sqlite --codes 200000 --used-ratio 0.8 --reset
+    python data_generator.py mysql --codes 1000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from code_generator import CODE_CHARS, CODE_LENGTH
+
+DEFAULT_MIX = {'pro_lifetime': 0.2, 'pro_1year': 0.5, 'pro_6month': 0.3}
+TERM_DAYS = {'pro_lifetime': None, 'pro_1year': 365, 'pro_6month': 180}
+EMAIL_DOMAINS = (('gmail.com', 55), ('outlook.com', 15), ('qq.com', 12), ('163.com', 8),
+                 ('icloud.com', 6), ('example.org', 4))
+REVOKE_REASONS = ('退款', '违规使用', '重复购买', '管理员撤销')
+DISABLE_REASONS = ('渠道回收', '泄露', '管理员禁用')
+
+CHUNK_SIZE = 20000
+
+# 随机字节 -> 激活码字符（256 不是 36 的整数倍，分布略有偏差，对测试数据无影响）
+_CODE_TABLE = bytes(ord(CODE_CHARS[i % len(CODE_CHARS)]) for i in range(256))
+
+# 批量写入时需要暂时移除的SQLite表
+SQLITE_TABLES = ('activation_codes', 'users', 'pro_users')
+
+
+class SyntheticData:
+    """按参数逐块生成数据行"""
+
+    def __init__(self, codes, used_ratio=0.6, disabled_ratio=0.02, revoked_ratio=0.03,
+                 days=730, mix=None, batch_size=10000, seed=None, now=None, start_index=0):
+        self.codes = codes
+        self.used_ratio = used_ratio
+        self.disabled_ratio = disabled_ratio
+        self.revoked_ratio = revoked_ratio
+        self.days = days
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.now = (now or datetime.now()).replace(microsecond=0)
+        self.start_index = start_index
+        mix = mix or DEFAULT_MIX
+        self.code_types = list(mix)
+        self.type_weights = list(accumulate(mix[t] for t in self.code_types))
+        self.domains = [d for d, _ in EMAIL_DOMAINS]
+        self.domain_weights = list(accumulate(w for _, w in EMAIL_DOMAINS))
+
+    def _code(self):
+        return self.rng.randbytes(CODE_LENGTH).translate(_CODE_TABLE).decode()
+
+    def _after(self, start, days):
+        # 时间取整到秒，写入时直接 isoformat 即可
+        return start + timedelta(seconds=int(days * 86400))
+
+    def _created_at(self):
+        # 越近的日期越密集：年龄 = days * u^1.5
+        return self._after(self.now, -self.days * self.rng.random() ** 1.5)
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """
+        逐块返回 [行字典]，每行是一个激活码，已使用的激活码带 user 子字典
+        """
+        rng = self.rng
+        for start in range(0, self.codes, chunk_size):
+            rows = []
+            for i in range(self.start_index + start, self.start_index + min(start + chunk_size, self.codes)):
+                code_type = rng.choices(self.code_types, cum_weights=self.type_weights)[0]
+                created_at = self._created_at()
+                row = {
+                    'code': self._code(),
+                    'code_type': code_type,
+                    'batch_name': f'synthetic_{i // self.batch_size:05d}',
+                    'created_at': created_at,
+                    'is_used': False,
+                    'used_by': None,
+                    'used_at': None,
+                    'is_disabled': False,
+                    'disabled_at': None,
+                    'disabled_reason': None,
+                    'user': None,
+                }
+                # 从创建到使用的间隔：指数分布，平均一周
+                used_at = self._after(created_at, rng.expovariate(1 / 7))
+                if rng.random() < self.used_ratio and used_at < self.now:
+                    row['is_used'] = True
+                    row['used_at'] = used_at
+                    row['used_by'] = self._email(i)
+                    row['user'] = self._user(i, row)
+                elif rng.random() < self.disabled_ratio:
+                    row['is_disabled'] = True
+                    row['disabled_at'] = self._after(created_at, (self.now - created_at).days * rng.random())
+                    row['disabled_reason'] = rng.choice(DISABLE_REASONS)
+                rows.append(row)
+            yield rows
+
+    def _email(self, i):
+        domain = self.rng.choices(self.domains, cum_weights=self.domain_weights)[0]
+        return f'user{i:08d}@{domain}'
+
+    def _user(self, i, row):
+        rng = self.rng
+        activated_at = row['used_at']
+        term = TERM_DAYS[row['code_type']]
+        expires_at = activated_at + timedelta(days=term) if term else None
+        revoked_at = None
+        if rng.random() < self.revoked_ratio:
+            revoked_at = self._after(activated_at, (self.now - activated_at).days * rng.random())
+        # 最后登录：大多数在最近一个月内，到期或撤销的用户停在那之前
+        last_active = min(t for t in (self.now, expires_at, revoked_at) if t is not None)
+        last_login = max(activated_at, self._after(last_active, -rng.expovariate(1 / 10)))
+        return {
+            'email': row['used_by'],
+            'name': f'User {i}',
+            'token': f'syn-{rng.getrandbits(64):016x}-{i}',
+            'activated_at': activated_at,
+            'expires_at': expires_at,
+            'is_active': revoked_at is None,
+            'revoked_at': revoked_at,
+            'revoked_reason': rng.choice(REVOKE_REASONS) if revoked_at else None,
+            'last_login': last_login,
+        }
+
+
+def _fmt(value):
+    return value.isoformat(' ') if value is not None else None
+
+
+def _parse_mix(spec):
+    mix = {}
+    for item in spec.split(','):
+        code_type, weight = item.split('=')
+        if code_type not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'unknown code type: {code_type}')
+        mix[code_type] = float(weight)
+    return mix
+
+
+# ---------------------------------------------------------------- SQLite
+
+def _sqlite_prepare(db_path):
+    """确保表结构存在（与API启动时一致）"""
+    import auto_create_pro_users
+    import sqlite_activation_api
+
+    sqlite_activation_api.DB_PATH = db_path
+    auto_create_pro_users.DB_PATH = db_path
+    sqlite_activation_api.init_database()
+    auto_create_pro_users.create_pro_users_table()
+
+
+def _sqlite_drop_for_load(conn):
+    """删除统计、到期时间戳触发器和二级索引，返回重建索引的SQL"""
+    placeholders = ','.join('?' * len(SQLITE_TABLES))
+    triggers = conn.execute(f"""
+        SELECT name FROM sqlite_master
+        WHERE type = 'trigger' AND tbl_name IN ({placeholders})
+          AND (name LIKE 'trg_stats_%' OR name LIKE 'trg_rollup_%' OR name LIKE 'trg_expiry_%')
+    """, SQLITE_TABLES).fetchall()
+    for (name,) in triggers:
+        conn.execute(f'DROP TRIGGER {name}')
+    indexes = conn.execute(f"""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND tbl_name IN ({placeholders}) AND sql IS NOT NULL
+    """, SQLITE_TABLES).fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX {name}')
+    conn.commit()
+    return [sql for _, sql in indexes]
+
+
+def _sqlite_insert(conn, rows):
+    conn.executemany("""
+        INSERT OR IGNORE INTO activation_codes
+            (code, code_type, batch_name, notes, is_used, used_by, used_at,
+             is_disabled, disabled_at, disabled_reason, created_at, updated_at)
+        VALUES (?, ?, ?, 'synthetic', ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (r['code'], r['code_type'], r['batch_name'], r['is_used'], r['used_by'], _fmt(r['used_at']),
+         r['is_disabled'], _fmt(r['disabled_at']), r['disabled_reason'], _fmt(r['created_at']),
+         _fmt(r['disabled_at'] or r['used_at'] or r['created_at']))
+        for r in rows
+    ])
+    users = [r for r in rows if r['user']]
+    conn.executemany("""
+        INSERT OR IGNORE INTO users
+            (email, token, pro_status, pro_activated_at, pro_expires_at, activation_code, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (u['email'], u['token'], 'active' if u['is_active'] else 'inactive', _fmt(u['activated_at']),
+         _fmt(u['expires_at']), r['code'], _fmt(u['activated_at']), _fmt(u['revoked_at'] or u['last_login']))
+        for r in users for u in (r['user'],)
+    ])
+    conn.executemany("""
+        INSERT OR IGNORE INTO pro_users
+            (user_email, user_name, pro_type, activation_code, activated_at, expires_at, is_lifetime,
+             is_active, last_login, user_token, revoked_at, revoked_reason, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (u['email'], u['name'], r['code_type'], r['code'], _fmt(u['activated_at']), _fmt(u['expires_at']),
+         u['expires_at'] is None, u['is_active'], _fmt(u['last_login']), u['token'], _fmt(u['revoked_at']),
+         u['revoked_reason'], _fmt(u['activated_at']), _fmt(u['revoked_at'] or u['last_login']))
+        for r in users for u in (r['user'],)
+    ])
+    conn.commit()
+    return len(users)
+
+
+def load_sqlite(db_path, generator, reset=False):
+    """写入SQLite，返回 (激活码数, 用户数)"""
+    import daily_rollup
+    import pro_expiry
+    import stats_counters
+    from code_filter import notify_codes_added
+    from sqlite_bootstrap import connect
+
+    _sqlite_prepare(db_path)
+    conn = connect(db_path)
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+    conn.execute('PRAGMA temp_store = MEMORY')
+
+    index_sql = _sqlite_drop_for_load(conn)
+    if reset:
+        for table in SQLITE_TABLES:
+            conn.execute(f'DELETE FROM {table}')
+        conn.commit()
+    generator.start_index = conn.execute('SELECT COALESCE(MAX(id), 0) FROM activation_codes').fetchone()[0]
+
+    total_codes = total_users = 0
+    for rows in generator.chunks():
+        total_users += _sqlite_insert(conn, rows)
+        total_codes += len(rows)
+        print(f"  已写入 {total_codes}/{generator.codes} 个激活码, {total_users} 个用户", end='\r')
+    print()
+
+    print("  重建索引...")
+    for sql in index_sql:
+        conn.execute(sql)
+    print("  重建统计计数、每日汇总和到期时间戳...")
+    pro_expiry.ensure_schema(conn)
+    stats_counters.ensure_schema(conn)
+    daily_rollup.ensure_schema(conn)
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    # 运行中的API进程的激活码过滤器据此补入新激活码
+    notify_codes_added(db_path)
+    return total_codes, total_users
+
+
+# ---------------------------------------------------------------- MySQL
+
+MYSQL_CODE_TYPES = {'pro_lifetime': 'lifetime', 'pro_1year': '1year', 'pro_6month': '6month'}
+
+
+def _mysql_connect():
+    """连接 activation_api.py 配置的数据库"""
+    import pymysql
+    from activation_api import DB_CONFIG
+
+    return pymysql.connect(**DB_CONFIG, autocommit=False)
+
+
+def load_mysql(generator, reset=False):
+    """写入MySQL（activation_api.py 的表结构），返回 (激活码数, 用户数)"""
+    conn = _mysql_connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SET SESSION unique_checks = 0')
+            cursor.execute('SET SESSION foreign_key_checks = 0')
+            if reset:
+                for table in ('activation_logs', 'user_pro_status', 'activation_codes'):
+                    cursor.execute(f'DELETE FROM {table}')
+                conn.commit()
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM activation_codes')
+            next_id = cursor.fetchone()[0] + 1
+            generator.start_index = next_id - 1
+
+            total_codes = total_users = 0
+            for rows in generator.chunks():
+                codes = []
+                for offset, r in enumerate(rows):
+                    r['id'] = next_id + offset
+                    codes.append((
+                        r['id'], r['code'], MYSQL_CODE_TYPES[r['code_type']], r['batch_name'],
+                        not r['is_disabled'], r['is_used'], r['used_by'], _fmt(r['used_at']),
+                        _fmt(r['created_at']), _fmt(r['disabled_at'] or r['used_at'] or r['created_at']),
+                    ))
+                next_id += len(rows)
+                cursor.executemany("""
+                    INSERT IGNORE INTO activation_codes
+                        (id, code, code_type, batch_id, is_active, is_used, used_by, used_at, created_at, updated_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, codes)
+
+                users = [r for r in rows if r['user']]
+                cursor.executemany("""
+                    INSERT IGNORE INTO user_pro_status
+                        (user_email, user_name, pro_type, expires_at, is_pro, activated_at,
+                         activation_code_used, last_login, created_at, updated_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, [
+                    (u['email'], u['name'], MYSQL_CODE_TYPES[r['code_type']], _fmt(u['expires_at']),
+                     u['is_active'], _fmt(u['activated_at']), r['code'], _fmt(u['last_login']),
+                     _fmt(u['activated_at']), _fmt(u['revoked_at'] or u['last_login']))
+                    for r in users for u in (r['user'],)
+                ])
+                logs = []
+                for r in users:
+                    u = r['user']
+                    logs.append((r['id'], u['email'], u['name'], 'activate', None, _fmt(u['activated_at'])))
+                    if u['revoked_at']:
+                        logs.append((r['id'], u['email'], u['name'], 'revoke', u['revoked_reason'],
+                                     _fmt(u['revoked_at'])))
+                cursor.executemany("""
+                    INSERT INTO activation_logs
+                        (activation_code_id, user_email, user_name, action_type, notes, created_at)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, logs)
+                conn.commit()
+                total_codes += len(rows)
+                total_users += len(users)
+                print(f"  已写入 {total_codes}/{generator.codes} 个激活码, {total_users} 个用户", end='\r')
+            print()
+            cursor.execute('SET SESSION unique_checks = 1')
+            cursor.execute('SET SESSION foreign_key_checks = 1')
+            for table in ('activation_codes', 'user_pro_status', 'activation_logs'):
+                cursor.execute(f'ANALYZE TABLE {table}')
+                cursor.fetchall()
+    finally:
+        conn.close()
+    return total_codes, total_users
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成大规模合成数据')
+    parser.add_argument('backend', choices=('sqlite', 'mysql'))
+    parser.add_argument('--codes', type=int, default=100000, help='激活码数量')
+    parser.add_argument('--used-ratio', type=float, default=0.6, help='已使用激活码比例')
+    parser.add_argument('--disabled-ratio', type=float, default=0.02, help='未使用激活码中被禁用的比例')
+    parser.add_argument('--revoked-ratio', type=float, default=0.03, help='Pro用户中被撤销的比例')
+    parser.add_argument('--days', type=int, default=730, help='数据覆盖的天数')
+    parser.add_argument('--mix', type=_parse_mix, default=DEFAULT_MIX,
+                        help='类型比例，如 pro_lifetime=0.2,pro_1year=0.5,pro_6month=0.3')
+    parser.add_argument('--batch-size', type=int, default=10000, help='每个批次名称下的激活码数')
+    parser.add_argument('--seed', type=int, default=None, help='随机种子（相同种子生成相同数据）')
+    parser.add_argument('--reset', action='store_true', help='写入前清空现有数据')
+    parser.add_argument('--db', default=os.environ.get(
+        'DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mozibang_activation.db')),
+        help='SQLite数据库路径')
+    args = parser.parse_args()
+
+    generator = SyntheticData(
+        args.codes, used_ratio=args.used_ratio, disabled_ratio=args.disabled_ratio,
+        revoked_ratio=args.revoked_ratio, days=args.days, mix=args.mix,
+        batch_size=args.batch_size, seed=args.seed,
+    )
+    started = time.perf_counter()
+    target = args.db if args.backend == 'sqlite' else 'MySQL'
+    print(f"🚀 生成 {args.codes} 个激活码 -> {target}")
+    if args.backend == 'sqlite':
+        codes, users = load_sqlite(args.db, generator, reset=args.reset)
+    else:
+        codes, users = load_mysql(generator, reset=args.reset)
+    elapsed = time.perf_counter() - started
+    print(f"✅ 完成: {codes} 个激活码, {users} 个Pro用户, 用时 {elapsed:.1f}s ({codes / elapsed:.0f} 个激活码/秒)")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - Pro权益令牌
+签发带过期时间的签名令牌（JWT格式，ES256，header中带密钥ID）。
+服务端只持有 P-256 私钥，扩展内置对应的公钥（activation_config.js），
+在 refresh_after 之前本地验证签名后直接使用令牌而无需调用 /api/verify_pro；
+撤销的用户通过 entitlement_revocations 表下发，扩展定期拉取 /api/entitlements/revocations。
+每个用户的撤销次数（revision）写入令牌的 rev 声明，rev 小于当前撤销次数的令牌失效；
+按次数而不是按秒级时间比较，同一秒内撤销后重新激活签发的令牌不会被误判为已撤销。
+
+生成密钥（输出服务端环境变量和扩展使用的公钥）：
+    python entitlement_tokens.py genkey k1
+导出已配置密钥的公钥：
+    python entitlement_tokens.py public-keys
+"""
+
+import base64
+import json
+import os
+import secrets
+import sys
+import time
+from datetime import datetime
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature, encode_dss_signature
+
+# 令牌有效期与刷新窗口（秒）
+ENTITLEMENT_TOKEN_TTL = int(os.environ.get('ENTITLEMENT_TOKEN_TTL', 7 * 24 * 3600))
+ENTITLEMENT_REFRESH_AFTER = int(os.environ.get('ENTITLEMENT_REFRESH_AFTER', 24 * 3600))
+
+
+class EntitlementTokenError(Exception):
+    """令牌无效，error_code 与API错误码保持一致"""
+
+    def __init__(self, message, error_code):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _load_signing_keys():
+    """
+    ENTITLEMENT_SIGNING_KEYS 格式: kid1:私钥1,kid2:私钥2
+    私钥为 base64url 编码的 PKCS#8 DER（P-256），由 genkey 生成；没有默认值
+    """
+    keys = {}
+    raw = os.environ.get('ENTITLEMENT_SIGNING_KEYS', '')
+    for item in raw.split(','):
+        if ':' in item:
+            kid, encoded = item.split(':', 1)
+            key = serialization.load_der_private_key(_b64decode(encoded.strip()), password=None)
+            if not isinstance(key, ec.EllipticCurvePrivateKey) or key.curve.name != 'secp256r1':
+                raise ValueError(f'Entitlement signing key {kid.strip()} is not a P-256 private key')
+            keys[kid.strip()] = key
+    return keys
+
+
+SIGNING_KEYS = _load_signing_keys()
+ACTIVE_KEY_ID = os.environ.get('ENTITLEMENT_ACTIVE_KID') or next(iter(SIGNING_KEYS), None)
+
+
+def require_signing_key():
+    """API 启动时调用：没有配置专用的签名私钥时拒绝启动"""
+    if ACTIVE_KEY_ID not in SIGNING_KEYS:
+        raise RuntimeError(
+            'ENTITLEMENT_SIGNING_KEYS must contain the active entitlement signing key '
+            '(generate one with: python entitlement_tokens.py genkey k1)'
+        )
+
+
+def _sign(signing_input, kid):
+    """ECDSA P-256 / SHA-256，签名为 JWS 要求的 r||s 定长格式"""
+    r, s = decode_dss_signature(SIGNING_KEYS[kid].sign(signing_input, ec.ECDSA(hashes.SHA256())))
+    return r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+
+
+def _verify_signature(signing_input, signature, kid):
+    if len(signature) != 64:
+        return False
+    r, s = int.from_bytes(signature[:32], 'big'), int.from_bytes(signature[32:], 'big')
+    try:
+        SIGNING_KEYS[kid].public_key().verify(encode_dss_signature(r, s), signing_input, ec.ECDSA(hashes.SHA256()))
+    except InvalidSignature:
+        return False
+    return True
+
+
+def public_jwk(kid):
+    """扩展验证签名使用的公钥（JWK）"""
+    numbers = SIGNING_KEYS[kid].public_key().public_numbers()
+    return {
+        'kty': 'EC',
+        'crv': 'P-256',
+        'kid': kid,
+        'x': _b64encode(numbers.x.to_bytes(32, 'big')),
+        'y': _b64encode(numbers.y.to_bytes(32, 'big')),
+    }
+
+
+def _to_epoch(value):
+    """数据库中的 ISO 时间字符串转为时间戳"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(datetime.fromisoformat(str(value)).timestamp())
+
+
+def issue_entitlement_token(user_email, pro_type, pro_expires_at=None, revision=0, now=None):
+    """签发令牌，返回 (令牌, 声明)；revision 为该用户当前的撤销次数（get_revision）"""
+    now = int(now if now is not None else time.time())
+    pro_expires_epoch = _to_epoch(pro_expires_at)
+
+    expires = now + ENTITLEMENT_TOKEN_TTL
+    if pro_expires_epoch is not None:
+        expires = min(expires, pro_expires_epoch)
+
+    claims = {
+        'sub': user_email,
+        'pro_type': pro_type,
+        'pro_expires_at': pro_expires_epoch,
+        'is_lifetime': pro_expires_epoch is None,
+        'iat': now,
+        'exp': expires,
+        'refresh_after': min(now + ENTITLEMENT_REFRESH_AFTER, expires),
+        'rev': int(revision or 0),
+        'jti': secrets.token_hex(8),
+    }
+    require_signing_key()
+    header = {'alg': 'ES256', 'typ': 'JWT', 'kid': ACTIVE_KEY_ID}
+
+    signing_input = (
+        _b64encode(json.dumps(header, separators=(',', ':')).encode('utf-8')) + '.' +
+        _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+    ).encode('ascii')
+    token = signing_input.decode('ascii') + '.' + _b64encode(_sign(signing_input, ACTIVE_KEY_ID))
+    return token, claims
+
+
+def verify_entitlement_token(token, revision_lookup=None, now=None):
+    """
+    校验签名、过期时间和撤销状态，成功返回声明
+    revision_lookup(email) 返回该用户当前的撤销次数
+    """
+    now = int(now if now is not None else time.time())
+    try:
+        header_b64, claims_b64, signature_b64 = token.split('.')
+        header = json.loads(_b64decode(header_b64))
+        claims = json.loads(_b64decode(claims_b64))
+        signature = _b64decode(signature_b64)
+    except (ValueError, AttributeError):
+        raise EntitlementTokenError('Malformed entitlement token', 'INVALID_TOKEN')
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise EntitlementTokenError('Malformed entitlement token', 'INVALID_TOKEN')
+
+    kid = header.get('kid')
+    if header.get('alg') != 'ES256' or kid not in SIGNING_KEYS:
+        raise EntitlementTokenError('Unknown signing key', 'INVALID_TOKEN')
+
+    if not _verify_signature(f'{header_b64}.{claims_b64}'.encode('ascii'), signature, kid):
+        raise EntitlementTokenError('Invalid token signature', 'INVALID_TOKEN')
+
+    if claims.get('exp', 0) <= now:
+        raise EntitlementTokenError('Entitlement token expired', 'TOKEN_EXPIRED')
+
+    if revision_lookup is not None:
+        if (revision_lookup(claims.get('sub')) or 0) > claims.get('rev', 0):
+            raise EntitlementTokenError('Entitlement revoked', 'TOKEN_REVOKED')
+
+    return claims
+
+
+def ensure_schema(conn):
+    """创建撤销列表表"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS entitlement_revocations (
+            user_email TEXT PRIMARY KEY,
+            revoked_at INTEGER NOT NULL,
+            revision INTEGER NOT NULL DEFAULT 1
+        )
+    """)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(entitlement_revocations)")}
+    if 'revision' not in columns:
+        conn.execute("ALTER TABLE entitlement_revocations ADD COLUMN revision INTEGER NOT NULL DEFAULT 1")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_entitlement_revocations_revoked_at
+        ON entitlement_revocations(revoked_at)
+    """)
+
+
+def record_revocation(conn, user_email, now=None):
+    """在调用方事务中记录撤销（撤销次数加一），之前签发的令牌全部失效"""
+    ensure_schema(conn)
+    conn.execute("""
+        INSERT INTO entitlement_revocations (user_email, revoked_at, revision)
+        VALUES (?, ?, 1)
+        ON CONFLICT(user_email) DO UPDATE SET
+            revoked_at = excluded.revoked_at,
+            revision = entitlement_revocations.revision + 1
+    """, (user_email, int(now if now is not None else time.time())))
+
+
+def get_revision(conn, user_email):
+    """该用户的撤销次数，从未撤销为 0"""
+    ensure_schema(conn)
+    row = conn.execute(
+        "SELECT revision FROM entitlement_revocations WHERE user_email = ?",
+        (user_email,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def list_revocations(conn, since=0, now=None):
+    """
+    返回 since 之后的撤销记录；早于一个令牌有效期的记录对应的令牌已自然过期，不再下发
+    """
+    ensure_schema(conn)
+    now = int(now if now is not None else time.time())
+    since = max(int(since), now - ENTITLEMENT_TOKEN_TTL)
+    rows = conn.execute("""
+        SELECT user_email, revoked_at, revision FROM entitlement_revocations
+        WHERE revoked_at >= ?
+        ORDER BY revoked_at
+    """, (since,)).fetchall()
+    return [{'user_email': row[0], 'revoked_at': row[1], 'revision': row[2]} for row in rows]
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'genkey':
+        kid = sys.argv[2] if len(sys.argv) > 2 else 'k1'
+        private_key = ec.generate_private_key(ec.SECP256R1())
+        der = private_key.private_bytes(
+            serialization.Encoding.DER, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+        SIGNING_KEYS[kid] = private_key
+        print("# 服务端环境变量（私钥，只配置在服务端，轮换时把新密钥追加在后面）")
+        print(f"ENTITLEMENT_SIGNING_KEYS={kid}:{_b64encode(der)}")
+        print(f"ENTITLEMENT_ACTIVE_KID={kid}")
+        print("# 扩展 activation_config.js 中 ENTITLEMENT_PUBLIC_KEYS 的条目（公钥）")
+        print(json.dumps({kid: public_jwk(kid)}, indent=2))
+    elif command == 'public-keys':
+        require_signing_key()
+        print(json.dumps({kid: public_jwk(kid) for kid in SIGNING_KEYS}, indent=2))
+    else:
+        print("用法: python entitlement_tokens.py genkey [kid] | public-keys")
+        sys.exit(1)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - 事件日志
+只追加的 events 表记录激活、验证、撤销、禁用、生成等操作（对应MySQL版的 activation_logs）。
+请求线程只把事件放入内存缓冲，由后台线程批量 executemany 写入；
+表上的触发器禁止修改，也禁止删除保留期（EVENT_LOG_MIN_RETENTION_DAYS）内的事件，
+管理后台通过 /admin/events 按索引查询
+
+高频的 verify 事件按 EVENT_VERIFY_SAMPLE_RATE 采样，detail.sample_rate 记录采样率；
+写入线程每隔 EVENT_LOG_PRUNE_INTERVAL 秒分批删除早于 EVENT_LOG_RETENTION_DAYS 天的事件。
+也可以手动执行一次：
+    python event_log.py prune
+"""
+
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+from flask import Blueprint, has_request_context, jsonify, request, session
+
+from rate_limiter import client_ip
+from sqlite_pool import get_pool
+from write_behind import AppendBuffer
+
+EVENT_TYPES = ('activate', 'verify', 'revoke', 'disable', 'generate')
+
+EVENT_LOG_ENABLED = os.environ.get('EVENT_LOG_ENABLED', '1') != '0'
+EVENT_LOG_FLUSH_INTERVAL = float(os.environ.get('EVENT_LOG_FLUSH_INTERVAL', 1))
+EVENT_LOG_BATCH_SIZE = int(os.environ.get('EVENT_LOG_BATCH_SIZE', 500))
+EVENT_LOG_MAX_PENDING = int(os.environ.get('EVENT_LOG_MAX_PENDING', 100000))
+# 扩展每次打开弹窗都会调用 verify_pro，默认只记录 1%
+EVENT_VERIFY_SAMPLE_RATE = float(os.environ.get('EVENT_VERIFY_SAMPLE_RATE', 0.01))
+EVENT_SAMPLE_RATES = {'verify': EVENT_VERIFY_SAMPLE_RATE}
+# 事件保留天数（0 表示不清理）；触发器只允许删除早于 EVENT_LOG_MIN_RETENTION_DAYS 天的事件
+EVENT_LOG_MIN_RETENTION_DAYS = 30
+EVENT_LOG_RETENTION_DAYS = int(os.environ.get('EVENT_LOG_RETENTION_DAYS', 90))
+EVENT_LOG_PRUNE_INTERVAL = float(os.environ.get('EVENT_LOG_PRUNE_INTERVAL', 3600))
+EVENT_LOG_PRUNE_BATCH_SIZE = 5000
+# 查询接口单页上限
+EVENT_QUERY_MAX_LIMIT = 1000
+
+_db_path_getter = None
+_schema_ready = set()
+_next_prune = 0.0
+
+
+def ensure_schema(conn):
+    """创建事件表、索引和禁止修改的触发器"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_type TEXT NOT NULL,
+            result TEXT NOT NULL DEFAULT 'success',
+            user_email TEXT DEFAULT NULL,
+            activation_code TEXT DEFAULT NULL,
+            error_code TEXT DEFAULT NULL,
+            detail TEXT DEFAULT NULL,
+            actor TEXT DEFAULT NULL,
+            ip_address TEXT DEFAULT NULL,
+            user_agent TEXT DEFAULT NULL,
+            created_at DATETIME NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_type_created ON events(event_type, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_email_created ON events(user_email, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_code ON events(activation_code)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_created ON events(created_at)")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_events_no_update BEFORE UPDATE ON events
+        BEGIN SELECT RAISE(ABORT, 'events is append-only'); END
+    """)
+    # 旧版本的触发器禁止一切删除，替换为只允许清理保留期之外的事件
+    conn.execute("DROP TRIGGER IF EXISTS trg_events_no_delete")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_events_delete_retention BEFORE DELETE ON events
+        WHEN OLD.created_at >= datetime('now', '-{EVENT_LOG_MIN_RETENTION_DAYS} days')
+        BEGIN SELECT RAISE(ABORT, 'events is append-only within the retention period'); END
+    """)
+
+
+def configure(db_path_getter):
+    """设置数据库路径的获取函数"""
+    global _db_path_getter
+    _db_path_getter = db_path_getter
+
+
+def _connection():
+    db_path = _db_path_getter()
+    conn = get_pool(db_path).connection()
+    if db_path not in _schema_ready:
+        ensure_schema(conn)
+        conn.commit()
+        _schema_ready.add(db_path)
+    return conn
+
+
+def prune_events(conn, retention_days=EVENT_LOG_RETENTION_DAYS, batch_size=EVENT_LOG_PRUNE_BATCH_SIZE):
+    """分批删除早于 retention_days 天的事件，每批单独提交，返回删除条数"""
+    if retention_days <= 0:
+        return 0
+    retention_days = max(retention_days, EVENT_LOG_MIN_RETENTION_DAYS)
+    cutoff = conn.execute("SELECT datetime('now', ?)", (f'-{retention_days} days',)).fetchone()[0]
+    pruned = 0
+    while True:
+        cursor = conn.execute("""
+            DELETE FROM events WHERE id IN (
+                SELECT id FROM events WHERE created_at < ? ORDER BY created_at LIMIT ?
+            )
+        """, (cutoff, batch_size))
+        conn.commit()
+        pruned += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return pruned
+
+
+def flush_events(entries):
+    """批量写入事件（一个事务），到达清理间隔时顺带清理过期事件"""
+    global _next_prune
+    conn = _connection()
+    try:
+        conn.executemany("""
+            INSERT INTO events (event_type, result, user_email, activation_code, error_code,
+                                detail, actor, ip_address, user_agent, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, entries)
+        conn.commit()
+        if time.monotonic() >= _next_prune:
+            _next_prune = time.monotonic() + EVENT_LOG_PRUNE_INTERVAL
+            prune_events(conn)
+    finally:
+        conn.close()
+
+
+event_buffer = AppendBuffer(
+    'event-log', flush_events,
+    flush_interval=EVENT_LOG_FLUSH_INTERVAL,
+    max_entries=EVENT_LOG_BATCH_SIZE,
+    max_pending=EVENT_LOG_MAX_PENDING,
+)
+
+
+def log_event(event_type, result='success', user_email=None, activation_code=None,
+              error_code=None, detail=None, actor=None):
+    """
+    记录一条事件（不阻塞请求线程）
+    在请求上下文中调用时自动记录IP和User-Agent；EVENT_SAMPLE_RATES 中的事件类型按比例采样
+    """
+    if not EVENT_LOG_ENABLED or _db_path_getter is None:
+        return
+
+    sample_rate = EVENT_SAMPLE_RATES.get(event_type, 1.0)
+    if sample_rate < 1.0:
+        if random.random() >= sample_rate:
+            return
+        detail = dict(detail or {}, sample_rate=sample_rate)
+
+    ip_address = user_agent = None
+    if has_request_context():
+        ip_address = client_ip()
+        user_agent = request.headers.get('User-Agent')
+    event_buffer.append((
+        event_type,
+        result,
+        user_email,
+        activation_code,
+        error_code,
+        json.dumps(detail, ensure_ascii=False) if detail is not None else None,
+        actor,
+        ip_address,
+        user_agent,
+        datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+    ))
+
+
+# 事件查询接口
+events_bp = Blueprint('events', __name__, url_prefix='/admin/events')
+
+
+@events_bp.before_request
+def require_admin():
+    if 'admin_user' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Login required',
+            'error_code': 'LOGIN_REQUIRED'
+        }), 401
+
+
+def _event_to_dict(row):
+    event = dict(row)
+    if event.get('detail'):
+        event['detail'] = json.loads(event['detail'])
+    return event
+
+
+@events_bp.route('', methods=['GET'])
+def list_events():
+    """
+    查询事件，按 id 升序返回，next_after_id 用于增量拉取
+    GET /admin/events?event_type=activate&user_email=&activation_code=&since=&until=&after_id=0&limit=100
+    """
+    event_type = request.args.get('event_type')
+    if event_type and event_type not in EVENT_TYPES:
+        return jsonify({'success': False, 'message': 'Invalid event_type', 'error_code': 'INVALID_DATA'}), 400
+    try:
+        after_id = int(request.args.get('after_id', 0))
+        limit = max(1, min(int(request.args.get('limit', 100)), EVENT_QUERY_MAX_LIMIT))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid paging parameters', 'error_code': 'INVALID_DATA'}), 400
+
+    conditions = ['id > ?']
+    params = [after_id]
+    for column in ('event_type', 'user_email', 'activation_code'):
+        value = request.args.get(column)
+        if value:
+            conditions.append(f'{column} = ?')
+            params.append(value)
+    if request.args.get('since'):
+        conditions.append('created_at >= ?')
+        params.append(request.args['since'])
+    if request.args.get('until'):
+        conditions.append('created_at < ?')
+        params.append(request.args['until'])
+
+    conn = _connection()
+    try:
+        rows = conn.execute(f"""
+            SELECT * FROM events
+            WHERE {' AND '.join(conditions)}
+            ORDER BY id
+            LIMIT ?
+        """, params + [limit]).fetchall()
+    finally:
+        conn.close()
+
+    events = [_event_to_dict(row) for row in rows]
+    return jsonify({
+        'success': True,
+        'data': {
+            'events': events,
+            'next_after_id': events[-1]['id'] if events else after_id,
+        }
+    })
+
+
+@events_bp.route('/summary', methods=['GET'])
+def events_summary():
+    """
+    按日期、事件类型和结果汇总，estimated_count 按采样率还原采样事件的数量
+    GET /admin/events/summary?since=2024-01-01&until=2024-02-01
+    """
+    since = request.args.get('since') or '0000-00-00'
+    until = request.args.get('until') or '9999-12-31'
+    conn = _connection()
+    try:
+        rows = conn.execute("""
+            SELECT DATE(created_at) AS day, event_type, result, COUNT(*) AS count,
+                   CAST(ROUND(SUM(1.0 / COALESCE(json_extract(detail, '$.sample_rate'), 1))) AS INTEGER)
+                       AS estimated_count
+            FROM events
+            WHERE created_at >= ? AND created_at < ?
+            GROUP BY day, event_type, result
+            ORDER BY day DESC, event_type, result
+        """, (since, until)).fetchall()
+    finally:
+        conn.close()
+    return jsonify({'success': True, 'data': {'summary': [dict(row) for row in rows]}})
+
+
+if __name__ == '__main__':
+    from sqlite_bootstrap import connect
+
+    db_path = os.environ.get('DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mozibang_activation.db'))
+    if len(sys.argv) < 2 or sys.argv[1] != 'prune':
+        print("用法: python event_log.py prune")
+        sys.exit(1)
+
+    conn = connect(db_path)
+    ensure_schema(conn)
+    conn.commit()
+    pruned = prune_events(conn)
+    print(f"✅ 已清理 {pruned} 条早于 {EVENT_LOG_RETENTION_DAYS} 天的事件: {db_path}")
+    conn.close()
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - 后台任务队列
+任务记录保存在SQLite的 jobs 表中，由Web进程内的工作线程或独立的
+worker进程（python job_queue.py）认领执行，管理后台通过 /admin/jobs 查询进度
+"""
+
+import json
+import os
+import sys
+import threading
+import uuid
+
+from flask import Blueprint, jsonify, request, send_file, session
+
+from sqlite_pool import get_pool
+from report_cache import report_cache
+from event_log import configure as configure_event_log, log_event
+from code_filter import code_filter
+from structured_logging import get_logger
+
+# 任务队列配置
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+JOB_RUNNER_IN_WEB = os.environ.get('JOB_RUNNER_IN_WEB', '1') != '0'
+JOB_STALE_MINUTES = int(os.environ.get('JOB_STALE_MINUTES', 10))
+EXPORT_DIR = os.environ.get('EXPORT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exports'))
+
+# 超过该数量的激活码生成请求转为后台任务
+BACKGROUND_GENERATE_THRESHOLD = int(os.environ.get('BACKGROUND_GENERATE_THRESHOLD', 5000))
+# 后台生成时每个子批次的数量，子批次之间更新进度
+JOB_GENERATE_CHUNK = 20000
+
+JOB_STATUSES = ('queued', 'running', 'succeeded', 'failed')
+
+log = get_logger('mozibang.jobs')
+
+
+def ensure_schema(conn):
+    """创建任务表"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            job_type TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            params TEXT DEFAULT NULL,
+            progress INTEGER NOT NULL DEFAULT 0,
+            progress_message TEXT DEFAULT NULL,
+            result TEXT DEFAULT NULL,
+            result_path TEXT DEFAULT NULL,
+            error TEXT DEFAULT NULL,
+            created_by TEXT DEFAULT NULL,
+            worker TEXT DEFAULT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            started_at DATETIME DEFAULT NULL,
+            heartbeat_at DATETIME DEFAULT NULL,
+            finished_at DATETIME DEFAULT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at)")
+
+
+def _job_to_dict(row):
+    job = dict(row)
+    for key in ('params', 'result'):
+        if job.get(key):
+            job[key] = json.loads(job[key])
+    job.pop('result_path', None)
+    return job
+
+
+class JobContext:
+    """传给任务处理函数的上下文"""
+
+    def __init__(self, runner, job_id):
+        self.runner = runner
+        self.job_id = job_id
+
+    def connection(self):
+        return self.runner.connection()
+
+    def set_progress(self, progress, message=None):
+        """更新进度（0-100）和心跳时间"""
+        conn = self.connection()
+        try:
+            conn.execute("""
+                UPDATE jobs
+                SET progress = ?, progress_message = ?, heartbeat_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (max(0, min(100, int(progress))), message, self.job_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class JobRunner:
+    """基于jobs表的任务执行器"""
+
+    def __init__(self):
+        self.handlers = {}
+        self._db_path_getter = None
+        self._schema_ready = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._pid = None
+        self.worker_name = None
+
+    def configure(self, db_path_getter):
+        """设置数据库路径的获取函数（各应用的 DB_PATH 可能被改写，因此延迟读取）"""
+        self._db_path_getter = db_path_getter
+
+    def register(self, job_type):
+        """注册任务处理函数：handler(context, params) -> dict，可包含 result_path"""
+        def decorator(fn):
+            self.handlers[job_type] = fn
+            return fn
+        return decorator
+
+    def connection(self):
+        db_path = self._db_path_getter()
+        conn = get_pool(db_path).connection()
+        if db_path not in self._schema_ready:
+            ensure_schema(conn)
+            self._schema_ready.add(db_path)
+        return conn
+
+    def ensure_started(self):
+        """在当前进程启动工作线程（fork后的子进程会重新启动）"""
+        if not JOB_RUNNER_IN_WEB or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._start_threads(JOB_WORKERS)
+
+    def _start_threads(self, workers):
+        self._pid = os.getpid()
+        self.worker_name = f'pid-{self._pid}'
+        self._recover_stale_jobs()
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._worker_loop, name=f'job-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _recover_stale_jobs(self):
+        """长时间没有心跳的运行中任务视为worker已退出"""
+        conn = self.connection()
+        try:
+            conn.execute("""
+                UPDATE jobs
+                SET status = 'failed', error = 'Worker lost', finished_at = CURRENT_TIMESTAMP
+                WHERE status = 'running' AND heartbeat_at < datetime('now', ?)
+            """, (f'-{JOB_STALE_MINUTES} minutes',))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def enqueue(self, job_type, params, created_by=None):
+        """创建任务并唤醒工作线程，返回任务ID"""
+        if job_type not in self.handlers:
+            raise ValueError(f'Unknown job type: {job_type}')
+        job_id = uuid.uuid4().hex
+        conn = self.connection()
+        try:
+            conn.execute("""
+                INSERT INTO jobs (id, job_type, status, params, created_by)
+                VALUES (?, ?, 'queued', ?, ?)
+            """, (job_id, job_type, json.dumps(params, ensure_ascii=False), created_by))
+            conn.commit()
+        finally:
+            conn.close()
+        self.ensure_started()
+        self._wakeup.set()
+        return job_id
+
+    def get_job(self, job_id):
+        conn = self.connection()
+        try:
+            return conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+
+    def list_jobs(self, status=None, limit=50):
+        conn = self.connection()
+        try:
+            if status:
+                rows = conn.execute("""
+                    SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?
+                """, (status, limit)).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+            return rows
+        finally:
+            conn.close()
+
+    def _claim_next(self):
+        """原子地认领一个排队中的任务"""
+        conn = self.connection()
+        try:
+            while True:
+                row = conn.execute("""
+                    SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1
+                """).fetchone()
+                if row is None:
+                    return None
+                cursor = conn.execute("""
+                    UPDATE jobs
+                    SET status = 'running', worker = ?, started_at = CURRENT_TIMESTAMP,
+                        heartbeat_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND status = 'queued'
+                """, (self.worker_name, row['id']))
+                conn.commit()
+                if cursor.rowcount == 1:
+                    return dict(row)
+        finally:
+            conn.close()
+
+    def _finish(self, job_id, status, result=None, result_path=None, error=None):
+        conn = self.connection()
+        try:
+            conn.execute("""
+                UPDATE jobs
+                SET status = ?, result = ?, result_path = ?, error = ?,
+                    progress = CASE WHEN ? = 'succeeded' THEN 100 ELSE progress END,
+                    finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                  result_path, error, status, job_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _execute(self, job):
+        handler = self.handlers.get(job['job_type'])
+        if handler is None:
+            self._finish(job['id'], 'failed', error=f"Unknown job type: {job['job_type']}")
+            return
+        params = json.loads(job['params']) if job['params'] else {}
+        try:
+            result = handler(JobContext(self, job['id']), params) or {}
+            result_path = result.pop('result_path', None)
+            self._finish(job['id'], 'succeeded', result=result, result_path=result_path)
+        except Exception as e:
+            log.error('job_failed', job_id=job['id'], job_type=job['job_type'], error=str(e))
+            self._finish(job['id'], 'failed', error=str(e))
+
+    def _worker_loop(self):
+        while True:
+            try:
+                job = self._claim_next()
+            except Exception as e:
+                log.error('job_claim_error', error=str(e))
+                job = None
+            if job is None:
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._execute(job)
+
+    def run_forever(self, workers=JOB_WORKERS):
+        """独立worker进程入口"""
+        with self._lock:
+            self._start_threads(workers)
+        for thread in self._threads:
+            thread.join()
+
+
+# 进程级单例
+job_runner = JobRunner()
+
+
+@job_runner.register('generate_codes')
+def run_generate_codes(context, params):
+    """后台生成激活码，结果写入CSV文件；任一子批次失败时删除本任务已写入的激活码"""
+    from code_generator import generate_codes_bulk, iter_codes_csv
+
+    count = int(params['count'])
+    code_type = params['code_type']
+    batch_name = params['batch_name']
+    notes = params.get('notes', '')
+
+    generated = []
+    conn = context.connection()
+    try:
+        try:
+            while len(generated) < count:
+                chunk = min(JOB_GENERATE_CHUNK, count - len(generated))
+                # 每个子批次提交时在同一事务中通知其他进程失效报表缓存
+                generated.extend(generate_codes_bulk(conn, chunk, code_type, batch_name, notes,
+                                                     before_commit=report_cache.publish_invalidation))
+                context.set_progress(len(generated) * 90 // count, f'已生成 {len(generated)}/{count}')
+        except Exception:
+            for start in range(0, len(generated), 900):
+                chunk = generated[start:start + 900]
+                conn.execute(
+                    f"DELETE FROM activation_codes WHERE is_used = 0 AND code IN ({','.join('?' * len(chunk))})",
+                    chunk
+                )
+            report_cache.publish_invalidation(conn)
+            conn.commit()
+            raise
+    finally:
+        conn.close()
+    report_cache.invalidate()
+    log_event('generate', 'success', actor=f'job:{context.job_id}',
+              detail={'count': len(generated), 'code_type': code_type, 'batch_name': batch_name})
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    result_path = os.path.join(EXPORT_DIR, f'codes_{context.job_id}.csv')
+    with open(result_path, 'w', encoding='utf-8', newline='') as f:
+        for part in iter_codes_csv(generated, code_type, batch_name):
+            f.write(part)
+
+    return {
+        'count': len(generated),
+        'code_type': code_type,
+        'batch_name': batch_name,
+        'result_path': result_path,
+    }
+
+
+@job_runner.register('export_report')
+def run_export_report(context, params):
+    """后台导出统计报告"""
+    from statistics_report import ActivationStatistics
+
+    context.set_progress(10, '正在生成统计报告')
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    stats = ActivationStatistics()
+    result_path = stats.export_report_to_json(os.path.join(EXPORT_DIR, f'report_{context.job_id}.json'))
+    return {'result_path': result_path}
+
+
+def current_admin_name():
+    """两个管理后台的 session['admin_user'] 格式不同"""
+    admin_user = session.get('admin_user')
+    if isinstance(admin_user, dict):
+        return admin_user.get('username')
+    return admin_user
+
+
+# 任务状态与进度接口
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/admin/jobs')
+
+
+@jobs_bp.before_request
+def require_admin():
+    if 'admin_user' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Login required',
+            'error_code': 'LOGIN_REQUIRED'
+        }), 401
+    job_runner.ensure_started()
+
+
+@jobs_bp.route('', methods=['GET'])
+def list_jobs():
+    """任务列表"""
+    status = request.args.get('status') or None
+    if status and status not in JOB_STATUSES:
+        return jsonify({'success': False, 'message': 'Invalid status', 'error_code': 'INVALID_DATA'}), 400
+    try:
+        limit = min(int(request.args.get('limit', 50)), 200)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid limit parameter', 'error_code': 'INVALID_DATA'}), 400
+    jobs = [_job_to_dict(row) for row in job_runner.list_jobs(status, limit)]
+    return jsonify({'success': True, 'data': {'jobs': jobs}})
+
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """任务状态与进度"""
+    row = job_runner.get_job(job_id)
+    if row is None:
+        return jsonify({'success': False, 'message': 'Job not found', 'error_code': 'JOB_NOT_FOUND'}), 404
+    job = _job_to_dict(row)
+    job['has_result_file'] = bool(row['result_path'])
+    return jsonify({'success': True, 'data': job})
+
+
+@jobs_bp.route('/<job_id>/download', methods=['GET'])
+def job_download(job_id):
+    """下载任务结果文件"""
+    row = job_runner.get_job(job_id)
+    if row is None or row['status'] != 'succeeded' or not row['result_path']:
+        return jsonify({'success': False, 'message': 'Result not available', 'error_code': 'RESULT_NOT_READY'}), 404
+    if not os.path.exists(row['result_path']):
+        return jsonify({'success': False, 'message': 'Result file missing', 'error_code': 'RESULT_NOT_FOUND'}), 404
+    return send_file(row['result_path'], as_attachment=True,
+                     download_name=os.path.basename(row['result_path']))
+
+
+if __name__ == '__main__':
+    # 独立worker进程：JOB_RUNNER_IN_WEB=0 时由它执行所有任务
+    db_path = os.environ.get('DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mozibang_activation.db'))
+    job_runner.configure(lambda: db_path)
+    configure_event_log(lambda: db_path)
+    code_filter.configure(lambda: db_path)
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else JOB_WORKERS
+    print(f"🚀 启动后台任务worker: {workers} 个线程, 数据库 {db_path}")
+    job_runner.run_forever(workers)
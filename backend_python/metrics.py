@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - 运行指标
+before/after request 钩子记录每个端点的请求数、延迟直方图和本次请求的数据库耗时，
+连同连接池、缓存、写回缓冲的状态以 Prometheus 文本格式在 /metrics 输出（需API密钥）。
+
+指标按进程统计：gunicorn 多 worker 时每次抓取只看到处理该请求的 worker，
+各指标带 pid 标签，可按 pid 聚合或为每个 worker 单独配置抓取
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, has_request_context, request
+
+from sqlite_pool import add_query_observer, get_pool_stats
+from structured_logging import get_logger
+
+# 请求延迟分桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 单次请求数据库耗时分桶（秒）
+DB_TIME_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+PROCESS_START_TIME = time.time()
+
+log = get_logger('mozibang.metrics')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增计数器"""
+
+    type = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labelvalues, value in sorted(values.items()):
+            yield self.name, tuple(zip(self.labelnames, labelvalues)), value
+
+
+class Gauge(Counter):
+    """可增可减的当前值"""
+
+    type = 'gauge'
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Histogram:
+    """固定分桶直方图"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}  # labelvalues -> [各桶计数..., 总和, 次数]
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        for labelvalues, state in sorted(values.items()):
+            labels = tuple(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                yield f'{self.name}_bucket', labels + (('le', _format_value(float(bound))),), cumulative
+            yield f'{self.name}_sum', labels, round(state[-2], 6)
+            yield f'{self.name}_count', labels, state[-1]
+
+
+class MetricsRegistry:
+    """指标注册表；collectors 在抓取时调用，返回 [(名称, 类型, 说明, [(标签, 值)])]"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        """Prometheus 文本格式（0.0.4）"""
+        pid = ('pid', os.getpid())
+        families = [(m.name, m.type, m.help, m.samples()) for m in self._metrics]
+        for collector in self._collectors:
+            try:
+                for name, metric_type, help_text, samples in collector():
+                    families.append((name, metric_type, help_text,
+                                     ((name, tuple(labels), value) for labels, value in samples)))
+            except Exception:
+                log.exception('metrics_collector_error')
+
+        lines = []
+        for name, metric_type, help_text, samples in families:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for sample_name, labels, value in samples:
+                lines.append(f'{sample_name}{_format_labels((pid,) + tuple(labels))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# 进程级注册表和请求指标
+registry = MetricsRegistry()
+
+http_requests_total = registry.counter(
+    'mozibang_http_requests_total', 'HTTP requests by endpoint and status', ('method', 'endpoint', 'status'))
+http_request_duration = registry.histogram(
+    'mozibang_http_request_duration_seconds', 'HTTP request latency', ('method', 'endpoint'))
+http_request_db_time = registry.histogram(
+    'mozibang_http_request_db_seconds', 'SQLite time spent per request', ('endpoint',), DB_TIME_BUCKETS)
+http_request_db_queries = registry.counter(
+    'mozibang_http_request_db_queries_total', 'SQLite statements and fetches executed by requests', ('endpoint',))
+http_requests_in_flight = registry.gauge(
+    'mozibang_http_requests_in_flight', 'Requests currently being processed')
+
+
+def _observe_query(timing):
+    """连接池查询观察者：把耗时累加到当前请求"""
+    if has_request_context() and 'metrics_db_time' in g:
+        g.metrics_db_time += timing.elapsed
+        g.metrics_db_queries += 1
+
+
+def _collect_process():
+    yield ('mozibang_process_start_time_seconds', 'gauge', 'Process start time (unix seconds)',
+           [((), round(PROCESS_START_TIME, 3))])
+
+
+def _collect_pools():
+    stats = get_pool_stats()
+    if not stats:
+        return
+    def per_pool(key):
+        return [((('db', os.path.basename(s['db_path'])),), s[key]) for s in stats]
+    yield ('mozibang_sqlite_pool_connections', 'gauge', 'Pooled SQLite connections by state',
+           [((('db', os.path.basename(s['db_path'])), ('state', state)), s[state])
+            for s in stats for state in ('in_use', 'idle')])
+    yield ('mozibang_sqlite_pool_max_size', 'gauge', 'Pool size limit', per_pool('max_size'))
+    yield ('mozibang_sqlite_pool_checkouts_total', 'counter', 'Connections borrowed', per_pool('checkouts'))
+    yield ('mozibang_sqlite_pool_connections_created_total', 'counter', 'Connections opened',
+           per_pool('connections_created'))
+    yield ('mozibang_sqlite_pool_waits_total', 'counter', 'Checkouts that had to wait', per_pool('waits'))
+    yield ('mozibang_sqlite_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection',
+           per_pool('wait_time_total'))
+    yield ('mozibang_sqlite_pool_timeouts_total', 'counter', 'Checkouts that timed out', per_pool('timeouts'))
+
+
+def _cache_collector(caches):
+    def collect():
+        requests_samples = []
+        ratio_samples = []
+        size_samples = []
+        for cache_name, stats_fn in caches.items():
+            stats = stats_fn()
+            hits = stats.get('hits', 0) + stats.get('stale_hits', 0)
+            lookups = hits + stats.get('misses', 0)
+            for key, result in (('hits', 'hit'), ('stale_hits', 'stale_hit'), ('misses', 'miss')):
+                if key in stats:
+                    requests_samples.append(((('cache', cache_name), ('result', result)), stats[key]))
+            ratio_samples.append(((('cache', cache_name),), round(hits / lookups, 4) if lookups else 0))
+            size_samples.append(((('cache', cache_name),), stats.get('size', stats.get('entries', 0))))
+        yield ('mozibang_cache_requests_total', 'counter', 'Cache lookups by result', requests_samples)
+        yield ('mozibang_cache_hit_ratio', 'gauge', 'Cache hit ratio since process start', ratio_samples)
+        yield ('mozibang_cache_entries', 'gauge', 'Entries currently cached', size_samples)
+    return collect
+
+
+def _buffer_collector(buffers):
+    def collect():
+        stats = {name: stats_fn() for name, stats_fn in buffers.items()}
+        def per_buffer(key):
+            return [((('buffer', name),), s.get(key, 0)) for name, s in stats.items()]
+        yield ('mozibang_buffer_pending', 'gauge', 'Entries waiting to be flushed', per_buffer('pending'))
+        yield ('mozibang_buffer_flushed_total', 'counter', 'Entries written by background flushes',
+               per_buffer('flushed_entries'))
+        yield ('mozibang_buffer_flush_errors_total', 'counter', 'Failed background flushes',
+               per_buffer('flush_errors'))
+        yield ('mozibang_buffer_dropped_total', 'counter', 'Entries dropped because the buffer was full',
+               per_buffer('dropped'))
+    return collect
+
+
+registry.add_collector(_collect_process)
+registry.add_collector(_collect_pools)
+
+
+def setup_metrics(app, protect, caches=None, buffers=None):
+    """
+    为 Flask 应用注册请求指标钩子和 /metrics 接口
+    protect: 保护 /metrics 的装饰器（API密钥校验）
+    caches / buffers: {名称: stats函数}，抓取时读取
+    """
+    add_query_observer(_observe_query)
+    if caches:
+        registry.add_collector(_cache_collector(caches))
+    if buffers:
+        registry.add_collector(_buffer_collector(buffers))
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.metrics_db_time = 0.0
+        g.metrics_db_queries = 0
+        http_requests_in_flight.inc()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get('metrics_started')
+        if started is not None:
+            endpoint = request.endpoint or 'unmatched'
+            http_requests_total.inc(request.method, endpoint, str(response.status_code))
+            http_request_duration.observe(time.perf_counter() - started, request.method, endpoint)
+            http_request_db_time.observe(g.metrics_db_time, endpoint)
+            http_request_db_queries.inc(endpoint, amount=g.metrics_db_queries)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        if g.pop('metrics_started', None) is not None:
+            http_requests_in_flight.dec()
+
+    def metrics_view():
+        return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    app.add_url_rule('/metrics', 'metrics', protect(metrics_view), methods=['GET'])
+    return app
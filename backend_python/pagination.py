@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - 游标（keyset）分页
+管理后台的激活码/用户列表按 (排序时间, id) 复合索引翻页，
+用上一页最后一行的 (排序时间, id) 作为游标，翻页耗时与页码无关；
+排序时间为 NULL 的行按空字符串排在最后（COALESCE 表达式索引），翻页时不会丢失。
+无筛选条件的总数直接读 stats_counters，有筛选条件时按条件缓存 COUNT(*)
+"""
+
+import base64
+import json
+import os
+import threading
+import time
+
+from stats_counters import row_count
+
+# 列表总数缓存时间（秒）
+LIST_COUNT_CACHE_TTL = float(os.environ.get('LIST_COUNT_CACHE_TTL', 60))
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 500
+
+# 列表查询使用的复合索引，等值筛选列在前，排序键在后；
+# 排序键表达式必须与 sort_key_sql() 一致，查询才能走索引；
+# 按原始列的 (created_at, id) / (activated_at, id) 供“最近激活”等 ORDER BY ... LIMIT 查询使用
+LIST_INDEXES = {
+    'activation_codes': [
+        ('idx_codes_created_id', 'created_at, id'),
+        ('idx_codes_created_key', "COALESCE(created_at, ''), id"),
+        ('idx_codes_type_created_key', "code_type, COALESCE(created_at, ''), id"),
+        ('idx_codes_status_created_key', "is_used, is_disabled, COALESCE(created_at, ''), id"),
+    ],
+    'pro_users': [
+        ('idx_pro_users_activated_id', 'activated_at, id'),
+        ('idx_pro_users_activated_key', "COALESCE(activated_at, ''), id"),
+        ('idx_pro_users_type_activated_key', "pro_type, COALESCE(activated_at, ''), id"),
+        ('idx_pro_users_active_activated_key', "is_active, COALESCE(activated_at, ''), id"),
+    ],
+}
+# 旧版本按原始列建的筛选索引，已被上面的表达式索引取代
+OBSOLETE_LIST_INDEXES = [
+    'idx_codes_type_created_id', 'idx_codes_status_created_id',
+    'idx_pro_users_type_activated_id', 'idx_pro_users_active_activated_id',
+]
+
+_indexed_paths = set()
+_indexed_lock = threading.Lock()
+
+
+def ensure_indexes(conn, db_path=None):
+    """创建列表查询的复合索引，表不存在时跳过（pro_users 可能稍后才创建）"""
+    if db_path is not None and db_path in _indexed_paths:
+        return
+    created_all = True
+    for table, indexes in LIST_INDEXES.items():
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        if not exists:
+            created_all = False
+            continue
+        for name, columns in indexes:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})")
+    for name in OBSOLETE_LIST_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.commit()
+    if db_path is not None and created_all:
+        with _indexed_lock:
+            _indexed_paths.add(db_path)
+
+
+def sort_key_sql(sort_column):
+    return f"COALESCE({sort_column}, '')"
+
+
+def encode_cursor(sort_value, row_id):
+    return base64.urlsafe_b64encode(
+        json.dumps([sort_value, row_id], separators=(',', ':')).encode('utf-8')
+    ).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor):
+    """解析游标，格式错误时抛出 ValueError"""
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(row_id, int):
+        raise ValueError('Invalid cursor')
+    return sort_value, row_id
+
+
+class CountCache:
+    """按 (表, 筛选条件) 缓存的总数"""
+
+    def __init__(self, ttl=LIST_COUNT_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def count(self, conn, table, where_clause, params):
+        """返回 (总数, 缓存时间戳)"""
+        now = time.time()
+        if not where_clause:
+            total = row_count(conn, table)
+            if total is not None:
+                return total, now
+        key = (table, where_clause, tuple(params))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                return entry
+        total = conn.execute(f"SELECT COUNT(*) FROM {table}{where_clause}", params).fetchone()[0]
+        with self._lock:
+            # 筛选组合有限，这里只做简单的上限保护
+            if len(self._entries) > 1000:
+                self._entries.clear()
+            self._entries[key] = (total, now)
+        return total, now
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+list_count_cache = CountCache()
+
+
+def keyset_page(conn, table, where_conditions, params, sort_column,
+                after=None, before=None, per_page=DEFAULT_PER_PAGE):
+    """
+    按 (COALESCE(sort_column, ''), id) 倒序取一页
+    after: 取该游标之后（更早）的一页；before: 取该游标之前（更新）的一页
+    返回 {'rows', 'next_cursor', 'prev_cursor', 'total', 'count_cached_at'}
+    """
+    per_page = max(1, min(int(per_page), MAX_PER_PAGE))
+    sort_key = sort_key_sql(sort_column)
+    base_where = " WHERE " + " AND ".join(where_conditions) if where_conditions else ""
+    total, counted_at = list_count_cache.count(conn, table, base_where, params)
+
+    conditions = list(where_conditions)
+    query_params = list(params)
+    if after:
+        conditions.append(f"({sort_key}, id) < (?, ?)")
+        query_params.extend(decode_cursor(after))
+        order = 'DESC'
+    elif before:
+        conditions.append(f"({sort_key}, id) > (?, ?)")
+        query_params.extend(decode_cursor(before))
+        order = 'ASC'
+    else:
+        order = 'DESC'
+
+    where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+    # 多取一行用于判断是否还有下一页
+    rows = conn.execute(f"""
+        SELECT * FROM {table}{where_clause}
+        ORDER BY {sort_key} {order}, id {order}
+        LIMIT ?
+    """, query_params + [per_page + 1]).fetchall()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        first, last = rows[0], rows[-1]
+        if has_more or before:
+            next_cursor = encode_cursor(last[sort_column] or '', last['id'])
+        if after or (before and has_more):
+            prev_cursor = encode_cursor(first[sort_column] or '', first['id'])
+
+    return {
+        'rows': rows,
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
+        'per_page': per_page,
+        'total': total,
+        'count_cached_at': counted_at,
+    }
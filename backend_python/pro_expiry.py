@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - Pro到期时间
+到期时间除 ISO 字符串（users.pro_expires_at / pro_users.expires_at，API 照常返回）外，
+另存为整数 Unix 时间戳（users.pro_expires_epoch / pro_users.expires_epoch），由触发器在写入事务内维护，
+到期判断、统计和清扫都按时间戳走索引范围扫描。ISO 字符串与 is_pro_expired 一致按服务器本地时间解释。
+
+后台清扫线程每隔 EXPIRY_SWEEP_INTERVAL 秒把已到期的 users 分批标记为 pro_status = 'expired'；
+多个 gunicorn worker 和独立 worker 进程中只有持有 expiry_sweeper_lease 租约的一个进程执行清扫，
+持有者退出后租约过期，由其他进程接手；
+pro_users.is_active 表示未被撤销，不随到期改变（到期人数按 expires_epoch 实时统计）。
+
+也可以手动执行一次：
+    python pro_expiry.py sweep
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+
+from sqlite_pool import get_pool
+from structured_logging import get_logger
+
+EXPIRY_SWEEP_INTERVAL = float(os.environ.get('EXPIRY_SWEEP_INTERVAL', 60))
+EXPIRY_SWEEP_BATCH_SIZE = int(os.environ.get('EXPIRY_SWEEP_BATCH_SIZE', 500))
+# 批次之间让出写锁的时间（秒）
+EXPIRY_SWEEP_PAUSE = 0.05
+# 清扫租约的有效期（清扫间隔的倍数），持有者每次清扫前续期
+EXPIRY_LEASE_INTERVALS = 3
+
+# 表 -> (ISO 列, 时间戳列)
+EXPIRY_COLUMNS = {
+    'users': ('pro_expires_at', 'pro_expires_epoch'),
+    'pro_users': ('expires_at', 'expires_epoch'),
+}
+
+EXPIRY_INDEXES = {
+    # 清扫与兑换：有效用户中已到期的
+    'idx_users_status_expiry': 'users(pro_status, pro_expires_epoch)',
+    # 按类型的到期人数、30天内到期列表
+    'idx_pro_users_expiry': 'pro_users(expires_epoch, pro_type)',
+    # 统计页面：未撤销用户按到期时间排序
+    'idx_pro_users_active_expiry': 'pro_users(is_active, expires_epoch)',
+}
+
+log = get_logger('mozibang.expiry')
+
+_ready_paths = set()
+_ready_tables = set()
+
+
+def _epoch_sql(value):
+    return f"CAST(strftime('%s', {value}, 'utc') AS INTEGER)"
+
+
+def _table_exists(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+
+def _trigger_exists(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def _install(conn, table, iso_column, epoch_column):
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if epoch_column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {epoch_column} INTEGER")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_expiry_{table}_insert AFTER INSERT ON {table}
+        WHEN NEW.{iso_column} IS NOT NULL
+        BEGIN
+            UPDATE {table} SET {epoch_column} = {_epoch_sql(f'NEW.{iso_column}')} WHERE rowid = NEW.rowid;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_expiry_{table}_update AFTER UPDATE OF {iso_column} ON {table}
+        BEGIN
+            UPDATE {table} SET {epoch_column} = {_epoch_sql(f'NEW.{iso_column}')} WHERE rowid = NEW.rowid;
+        END
+    """)
+    # 回填触发器安装前的数据
+    conn.execute(f"""
+        UPDATE {table} SET {epoch_column} = {_epoch_sql(iso_column)}
+        WHERE {iso_column} IS NOT NULL AND {epoch_column} IS NOT {_epoch_sql(iso_column)}
+    """)
+
+
+def ensure_schema(conn, db_path=None):
+    """
+    为已存在的 users / pro_users 添加时间戳列、维护触发器和索引；新装触发器时回填一次。
+    API 每次借出连接时调用：按表记录就绪状态，pro_users 稍后由 auto_create_pro_users 创建时自动补装
+    """
+    if db_path is not None and db_path in _ready_paths:
+        return
+    for table, (iso_column, epoch_column) in EXPIRY_COLUMNS.items():
+        if (db_path, table) in _ready_tables or not _table_exists(conn, table):
+            continue
+        if not _trigger_exists(conn, f'trg_expiry_{table}_insert'):
+            # 多个 worker 同时启动时只有一个安装，其余拿到写锁后重新检查
+            conn.commit()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if not _trigger_exists(conn, f'trg_expiry_{table}_insert'):
+                    _install(conn, table, iso_column, epoch_column)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        for name, target in EXPIRY_INDEXES.items():
+            if target.startswith(f'{table}('):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+        if table == 'pro_users':
+            # 旧的按 ISO 字符串的到期索引已由时间戳索引取代
+            conn.execute("DROP INDEX IF EXISTS idx_pro_users_expires_type")
+        conn.commit()
+        if db_path is not None:
+            _ready_tables.add((db_path, table))
+    if db_path is not None and all((db_path, table) in _ready_tables for table in EXPIRY_COLUMNS):
+        _ready_paths.add(db_path)
+
+
+def is_expired(expires_epoch, now=None):
+    """终身版 expires_epoch 为空"""
+    return expires_epoch is not None and expires_epoch <= (now if now is not None else time.time())
+
+
+def expired_counts(conn, now=None):
+    """已到期的 Pro 用户数 {pro_type: count}（idx_pro_users_expiry 覆盖索引范围扫描）"""
+    now = int(now if now is not None else time.time())
+    # +pro_type：不让查询规划器为了 GROUP BY 改走 pro_type 索引全表扫描
+    return dict(conn.execute("""
+        SELECT pro_type, COUNT(*) FROM pro_users
+        WHERE expires_epoch <= ?
+        GROUP BY +pro_type
+    """, (now,)).fetchall())
+
+
+def expiring_users(conn, within_days=None, active_only=False, limit=None, columns='user_email, pro_type, expires_at'):
+    """
+    尚未到期、按到期时间升序的 Pro 用户，附带 days_until_expiry（天，小数）
+    within_days: 只取该天数内到期的；active_only: 只取未撤销的
+    """
+    now = int(time.time())
+    conditions = ["expires_epoch > :now"]
+    if within_days is not None:
+        conditions.append("expires_epoch <= :until")
+    if active_only:
+        conditions.append("is_active = 1")
+    sql = f"""
+        SELECT {columns}, (expires_epoch - :now) / 86400.0 AS days_until_expiry
+        FROM pro_users
+        WHERE {' AND '.join(conditions)}
+        ORDER BY expires_epoch
+    """
+    if limit is not None:
+        sql += " LIMIT :limit"
+    params = {'now': now, 'until': now + (within_days or 0) * 86400, 'limit': limit}
+    return conn.execute(sql, params).fetchall()
+
+
+class ExpirySweeper:
+    """把已到期的有效用户分批标记为 expired，每批一个短事务，批次之间让出写锁"""
+
+    def __init__(self, interval=EXPIRY_SWEEP_INTERVAL, batch_size=EXPIRY_SWEEP_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._db_path_getter = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._leader = False
+        self._metrics = {'runs': 0, 'expired_users': 0, 'batches': 0, 'errors': 0, 'last_run_ms': 0}
+
+    def configure(self, db_path_getter):
+        """设置数据库路径的获取函数（延迟读取，DB_PATH 可被改写）"""
+        self._db_path_getter = db_path_getter
+
+    def ensure_started(self):
+        """
+        在当前进程启动清扫线程（fork后的子进程会重新启动）；间隔为 0 时不启动。
+        每个进程都有线程，但只有拿到租约的进程清扫
+        """
+        if self.interval <= 0 or self._db_path_getter is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='expiry-sweeper', daemon=True).start()
+
+    def _acquire_lease(self, conn):
+        """获取或续期清扫租约（单行表，过期后任何进程都可接手），返回是否持有"""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS expiry_sweeper_lease (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                owner TEXT NOT NULL,
+                expires_epoch INTEGER NOT NULL
+            )
+        """)
+        now = int(time.time())
+        cursor = conn.execute("""
+            INSERT INTO expiry_sweeper_lease (id, owner, expires_epoch) VALUES (1, :owner, :until)
+            ON CONFLICT(id) DO UPDATE SET owner = excluded.owner, expires_epoch = excluded.expires_epoch
+            WHERE owner = excluded.owner OR expires_epoch <= :now
+        """, {'owner': f'{socket.gethostname()}:{os.getpid()}', 'now': now,
+              'until': now + int(self.interval * EXPIRY_LEASE_INTERVALS) + 1})
+        conn.commit()
+        return cursor.rowcount == 1
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                conn = get_pool(self._db_path_getter()).connection()
+                try:
+                    leader = self._acquire_lease(conn)
+                    if leader != self._leader:
+                        log.info('expiry_sweeper_lease', leader=leader)
+                        self._leader = leader
+                    if leader:
+                        self.sweep(conn)
+                finally:
+                    conn.close()
+            except Exception as e:
+                self._metrics['errors'] += 1
+                log.error('expiry_sweep_error', error=str(e))
+
+    def sweep(self, conn, now=None):
+        """清扫到当前时间为止已到期的用户，返回标记的人数"""
+        started = time.perf_counter()
+        now = int(now if now is not None else time.time())
+        total = 0
+        while True:
+            cursor = conn.execute("""
+                UPDATE users SET pro_status = 'expired', updated_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM users
+                    WHERE pro_status = 'active' AND pro_expires_epoch <= ?
+                    LIMIT ?
+                )
+            """, (now, self.batch_size))
+            swept = cursor.rowcount
+            conn.commit()
+            total += swept
+            self._metrics['batches'] += 1
+            if swept < self.batch_size:
+                break
+            time.sleep(EXPIRY_SWEEP_PAUSE)
+        self._metrics['runs'] += 1
+        self._metrics['expired_users'] += total
+        self._metrics['last_run_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        if total:
+            log.info('expiry_sweep', expired_users=total, ms=self._metrics['last_run_ms'])
+        return total
+
+    def stats(self):
+        return dict(self._metrics, interval=self.interval, batch_size=self.batch_size,
+                    running=self._pid == os.getpid(), leader=self._leader)
+
+
+# 进程级单例
+expiry_sweeper = ExpirySweeper()
+
+
+if __name__ == '__main__':
+    from sqlite_bootstrap import connect
+
+    db_path = os.environ.get('DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mozibang_activation.db'))
+    if len(sys.argv) < 2 or sys.argv[1] != 'sweep':
+        print("用法: python pro_expiry.py sweep")
+        sys.exit(1)
+
+    conn = connect(db_path)
+    ensure_schema(conn)
+    swept = expiry_sweeper.sweep(conn)
+    print(f"✅ 已标记 {swept} 个到期用户: {db_path}")
+    conn.close()
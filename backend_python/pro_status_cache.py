@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - Pro状态缓存
+按邮箱缓存 /api/verify_pro 的查询结果（LRU + TTL），
+激活、撤销等写操作通过 cache_invalidations 表通知所有进程失效
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 缓存配置
+PRO_STATUS_CACHE_SIZE = int(os.environ.get('PRO_STATUS_CACHE_SIZE', 10000))
+PRO_STATUS_CACHE_TTL = float(os.environ.get('PRO_STATUS_CACHE_TTL', 60))
+PRO_STATUS_CACHE_SYNC_INTERVAL = float(os.environ.get('PRO_STATUS_CACHE_SYNC_INTERVAL', 1))
+
+# 失效记录保留时间，远大于TTL即可
+INVALIDATION_RETENTION = '-1 hour'
+
+
+def ensure_schema(conn):
+    """创建跨进程失效通知表"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache_invalidations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cache_key TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+class ProStatusCache:
+    """线程安全的LRU + TTL缓存"""
+
+    def __init__(self, max_size=PRO_STATUS_CACHE_SIZE, ttl=PRO_STATUS_CACHE_TTL,
+                 sync_interval=PRO_STATUS_CACHE_SYNC_INTERVAL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._entries = OrderedDict()  # email -> (过期时间, 值)
+        self._generation = 0
+        self._next_sync = 0.0
+        self._last_invalidation_id = None
+        self._schema_ready = False
+        self._metrics = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'stale_sets_skipped': 0,
+            'sync_errors': 0,
+        }
+
+    @property
+    def generation(self):
+        """失效代数，查库前记录，写回缓存时用于丢弃并发失效前读到的旧值"""
+        return self._generation
+
+    def get(self, key):
+        """返回 (是否命中, 缓存值)，缓存值可以是 None（表示用户不存在或未激活）"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._metrics['misses'] += 1
+                return False, None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self._metrics['expired'] += 1
+                self._metrics['misses'] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._metrics['hits'] += 1
+            return True, value
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                self._metrics['stale_sets_skipped'] += 1
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._metrics['evictions'] += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._metrics['invalidations'] += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def _ensure_schema(self, conn):
+        if not self._schema_ready:
+            ensure_schema(conn)
+            self._schema_ready = True
+
+    def publish_invalidation(self, conn, key):
+        """
+        在调用方的事务中写入失效记录，其他进程在下一次 sync_invalidations() 时失效；
+        调用方提交事务后还需调用 invalidate() 失效本进程缓存；
+        缓存未命中时从 users 表回填，因此同一事务中必须已更新 users.pro_status
+        """
+        self._ensure_schema(conn)
+        conn.execute("INSERT INTO cache_invalidations (cache_key) VALUES (?)", (key,))
+        conn.execute(
+            "DELETE FROM cache_invalidations WHERE created_at < datetime('now', ?)",
+            (INVALIDATION_RETENTION,)
+        )
+
+    def sync_invalidations(self, connection_factory):
+        """每隔 sync_interval 秒拉取一次其他进程发布的失效记录"""
+        now = time.monotonic()
+        if now < self._next_sync or not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sync = now + self.sync_interval
+            conn = connection_factory()
+            try:
+                self._ensure_schema(conn)
+                if self._last_invalidation_id is None:
+                    row = conn.execute("SELECT MAX(id) FROM cache_invalidations").fetchone()
+                    self._last_invalidation_id = row[0] or 0
+                    return
+                rows = conn.execute(
+                    "SELECT id, cache_key FROM cache_invalidations WHERE id > ? ORDER BY id",
+                    (self._last_invalidation_id,)
+                ).fetchall()
+            finally:
+                conn.close()
+            for invalidation_id, key in rows:
+                self.invalidate(key)
+                self._last_invalidation_id = invalidation_id
+        except sqlite3.Error:
+            # 同步失败时缓存最多陈旧一个TTL
+            self._metrics['sync_errors'] += 1
+        finally:
+            self._sync_lock.release()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+            lookups = stats['hits'] + stats['misses']
+            stats.update({
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hit_rate': round(stats['hits'] / lookups, 4) if lookups else 0,
+            })
+            return stats
+
+
+# 进程级单例
+pro_status_cache = ProStatusCache()
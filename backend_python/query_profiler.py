@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - SQL查询分析
+按规范化后的SQL（字面量替换为 ?、IN 列表和多行 VALUES 折叠）汇总调用次数和耗时；
+单次耗时超过 SLOW_QUERY_MS 的语句记入慢查询日志，附带执行计划：
+- SQLite：通过连接池的查询观察者计时，EXPLAIN QUERY PLAN 在后台线程用独立连接执行，
+  同一语句的计划只取一次；
+- MySQL：get_db_connection() 使用 mysql_cursor_class() 生成的游标类，慢查询当场 EXPLAIN。
+SQLite 的 SELECT 在取行时才真正执行，execute 和 fetch 分别计时，慢查询日志标明阶段。
+
+管理后台 /admin/queries 查看汇总和最近的慢查询，?format=json 返回JSON
+"""
+
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+
+from flask import Blueprint, g, has_request_context, jsonify, render_template, request, session
+
+from sqlite_pool import add_query_observer
+from structured_logging import get_logger
+
+QUERY_PROFILER_ENABLED = os.environ.get('QUERY_PROFILER_ENABLED', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get('SLOW_QUERY_LOG_SIZE', 200))
+# 汇总表最多保留的不同语句数，超出后新语句只计入 untracked
+QUERY_PROFILER_MAX_STATEMENTS = int(os.environ.get('QUERY_PROFILER_MAX_STATEMENTS', 1000))
+
+# 计入调用次数的阶段（fetch 只累加耗时）
+_CALL_PHASES = ('execute', 'executemany', 'executescript', 'commit')
+
+log = get_logger('mozibang.queries')
+
+_COMMENT_RE = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_MYSQL_PARAM_RE = re.compile(r'%\(\w+\)s|%s')
+_IN_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)', re.I)
+_VALUES_ROW = r'\(\s*\?(?:\s*,\s*\?)*\s*\)'
+_VALUES_RE = re.compile(rf'{_VALUES_ROW}(?:\s*,\s*{_VALUES_ROW})+')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def _normalize(sql):
+    sql = _COMMENT_RE.sub(' ', sql)
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _MYSQL_PARAM_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('IN (?...)', sql)
+    sql = _VALUES_RE.sub('(?...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+_normalize_cached = lru_cache(maxsize=4096)(_normalize)
+
+
+def normalize_sql(sql):
+    """规范化SQL，用作汇总的键；代码中的常量SQL走缓存"""
+    if not sql:
+        return ''
+    if len(sql) > 2048:
+        return _normalize(sql)
+    return _normalize_cached(sql)
+
+
+def _placeholder_count(sql):
+    return _STRING_RE.sub('', sql).count('?')
+
+
+def _request_info():
+    if has_request_context():
+        return request.endpoint, g.get('request_id')
+    return None, None
+
+
+class QueryProfiler:
+    """按语句汇总耗时并保留最近的慢查询"""
+
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, log_size=SLOW_QUERY_LOG_SIZE,
+                 max_statements=QUERY_PROFILER_MAX_STATEMENTS):
+        self.slow_query_ms = slow_query_ms
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self._statements = {}  # (backend, 规范化SQL) -> 汇总
+        self._slow = deque(maxlen=log_size)
+        self._untracked = 0
+        self._started_at = time.time()
+
+    def record(self, backend, sql, elapsed, phase='execute'):
+        """记录一次计时，超过阈值时返回慢查询条目（计划由调用方补充），否则返回 None"""
+        key = (backend, normalize_sql(sql))
+        elapsed_ms = elapsed * 1000
+        slow = elapsed_ms >= self.slow_query_ms
+        with self._lock:
+            stat = self._statements.get(key)
+            if stat is None:
+                if len(self._statements) >= self.max_statements:
+                    self._untracked += 1
+                    return None
+                stat = self._statements[key] = {
+                    'calls': 0, 'fetches': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'slow': 0, 'plan': None,
+                }
+            if phase in _CALL_PHASES:
+                stat['calls'] += 1
+            else:
+                stat['fetches'] += 1
+            stat['total_ms'] += elapsed_ms
+            stat['max_ms'] = max(stat['max_ms'], elapsed_ms)
+            stat['last_seen'] = time.time()
+            if not slow:
+                return None
+            stat['slow'] += 1
+            plan = stat['plan']
+
+        endpoint, request_id = _request_info()
+        entry = {
+            'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'backend': backend,
+            'sql': key[1],
+            'phase': phase,
+            'elapsed_ms': round(elapsed_ms, 3),
+            'endpoint': endpoint,
+            'request_id': request_id,
+            'plan': plan,
+        }
+        with self._lock:
+            self._slow.appendleft(entry)
+        return entry
+
+    def set_plan(self, backend, sql, plan):
+        with self._lock:
+            stat = self._statements.get((backend, normalize_sql(sql)))
+            if stat is not None:
+                stat['plan'] = plan
+
+    def statements(self, order_by='total_ms', limit=100):
+        """按总耗时（或 calls / max_ms / avg_ms）倒序的语句汇总"""
+        with self._lock:
+            items = [(key, dict(stat)) for key, stat in self._statements.items()]
+        result = []
+        for (backend, sql), stat in items:
+            result.append({
+                'backend': backend,
+                'sql': sql,
+                'calls': stat['calls'],
+                'fetches': stat['fetches'],
+                'total_ms': round(stat['total_ms'], 3),
+                'avg_ms': round(stat['total_ms'] / stat['calls'], 3) if stat['calls'] else 0,
+                'max_ms': round(stat['max_ms'], 3),
+                'slow': stat['slow'],
+                'plan': stat['plan'],
+                'last_seen': datetime.fromtimestamp(stat['last_seen']).strftime('%Y-%m-%d %H:%M:%S'),
+            })
+        if order_by not in ('total_ms', 'calls', 'max_ms', 'avg_ms', 'slow'):
+            order_by = 'total_ms'
+        result.sort(key=lambda item: item[order_by], reverse=True)
+        return result[:limit]
+
+    def slow_queries(self, limit=None):
+        with self._lock:
+            entries = list(self._slow)
+        return entries[:limit] if limit else entries
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._slow.clear()
+            self._untracked = 0
+            self._started_at = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'statements': len(self._statements),
+                'untracked': self._untracked,
+                'slow_logged': len(self._slow),
+                'slow_query_ms': self.slow_query_ms,
+                'since': datetime.fromtimestamp(self._started_at).strftime('%Y-%m-%d %H:%M:%S'),
+            }
+
+
+# 进程级单例
+query_profiler = QueryProfiler()
+
+
+def _log_slow(entry):
+    log.warning('slow_query', sql=entry['sql'], phase=entry['phase'], elapsed_ms=entry['elapsed_ms'],
+                backend=entry['backend'], endpoint=entry['endpoint'], request_id=entry['request_id'],
+                plan=entry['plan'])
+
+
+class _SQLiteExplainer:
+    """后台线程执行 EXPLAIN QUERY PLAN，使用独立连接（不经过连接池，不会被再次计时）"""
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=100)
+        self._connections = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, db_path, sql, parameters, entry):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='query-explainer', daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait((db_path, sql, parameters, entry))
+        except queue.Full:
+            _log_slow(entry)
+
+    def _plan(self, db_path, sql, parameters):
+        conn = self._connections.get(db_path)
+        if conn is None:
+            conn = self._connections[db_path] = sqlite3.connect(db_path)
+        if parameters is None or (isinstance(parameters, (list, tuple)) and len(parameters) != _placeholder_count(sql)):
+            parameters = [None] * _placeholder_count(sql)
+        rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+        return [row[-1] for row in rows]
+
+    def _run(self):
+        while True:
+            db_path, sql, parameters, entry = self._queue.get()
+            if entry['plan'] is None:
+                try:
+                    entry['plan'] = self._plan(db_path, sql, parameters)
+                    query_profiler.set_plan('sqlite', sql, entry['plan'])
+                except Exception as e:
+                    entry['plan'] = [f'EXPLAIN failed: {e}']
+            _log_slow(entry)
+
+
+_explainer = _SQLiteExplainer()
+
+
+def _observe_sqlite(timing):
+    entry = query_profiler.record('sqlite', timing.sql, timing.elapsed, timing.phase)
+    if entry is None:
+        return
+    if timing.phase in ('execute', 'fetch') and timing.db_path and entry['plan'] is None:
+        _explainer.submit(timing.db_path, timing.sql, timing.parameters, entry)
+    else:
+        _log_slow(entry)
+
+
+def install():
+    """在当前进程启用SQLite查询分析（注册连接池观察者）"""
+    if QUERY_PROFILER_ENABLED:
+        add_query_observer(_observe_sqlite)
+
+
+def mysql_cursor_class(base=None):
+    """
+    返回带计时的 PyMySQL 游标类，用于 pymysql.connect(cursorclass=...)
+    PyMySQL 的 executemany 内部调用 execute，因此只需覆盖 execute
+    """
+    import pymysql.cursors
+
+    base = base or pymysql.cursors.Cursor
+    if not QUERY_PROFILER_ENABLED:
+        return base
+
+    class ProfiledCursor(base):
+        def execute(self, query, args=None):
+            started = time.perf_counter()
+            try:
+                return super().execute(query, args)
+            finally:
+                entry = query_profiler.record('mysql', query, time.perf_counter() - started)
+                if entry is not None:
+                    if entry['plan'] is None:
+                        entry['plan'] = self._explain(query, args)
+                        query_profiler.set_plan('mysql', query, entry['plan'])
+                    _log_slow(entry)
+
+        def _explain(self, query, args):
+            if query.lstrip()[:6].upper() not in ('SELECT', 'UPDATE', 'DELETE', 'INSERT'):
+                return None
+            try:
+                with self.connection.cursor(pymysql.cursors.Cursor) as cursor:
+                    cursor.execute('EXPLAIN ' + query, args)
+                    columns = [column[0] for column in cursor.description]
+                    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            except Exception as e:
+                return [f'EXPLAIN failed: {e}']
+
+    ProfiledCursor.__name__ = f'Profiled{base.__name__}'
+    return ProfiledCursor
+
+
+# 管理后台查询分析页面
+profiler_bp = Blueprint('profiler', __name__, url_prefix='/admin/queries')
+
+
+@profiler_bp.before_request
+def require_admin():
+    if 'admin_user' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Login required',
+            'error_code': 'LOGIN_REQUIRED'
+        }), 401
+
+
+@profiler_bp.route('', methods=['GET'])
+def query_profile():
+    """
+    语句汇总和慢查询
+    GET /admin/queries?order_by=total_ms&limit=100&format=json
+    """
+    order_by = request.args.get('order_by', 'total_ms')
+    limit = request.args.get('limit', 100, type=int)
+    data = {
+        'summary': query_profiler.stats(),
+        'statements': query_profiler.statements(order_by, limit),
+        'slow_queries': query_profiler.slow_queries(limit),
+    }
+    if request.args.get('format') == 'json':
+        return jsonify({'success': True, 'data': data})
+    return render_template('query_profile.html', order_by=order_by, **data)
+
+
+@profiler_bp.route('/reset', methods=['POST'])
+def reset_profile():
+    """清空汇总和慢查询日志"""
+    query_profiler.reset()
+    return jsonify({'success': True, 'message': 'Query profile reset'})
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - 兑换限流与防暴力枚举
+- 令牌桶：/api/activate 按 IP 和邮箱、/api/check 按 IP 限流，失败的猜测额外扣除令牌；
+  默认在进程内计数，设置 RATE_LIMIT_SHARED_DB 后所有 gunicorn worker 共享一个 SQLite 文件中的令牌桶
+  （与业务库分开，不争抢业务库的写锁）；
+- 负查询缓存：最近查询失败的激活码（不存在 / 已使用或禁用）在 TTL 内直接拒绝，不再查库。
+  新生成的激活码是随机的，与缓存中的猜测值重合的概率可以忽略，TTL 到期后自然失效。
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import jsonify, request
+
+from pro_status_cache import ProStatusCache
+from sqlite_bootstrap import connect
+from structured_logging import get_logger
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+# 共享令牌桶的 SQLite 文件（为空表示每个进程单独计数）
+RATE_LIMIT_SHARED_DB = os.environ.get('RATE_LIMIT_SHARED_DB', '')
+# 位于几层反向代理之后；大于0时从 X-Forwarded-For 取客户端IP
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', 0))
+# 失败的猜测额外扣除的令牌数
+RATE_LIMIT_FAILURE_COST = float(os.environ.get('RATE_LIMIT_FAILURE_COST', 2))
+# 进程内最多跟踪的令牌桶数（LRU淘汰）
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+
+# 规则：名称 -> (桶容量, 每分钟补充的令牌数)
+RATE_LIMIT_RULES = {
+    'activate_ip': (float(os.environ.get('RATE_LIMIT_ACTIVATE_IP_BURST', 20)),
+                    float(os.environ.get('RATE_LIMIT_ACTIVATE_IP_PER_MINUTE', 10))),
+    'activate_email': (float(os.environ.get('RATE_LIMIT_ACTIVATE_EMAIL_BURST', 10)),
+                       float(os.environ.get('RATE_LIMIT_ACTIVATE_EMAIL_PER_MINUTE', 5))),
+    'check_ip': (float(os.environ.get('RATE_LIMIT_CHECK_IP_BURST', 60)),
+                 float(os.environ.get('RATE_LIMIT_CHECK_IP_PER_MINUTE', 30))),
+}
+
+NEGATIVE_CACHE_SIZE = int(os.environ.get('NEGATIVE_CACHE_SIZE', 50000))
+NEGATIVE_CACHE_TTL = float(os.environ.get('NEGATIVE_CACHE_TTL', 600))
+
+# 共享令牌桶中超过该时间未访问的行会被清理（秒）
+SHARED_BUCKET_RETENTION = 3600
+SHARED_PRUNE_INTERVAL = 60
+
+log = get_logger('mozibang.rate_limit')
+
+
+class MemoryBuckets:
+    """进程内令牌桶（LRU淘汰最久未访问的键）"""
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> [令牌数, 更新时间]
+
+    def take(self, key, capacity, rate, cost, now):
+        """取 cost 个令牌，返回 (是否允许, 剩余令牌数)"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [capacity, now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            bucket[0], bucket[1] = tokens, now
+            return allowed, tokens
+
+    def penalize(self, key, capacity, rate, cost, now):
+        """无条件扣除令牌（最多扣到 -capacity），用于失败的猜测"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[0], bucket[1] = max(-capacity, tokens - cost), now
+
+    def size(self):
+        with self._lock:
+            return len(self._buckets)
+
+
+class SQLiteBuckets:
+    """
+    多进程共享的令牌桶：每次取令牌是一条 UPSERT ... RETURNING，补充和扣除在同一条语句中完成。
+    数据只是限流状态，文件使用 synchronous=OFF，崩溃丢失只会让计数重新开始
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._next_prune = 0.0
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect(self.db_path, isolation_level=None)
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    allowed INTEGER NOT NULL
+                ) WITHOUT ROWID
+            """)
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, capacity, rate, cost, now):
+        conn = self._conn()
+        params = {'key': key, 'capacity': capacity, 'rate': rate, 'cost': cost, 'now': now}
+        # SET 中的表达式都基于更新前的行计算
+        tokens, allowed = conn.execute("""
+            INSERT INTO rate_limit_buckets (key, tokens, updated_at, allowed)
+            VALUES (:key, :capacity - :cost, :now, 1)
+            ON CONFLICT(key) DO UPDATE SET
+                tokens = MIN(:capacity, tokens + (:now - updated_at) * :rate)
+                         - CASE WHEN MIN(:capacity, tokens + (:now - updated_at) * :rate) >= :cost
+                                THEN :cost ELSE 0 END,
+                allowed = MIN(:capacity, tokens + (:now - updated_at) * :rate) >= :cost,
+                updated_at = :now
+            RETURNING tokens, allowed
+        """, params).fetchone()
+        if now >= self._next_prune:
+            self._next_prune = now + SHARED_PRUNE_INTERVAL
+            conn.execute("DELETE FROM rate_limit_buckets WHERE updated_at < ?", (now - SHARED_BUCKET_RETENTION,))
+        return bool(allowed), tokens
+
+    def penalize(self, key, capacity, rate, cost, now):
+        self._conn().execute("""
+            UPDATE rate_limit_buckets
+            SET tokens = MAX(-:capacity, MIN(:capacity, tokens + (:now - updated_at) * :rate) - :cost),
+                updated_at = :now
+            WHERE key = :key
+        """, {'key': key, 'capacity': capacity, 'rate': rate, 'cost': cost, 'now': now})
+
+    def size(self):
+        return self._conn().execute("SELECT COUNT(*) FROM rate_limit_buckets").fetchone()[0]
+
+
+class RateLimiter:
+    """按规则组合令牌桶；存储出错时放行（fail open），只记录错误"""
+
+    def __init__(self, rules=None, shared_db=RATE_LIMIT_SHARED_DB, enabled=RATE_LIMIT_ENABLED,
+                 failure_cost=RATE_LIMIT_FAILURE_COST):
+        self.rules = dict(rules or RATE_LIMIT_RULES)
+        self.enabled = enabled
+        self.failure_cost = failure_cost
+        self.store = SQLiteBuckets(shared_db) if shared_db else MemoryBuckets()
+        self._lock = threading.Lock()
+        self._metrics = {'allowed': 0, 'limited': 0, 'penalties': 0, 'store_errors': 0}
+        self._limited_by_rule = {}
+
+    def _rule(self, rule):
+        capacity, per_minute = self.rules[rule]
+        return capacity, per_minute / 60.0
+
+    def check(self, *checks):
+        """
+        依次检查 (规则, 键)，全部允许返回 None，否则返回建议的重试等待秒数；
+        前面的规则已拒绝时不再消耗后面规则的令牌
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        for rule, key in checks:
+            if not key:
+                continue
+            capacity, rate = self._rule(rule)
+            try:
+                allowed, tokens = self.store.take(f'{rule}:{key}', capacity, rate, 1, now)
+            except sqlite3.Error as e:
+                self._count('store_errors')
+                log.warning('rate_limit_store_error', error=str(e))
+                continue
+            if not allowed:
+                with self._lock:
+                    self._metrics['limited'] += 1
+                    self._limited_by_rule[rule] = self._limited_by_rule.get(rule, 0) + 1
+                return max(1, math.ceil((1 - tokens) / rate)) if rate > 0 else 60
+        self._count('allowed')
+        return None
+
+    def penalize(self, *checks):
+        """失败的猜测额外扣除令牌"""
+        if not self.enabled or self.failure_cost <= 0:
+            return
+        now = time.time()
+        for rule, key in checks:
+            if not key:
+                continue
+            capacity, rate = self._rule(rule)
+            try:
+                self.store.penalize(f'{rule}:{key}', capacity, rate, self.failure_cost, now)
+            except sqlite3.Error as e:
+                self._count('store_errors')
+                log.warning('rate_limit_store_error', error=str(e))
+                continue
+            self._count('penalties')
+
+    def _count(self, key):
+        with self._lock:
+            self._metrics[key] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics, limited_by_rule=dict(self._limited_by_rule))
+        stats.update({
+            'enabled': self.enabled,
+            'backend': 'sqlite' if isinstance(self.store, SQLiteBuckets) else 'memory',
+            'rules': {name: {'burst': burst, 'per_minute': per_minute}
+                      for name, (burst, per_minute) in self.rules.items()},
+        })
+        try:
+            stats['buckets'] = self.store.size()
+        except sqlite3.Error:
+            stats['buckets'] = None
+        return stats
+
+
+def client_ip():
+    """客户端IP；位于 RATE_LIMIT_TRUSTED_PROXIES 层代理之后时取 X-Forwarded-For 中对应的一项"""
+    if RATE_LIMIT_TRUSTED_PROXIES > 0:
+        forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+        if len(forwarded) >= RATE_LIMIT_TRUSTED_PROXIES:
+            return forwarded[-RATE_LIMIT_TRUSTED_PROXIES]
+    return request.remote_addr
+
+
+def rate_limited_response(retry_after):
+    response = jsonify({
+        'success': False,
+        'message': 'Too many requests, please retry later',
+        'error_code': 'RATE_LIMITED'
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+# 进程级单例
+rate_limiter = RateLimiter()
+# 负查询缓存：激活码 -> 'missing'（不存在）或 'unavailable'（已使用或已禁用）
+negative_code_cache = ProStatusCache(max_size=NEGATIVE_CACHE_SIZE, ttl=NEGATIVE_CACHE_TTL)
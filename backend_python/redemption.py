@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - 激活码兑换
+一次兑换在 BEGIN IMMEDIATE 事务中完成，开始时就拿到写锁，不会在读后升级锁时遇到 SQLITE_BUSY：
+1. 条件更新 UPDATE ... WHERE is_used = 0 AND is_disabled = 0 AND 用户不是未到期的有效Pro ... RETURNING，
+   可用性检查和占用在同一条语句里完成，并发请求同一个激活码只有一个能更新到行；
+2. users / pro_users 用 UPSERT 写入，不需要先查询用户是否存在；
+3. 拿不到写锁（database is locked / busy）时回滚并按指数退避重试。
+"""
+
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+# 遇到 SQLITE_BUSY 时的最大重试次数和初始退避时间（秒）
+REDEEM_MAX_RETRIES = int(os.environ.get('REDEEM_MAX_RETRIES', 5))
+REDEEM_RETRY_BACKOFF = float(os.environ.get('REDEEM_RETRY_BACKOFF', 0.02))
+
+TERM_DAYS = {'pro_lifetime': None, 'pro_1year': 365, 'pro_6month': 180}
+# 未知类型按一年处理
+DEFAULT_TERM_DAYS = 365
+
+Redemption = namedtuple('Redemption', 'code_type is_lifetime expires_at')
+
+_stats_lock = threading.Lock()
+_stats = {'redeemed': 0, 'rejected': 0, 'busy_retries': 0, 'busy_failures': 0}
+
+
+class RedemptionRejected(Exception):
+    """激活码不可用或用户已是Pro，error_code 与API返回的错误码一致"""
+
+    def __init__(self, error_code, message):
+        super().__init__(message)
+        self.error_code = error_code
+        self.message = message
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats, max_retries=REDEEM_MAX_RETRIES)
+
+
+def _is_busy(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def compute_expiry(code_type, now=None):
+    """返回 (是否永久, 到期时间ISO字符串或None)"""
+    days = TERM_DAYS.get(code_type, DEFAULT_TERM_DAYS)
+    if days is None:
+        return True, None
+    return False, ((now or datetime.now()) + timedelta(days=days)).isoformat()
+
+
+def _redeem_once(conn, activation_code, user_email, user_name, user_token, before_commit):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute("""
+            UPDATE activation_codes
+            SET is_used = 1, used_by = ?, used_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE code = ? AND is_used = 0 AND is_disabled = 0
+              AND NOT EXISTS (
+                  SELECT 1 FROM users WHERE email = ? AND pro_status = 'active'
+                    AND (pro_expires_epoch IS NULL OR pro_expires_epoch > ?)
+              )
+            RETURNING code_type
+        """, (user_email, activation_code, user_email, int(time.time()))).fetchone()
+
+        if row is None:
+            # 没有更新到行：区分激活码不可用和用户已是Pro（只在失败路径上多查一次）
+            available = conn.execute("""
+                SELECT 1 FROM activation_codes WHERE code = ? AND is_used = 0 AND is_disabled = 0
+            """, (activation_code,)).fetchone()
+            conn.rollback()
+            if available:
+                raise RedemptionRejected('ALREADY_PRO_USER', 'User already has active Pro status')
+            raise RedemptionRejected('INVALID_CODE', 'Invalid or already used activation code')
+
+        code_type = row[0]
+        is_lifetime, expires_at = compute_expiry(code_type)
+
+        conn.execute("""
+            INSERT INTO users
+            (email, token, pro_status, pro_activated_at, pro_expires_at, activation_code)
+            VALUES (?, ?, 'active', CURRENT_TIMESTAMP, ?, ?)
+            ON CONFLICT(email) DO UPDATE SET
+                pro_status = 'active', pro_activated_at = excluded.pro_activated_at,
+                pro_expires_at = excluded.pro_expires_at, activation_code = excluded.activation_code,
+                token = excluded.token, updated_at = CURRENT_TIMESTAMP
+        """, (user_email, user_token, expires_at, activation_code))
+
+        # 已有记录时原地更新，统计触发器按重新激活处理
+        conn.execute("""
+            INSERT INTO pro_users
+            (user_email, user_name, pro_type, activation_code, activated_at, expires_at,
+             is_lifetime, is_active, user_token, created_at, updated_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?, 1, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_email) DO UPDATE SET
+                user_name = excluded.user_name, pro_type = excluded.pro_type,
+                activation_code = excluded.activation_code, activated_at = excluded.activated_at,
+                expires_at = excluded.expires_at, is_lifetime = excluded.is_lifetime, is_active = 1,
+                user_token = excluded.user_token, revoked_at = NULL, revoked_reason = NULL,
+                updated_at = excluded.updated_at
+        """, (user_email, user_name or '', code_type, activation_code, expires_at, is_lifetime, user_token))
+
+        if before_commit:
+            before_commit(conn)
+        conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    return Redemption(code_type, is_lifetime, expires_at)
+
+
+def redeem_code(conn, activation_code, user_email, user_name, user_token, before_commit=None):
+    """
+    兑换激活码，成功返回 Redemption，激活码不可用或用户已是Pro时抛出 RedemptionRejected
+    before_commit(conn): 在同一事务提交前执行（如写入缓存失效记录）
+    conn 不能处于未提交的事务中
+    """
+    attempt = 0
+    while True:
+        try:
+            result = _redeem_once(conn, activation_code, user_email, user_name, user_token, before_commit)
+        except RedemptionRejected:
+            _count('rejected')
+            raise
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e) or attempt >= REDEEM_MAX_RETRIES:
+                if _is_busy(e):
+                    _count('busy_failures')
+                raise
+            _count('busy_retries')
+            time.sleep(REDEEM_RETRY_BACKOFF * (2 ** attempt) * (0.5 + random.random()))
+            attempt += 1
+            continue
+        _count('redeemed')
+        return result
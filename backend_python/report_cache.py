@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - 统计报表缓存
+统计页面的数据整体缓存：
+- 未超过 REPORT_CACHE_TTL 直接返回；
+- 超过TTL但未超过 REPORT_CACHE_MAX_STALE 时先返回旧数据，同时在后台线程重新计算；
+- 没有缓存、旧数据过老或已被 invalidate() 时同步计算。
+同一个键同时只有一个线程在计算，并发访问的管理员共享同一次查询结果。
+
+写操作在自己的事务中调用 publish_invalidation() 递增 report_invalidations 表中的版本号，
+各进程（gunicorn worker、独立的 job_queue worker）每隔 REPORT_CACHE_SYNC_INTERVAL 秒读取版本号并失效；
+失效代数保证失效之前开始的计算不会把旧数据写回缓存
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from structured_logging import get_logger
+
+REPORT_CACHE_TTL = float(os.environ.get('REPORT_CACHE_TTL', 60))
+REPORT_CACHE_MAX_STALE = float(os.environ.get('REPORT_CACHE_MAX_STALE', 600))
+REPORT_CACHE_SYNC_INTERVAL = float(os.environ.get('REPORT_CACHE_SYNC_INTERVAL', 1))
+# 失效全部报表时记录的键
+ALL_REPORTS = '*'
+
+log = get_logger('mozibang.report_cache')
+
+
+def ensure_schema(conn):
+    """创建跨进程失效版本表（每个键一行，不会增长）"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS report_invalidations (
+            cache_key TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+
+class ReportCache:
+    """带后台刷新的报表缓存"""
+
+    def __init__(self, ttl=REPORT_CACHE_TTL, max_stale=REPORT_CACHE_MAX_STALE,
+                 sync_interval=REPORT_CACHE_SYNC_INTERVAL):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._entries = {}  # key -> (计算完成时间, 值)
+        self._key_locks = {}
+        self._refreshing = set()
+        self._generation = 0
+        self._next_sync = 0.0
+        self._seen_versions = None  # cache_key -> 已处理的版本号
+        self._schema_ready = False
+        self._metrics = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+            'invalidations': 0,
+            'stale_sets_skipped': 0,
+            'sync_errors': 0,
+        }
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get(self, key, compute):
+        """
+        返回 (值, 计算时间戳, 是否为过期数据)
+        compute() 抛出的异常在同步计算时直接向上抛出
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            age = now - entry[0]
+            if age < self.ttl:
+                self._count('hits')
+                return entry[1], entry[0], False
+            if age < self.max_stale:
+                self._count('stale_hits')
+                self._refresh_in_background(key, compute)
+                return entry[1], entry[0], True
+
+        self._count('misses')
+        with self._key_lock(key):
+            # 等待期间其他线程可能已算好
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] < self.ttl:
+                return entry[1], entry[0], False
+            computed_at, value = self._compute(key, compute)
+            return value, computed_at, False
+
+    def _compute(self, key, compute):
+        with self._lock:
+            generation = self._generation
+        value = compute()
+        computed_at = time.time()
+        with self._lock:
+            self._metrics['refreshes'] += 1
+            # 计算期间发生了失效：结果可能早于那次写操作，只返回给本次调用方，不写回缓存
+            if generation != self._generation:
+                self._metrics['stale_sets_skipped'] += 1
+            else:
+                self._entries[key] = (computed_at, value)
+        return computed_at, value
+
+    def _refresh_in_background(self, key, compute):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                with self._key_lock(key):
+                    self._compute(key, compute)
+            except Exception as e:
+                self._count('refresh_errors')
+                log.error('report_cache_refresh_error', key=key, error=str(e))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name=f'report-refresh-{key}', daemon=True).start()
+
+    def invalidate(self, key=None):
+        """写操作提交后调用，失效本进程缓存，下次访问同步重新计算；key 为空时清空全部"""
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self._metrics['invalidations'] += 1
+
+    def _ensure_schema(self, conn):
+        if not self._schema_ready:
+            ensure_schema(conn)
+            self._schema_ready = True
+
+    def publish_invalidation(self, conn, key=None):
+        """
+        在调用方的事务中递增失效版本号，其他进程在下一次 sync_invalidations() 时失效；
+        调用方提交事务后还需调用 invalidate() 失效本进程缓存
+        """
+        self._ensure_schema(conn)
+        conn.execute("""
+            INSERT INTO report_invalidations (cache_key, version) VALUES (?, 1)
+            ON CONFLICT(cache_key) DO UPDATE SET version = version + 1
+        """, (key or ALL_REPORTS,))
+
+    def sync_invalidations(self, connection_factory):
+        """每隔 sync_interval 秒读取一次其他进程发布的失效版本号"""
+        now = time.monotonic()
+        if now < self._next_sync or not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sync = now + self.sync_interval
+            conn = connection_factory()
+            try:
+                self._ensure_schema(conn)
+                versions = dict(conn.execute("SELECT cache_key, version FROM report_invalidations").fetchall())
+            finally:
+                conn.close()
+            seen, self._seen_versions = self._seen_versions, versions
+            if seen is None:
+                # 第一次同步：本进程缓存为空，只记录当前版本
+                return
+            for key, version in versions.items():
+                if seen.get(key) != version:
+                    self.invalidate(None if key == ALL_REPORTS else key)
+        except sqlite3.Error as e:
+            # 同步失败时报表最多陈旧 max_stale
+            self._count('sync_errors')
+            log.warning('report_cache_sync_error', error=str(e))
+        finally:
+            self._sync_lock.release()
+
+    def _count(self, name):
+        with self._lock:
+            self._metrics[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+            stats.update({
+                'entries': len(self._entries),
+                'refreshing': len(self._refreshing),
+                'ttl_seconds': self.ttl,
+                'max_stale_seconds': self.max_stale,
+                'sync_interval_seconds': self.sync_interval,
+            })
+            return stats
+
+
+# 进程级单例
+report_cache = ReportCache()
+
+
+def get_statistics_page_data(days=30, force_refresh=False):
+    """
+    统计页面所需的全部数据（经缓存）
+    返回 (数据字典, 计算时间戳, 是否为过期数据)
+    """
+    from statistics_report import ActivationStatistics
+
+    def compute():
+        stats = ActivationStatistics()
+        revenue_estimation = stats.get_revenue_estimation()
+        activity = stats.get_statistics_page_activity()
+        return {
+            'activation_overview': stats.get_activation_overview(),
+            'user_stats': stats.get_user_statistics(),
+            'daily_trends': stats.get_daily_activation_trend(days=days),
+            'revenue_estimation': revenue_estimation,
+            'total_revenue': revenue_estimation.get('total_estimated_revenue', 0),
+            'recent_users': activity['recent_users'],
+            'expiring_users': activity['expiring_users'],
+        }
+
+    from statistics_report import get_db_connection
+
+    report_cache.sync_invalidations(get_db_connection)
+    key = f'statistics_page:{days}'
+    if force_refresh:
+        report_cache.invalidate(key)
+    return report_cache.get(key, compute)
@@ -5,18 +5,55 @@ MoziBang 激活码验证API + 管理后台 - SQLite版本
 提供激活码验证、Pro状态管理、管理后台等功能
 """
 
-import sqlite3
 import hashlib
-import secrets
-import string
-from datetime import datetime, timedelta
+from datetime import datetime
 from functools import wraps
 from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, session
 from flask_cors import CORS
 import os
+import time
 import logging
+from sqlite_pool import get_pool
+from sqlite_bootstrap import bootstrap_database, connect, get_effective_settings
+from pro_status_cache import pro_status_cache, ensure_schema as ensure_cache_schema
+from write_behind import WriteBehindBuffer
+from stats_counters import (
+    ensure_schema as ensure_stats_counters, code_counts as get_code_counts,
+    user_status_counts as get_user_status_counts
+)
+from report_cache import report_cache, get_statistics_page_data
+from streaming_export import exports_bp, configure as configure_exports
+from event_log import event_buffer, events_bp, log_event, configure as configure_event_log, ensure_schema as ensure_event_schema
+from metrics import setup_metrics
+from query_profiler import profiler_bp, install as install_query_profiler
+from structured_logging import get_logger, setup_logging, stats as logging_stats
+from rate_limiter import rate_limiter, negative_code_cache, client_ip, rate_limited_response
+from code_filter import code_filter, notify_codes_added
+from daily_rollup import ensure_schema as ensure_rollup_schema
+from pro_expiry import expiry_sweeper, is_expired as is_pro_expired, ensure_schema as ensure_expiry_schema
+from redemption import redeem_code, RedemptionRejected, stats as redemption_stats
+from pagination import keyset_page, DEFAULT_PER_PAGE, ensure_indexes as ensure_list_indexes
+from code_generator import (
+    generate_codes_bulk, codes_csv_response, normalize_code, check_code_format, require_signing_keys,
+    format_stats as code_format_stats, MAX_BULK_CODES, GENERATE_DISPLAY_LIMIT
+)
+from entitlement_tokens import (
+    EntitlementTokenError, issue_entitlement_token, verify_entitlement_token,
+    record_revocation, get_revision, list_revocations, require_signing_key as require_entitlement_signing_key,
+    ensure_schema as ensure_entitlement_schema
+)
+from job_queue import (
+    job_runner, jobs_bp, current_admin_name, BACKGROUND_GENERATE_THRESHOLD,
+    ensure_schema as ensure_job_schema
+)
 
 app = Flask(__name__)
+setup_logging(app)
+log = get_logger('mozibang.api')
+app.register_blueprint(jobs_bp)
+app.register_blueprint(exports_bp)
+app.register_blueprint(events_bp)
+app.register_blueprint(profiler_bp)
 
 # 添加moment模板过滤器和全局函数
 @app.template_filter('moment')
@@ -49,6 +86,24 @@ else:
 # SQLite数据库文件路径
 DB_PATH = os.path.join(os.path.dirname(__file__), 'mozibang_activation.db')
 
+# 批量验证限制
+BATCH_VERIFY_MAX_EMAILS = int(os.environ.get('BATCH_VERIFY_MAX_EMAILS', 5000))
+BATCH_VERIFY_MAX_BYTES = int(os.environ.get('BATCH_VERIFY_MAX_BYTES', 1024 * 1024))
+BATCH_VERIFY_CHUNK_SIZE = 500
+
+# 后台任务与Web应用共用同一个数据库（延迟读取，DB_PATH 可被改写）
+job_runner.configure(lambda: DB_PATH)
+configure_exports(lambda: DB_PATH)
+configure_event_log(lambda: DB_PATH)
+code_filter.configure(lambda: DB_PATH)
+expiry_sweeper.configure(lambda: DB_PATH)
+install_query_profiler()
+
+# 权益令牌只用专用的签名私钥签发（扩展内置对应公钥），未配置时拒绝启动
+require_entitlement_signing_key()
+# 激活码校验位只用专用的签名密钥，未配置时拒绝启动
+require_signing_keys()
+
 # 管理员账户配置
 ADMIN_USERS = {
     'admin': 'admin123'
@@ -65,7 +120,8 @@ def login_required(f):
 
 def init_database():
     """初始化数据库表"""
-    conn = sqlite3.connect(DB_PATH)
+    journal_mode = bootstrap_database(DB_PATH)
+    conn = connect(DB_PATH)
     cursor = conn.cursor()
     
     # 创建激活码表 - 使用与代码匹配的字段名
@@ -108,6 +164,24 @@ def init_database():
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_is_used ON activation_codes(is_used)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_is_disabled ON activation_codes(is_disabled)')
     
+    # 列表游标分页使用的复合索引
+    ensure_list_indexes(conn)
+    
+    # 到期时间戳列与索引、统计计数表与维护触发器
+    ensure_expiry_schema(conn)
+    ensure_stats_counters(conn)
+    ensure_rollup_schema(conn)
+    
+    # 创建Pro状态缓存的跨进程失效通知表和权益令牌撤销列表
+    ensure_cache_schema(conn)
+    ensure_entitlement_schema(conn)
+    
+    # 创建后台任务表
+    ensure_job_schema(conn)
+    
+    # 创建只追加的事件日志表
+    ensure_event_schema(conn)
+    
     # 插入一些测试激活码
     test_codes = [
         ('MOZIBANG-PRO-2024', 'pro_lifetime', 'TEST-BATCH-001'),
@@ -123,14 +197,39 @@ def init_database():
     
     conn.commit()
     conn.close()
-    print("✅ 数据库初始化完成")
+    notify_codes_added(DB_PATH)
+    print(f"✅ 数据库初始化完成 (journal_mode={journal_mode})")
 
 def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # 使结果可以像字典一样访问
+    """
+    获取数据库连接（从进程内连接池借出，close() 即归还）
+    gunicorn 直接加载 app 时不会执行 init_database()，借出时补齐到期时间戳列和每日汇总触发器（就绪后只是一次集合查找）
+    """
+    conn = get_pool(DB_PATH).connection()
+    try:
+        ensure_expiry_schema(conn, DB_PATH)
+        ensure_rollup_schema(conn, DB_PATH)
+    except Exception:
+        conn.close()
+        raise
     return conn
 
+def flush_last_seen(entries):
+    """批量写入用户最后访问时间"""
+    conn = get_db_connection()
+    try:
+        conn.executemany("""
+            UPDATE users 
+            SET updated_at = ? 
+            WHERE email = ?
+        """, [(seen_at, email) for email, seen_at in entries])
+        conn.commit()
+    finally:
+        conn.close()
+
+# 最后访问时间写回缓冲，verify_pro 不再逐次写库
+last_seen_buffer = WriteBehindBuffer('last_seen', flush_last_seen)
+
 def verify_api_key(f):
     """API密钥验证装饰器"""
     @wraps(f)
@@ -145,14 +244,30 @@ def verify_api_key(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# 请求指标，/metrics 需API密钥
+setup_metrics(
+    app, verify_api_key,
+    caches={'pro_status': pro_status_cache.stats, 'report': report_cache.stats,
+            'negative_codes': negative_code_cache.stats},
+    buffers={'last_seen': last_seen_buffer.stats, 'event_log': event_buffer.stats},
+)
+
+@app.before_request
+def start_expiry_sweeper():
+    """在 worker 进程中启动到期清扫线程（gunicorn fork 之后）"""
+    expiry_sweeper.ensure_started()
+
 def generate_user_token(user_email):
     """生成用户令牌"""
     return hashlib.sha256(f"{user_email}_{datetime.now().isoformat()}".encode()).hexdigest()
 
-def generate_activation_code():
-    """生成激活码"""
-    chars = string.ascii_uppercase + string.digits
-    return ''.join(secrets.choice(chars) for _ in range(16))
+def invalid_code_format_response():
+    """激活码格式错误或校验位不符（通常是输错）"""
+    return jsonify({
+        'success': False,
+        'message': 'Invalid activation code format, please check for typos',
+        'error_code': 'INVALID_CODE_FORMAT'
+    }), 400
 
 def generate_batch_id():
     """生成批次ID"""
@@ -161,11 +276,38 @@ def generate_batch_id():
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查"""
+    try:
+        conn = get_db_connection()
+        sqlite_settings = get_effective_settings(conn)
+        conn.close()
+    except Exception as e:
+        log.exception('health_check_error')
+        return jsonify({
+            'status': 'unhealthy',
+            'timestamp': datetime.now().isoformat(),
+            'database': 'sqlite',
+            'database_file': DB_PATH,
+            'error': str(e)
+        }), 503
+    
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'database': 'sqlite',
-        'database_file': DB_PATH
+        'database_file': DB_PATH,
+        'sqlite_settings': sqlite_settings,
+        'connection_pool': get_pool(DB_PATH).stats(),
+        'pro_status_cache': pro_status_cache.stats(),
+        'last_seen_buffer': last_seen_buffer.stats(),
+        'report_cache': report_cache.stats(),
+        'event_log': event_buffer.stats(),
+        'redemption': redemption_stats(),
+        'rate_limiter': rate_limiter.stats(),
+        'negative_code_cache': negative_code_cache.stats(),
+        'code_filter': code_filter.stats(),
+        'code_format': code_format_stats(),
+        'expiry_sweeper': expiry_sweeper.stats(),
+        'logging': logging_stats()
     })
 
 @app.route('/api/fix_database', methods=['POST'])
@@ -190,6 +332,7 @@ def fix_database():
             }), 500
             
     except Exception as e:
+        log.exception('fix_database_error')
         return jsonify({
             'success': False,
             'message': f'Database fix error: {str(e)}',
@@ -218,6 +361,7 @@ def fix_schema():
             }), 500
             
     except Exception as e:
+        log.exception('fix_schema_error')
         return jsonify({
             'success': False,
             'message': f'Schema fix error: {str(e)}',
@@ -237,7 +381,7 @@ def activate_code():
                 'error_code': 'INVALID_DATA'
             }), 400
         
-        activation_code = data.get('activation_code', '').strip().upper()
+        activation_code = normalize_code(data.get('activation_code', ''))
         user_email = data.get('user_email', '').strip().lower()
         user_name = data.get('user_name', '').strip()
         
@@ -248,108 +392,87 @@ def activate_code():
                 'error_code': 'MISSING_REQUIRED_FIELDS'
             }), 400
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 检查激活码是否存在且可用
-        cursor.execute("""
-            SELECT * FROM activation_codes 
-            WHERE code = ? AND is_used = 0 AND is_disabled = 0
-        """, (activation_code,))
-        code_record = cursor.fetchone()
-        
-        if not code_record:
-            conn.close()
+        # 先按IP再按邮箱限流，被拒绝的请求不查库
+        limit_keys = (('activate_ip', client_ip()), ('activate_email', user_email))
+        retry_after = rate_limiter.check(*limit_keys)
+        if retry_after:
+            log.info('activation_rate_limited', user_email=user_email, retry_after=retry_after)
+            return rate_limited_response(retry_after)
+        
+        # 新格式激活码先核对校验位，输错或伪造的不查库
+        if not check_code_format(activation_code):
+            rate_limiter.penalize(*limit_keys)
+            log.info('activation_rejected', user_email=user_email, error_code='INVALID_CODE_FORMAT')
+            return invalid_code_format_response()
+        
+        # 过滤器确定不存在或最近确认不可用的激活码直接拒绝（不写事件日志，枚举流量不会变成数据库写入）
+        cached, _ = negative_code_cache.get(activation_code)
+        if cached or not code_filter.might_contain(activation_code, get_db_connection):
+            rate_limiter.penalize(*limit_keys)
+            log.info('activation_rejected', user_email=user_email, error_code='INVALID_CODE', cached=True)
             return jsonify({
                 'success': False,
                 'message': 'Invalid or already used activation code',
                 'error_code': 'INVALID_CODE'
             }), 400
         
-        # 检查用户是否已经是Pro用户
-        cursor.execute("SELECT * FROM users WHERE email = ?", (user_email,))
-        existing_user = cursor.fetchone()
+        # 生成用户令牌
+        user_token = generate_user_token(user_email)
         
-        if existing_user and existing_user[3] == 'active':  # pro_status字段
-            conn.close()
+        # 可用性检查、占用激活码和写入用户在同一个 BEGIN IMMEDIATE 事务中完成
+        def publish_invalidations(c):
+            pro_status_cache.publish_invalidation(c, user_email)
+            report_cache.publish_invalidation(c)
+
+        conn = get_db_connection()
+        try:
+            redemption = redeem_code(
+                conn, activation_code, user_email, user_name, user_token,
+                before_commit=publish_invalidations
+            )
+        except RedemptionRejected as e:
+            if e.error_code == 'INVALID_CODE':
+                negative_code_cache.set(activation_code, 'unavailable')
+                rate_limiter.penalize(*limit_keys)
+            log_event('activate', 'failed', user_email, activation_code, e.error_code)
+            log.info('activation_rejected', user_email=user_email, error_code=e.error_code)
             return jsonify({
                 'success': False,
-                'message': 'User already has active Pro status',
-                'error_code': 'ALREADY_PRO_USER'
+                'message': e.message,
+                'error_code': e.error_code
             }), 400
+        pro_status_cache.invalidate(user_email)
+        report_cache.invalidate()
         
-        # 计算过期时间
-        expires_at = None
-        is_lifetime = False
-        
-        if code_record[2] == 'pro_lifetime':  # code_type字段
-            is_lifetime = True
-        elif code_record[2] == 'pro_1year':
-            expires_at = (datetime.now() + timedelta(days=365)).isoformat()
-        elif code_record[2] == 'pro_6month':
-            expires_at = (datetime.now() + timedelta(days=180)).isoformat()
-        else:
-            # 默认为1年
-            expires_at = (datetime.now() + timedelta(days=365)).isoformat()
+        log.info('activation_success', user_email=user_email, activation_code=activation_code,
+                 code_type=redemption.code_type)
+        log_event('activate', 'success', user_email, activation_code,
+                  detail={'code_type': redemption.code_type, 'expires_at': redemption.expires_at})
         
-        # 生成用户令牌
-        user_token = generate_user_token(user_email)
+        # 签发权益令牌，扩展可在刷新窗口内离线使用
+        entitlement_token, entitlement = issue_entitlement_token(
+            user_email, redemption.code_type, redemption.expires_at, get_revision(conn, user_email))
         
-        # 开始事务
-        try:
-            # 标记激活码为已使用
-            cursor.execute("""
-                UPDATE activation_codes 
-                SET is_used = 1, used_by = ?, used_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
-                WHERE code = ?
-            """, (user_email, activation_code))
-            
-            # 添加或更新用户记录
-            if existing_user:
-                cursor.execute("""
-                    UPDATE users 
-                    SET pro_status = 'active', pro_activated_at = CURRENT_TIMESTAMP,
-                        pro_expires_at = ?, activation_code = ?, token = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE email = ?
-                """, (expires_at, activation_code, user_token, user_email))
-            else:
-                cursor.execute("""
-                    INSERT INTO users 
-                    (email, token, pro_status, pro_activated_at, pro_expires_at, activation_code)
-                    VALUES (?, ?, 'active', CURRENT_TIMESTAMP, ?, ?)
-                """, (user_email, user_token, expires_at, activation_code))
-            
-            # 同时添加到pro_users表（用于统计）
-            cursor.execute("""
-                INSERT OR REPLACE INTO pro_users 
-                (user_email, user_name, pro_type, activation_code, activated_at, expires_at, 
-                 is_lifetime, is_active, user_token, created_at, updated_at)
-                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?, 1, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-            """, (user_email, user_name or '', code_record[2], activation_code, expires_at, is_lifetime, user_token))
-            
-            conn.commit()
-            
-            print(f"Activation successful: {user_email} -> {activation_code}")
-            
-            return jsonify({
-                'success': True,
-                'message': 'Activation successful',
-                'data': {
-                    'user_email': user_email,
-                    'pro_type': code_record[2],  # code_type字段
-                    'is_lifetime': is_lifetime,
-                    'expires_at': expires_at,
-                    'user_token': user_token,
-                    'activated_at': datetime.now().isoformat()
-                }
-            })
-            
-        except Exception as e:
-            conn.rollback()
-            raise e
+        return jsonify({
+            'success': True,
+            'message': 'Activation successful',
+            'data': {
+                'user_email': user_email,
+                'pro_type': redemption.code_type,
+                'is_lifetime': redemption.is_lifetime,
+                'expires_at': redemption.expires_at,
+                'user_token': user_token,
+                'activated_at': datetime.now().isoformat(),
+                'entitlement_token': entitlement_token,
+                'entitlement_expires_at': entitlement['exp'],
+                'refresh_after': entitlement['refresh_after']
+            }
+        })
             
-    except Exception as e:
-        print(f"Activation error: {str(e)}")
+    except Exception:
+        log.exception('activation_error')
+        if 'activation_code' in locals():
+            log_event('activate', 'failed', user_email, activation_code, 'INTERNAL_ERROR')
         return jsonify({
             'success': False,
             'message': 'Internal server error',
@@ -372,7 +495,7 @@ def check_code():
                 'error_code': 'INVALID_DATA'
             }), 400
         
-        activation_code = data.get('code', '').strip().upper()
+        activation_code = normalize_code(data.get('code', ''))
         
         if not activation_code:
             return jsonify({
@@ -381,6 +504,25 @@ def check_code():
                 'error_code': 'MISSING_CODE'
             }), 400
         
+        limit_keys = (('check_ip', client_ip()),)
+        retry_after = rate_limiter.check(*limit_keys)
+        if retry_after:
+            log.info('check_rate_limited', retry_after=retry_after)
+            return rate_limited_response(retry_after)
+        
+        if not check_code_format(activation_code):
+            rate_limiter.penalize(*limit_keys)
+            return invalid_code_format_response()
+        
+        cached, kind = negative_code_cache.get(activation_code)
+        if (cached and kind == 'missing') or not code_filter.might_contain(activation_code, get_db_connection):
+            rate_limiter.penalize(*limit_keys)
+            return jsonify({
+                'success': False,
+                'message': 'Activation code not found',
+                'error_code': 'CODE_NOT_FOUND'
+            }), 404
+        
         conn = get_db_connection()
         cursor = conn.cursor()
         
@@ -394,6 +536,8 @@ def check_code():
         
         if not code_record:
             conn.close()
+            negative_code_cache.set(activation_code, 'missing')
+            rate_limiter.penalize(*limit_keys)
             return jsonify({
                 'success': False,
                 'message': 'Activation code not found',
@@ -415,8 +559,8 @@ def check_code():
             }
         })
         
-    except Exception as e:
-        print(f"Check code error: {str(e)}")
+    except Exception:
+        log.exception('check_code_error')
         return jsonify({
             'success': False,
             'message': 'Internal server error',
@@ -449,18 +593,32 @@ def verify_pro_status():
                 'error_code': 'MISSING_USER_EMAIL'
             }), 400
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        # 优先读取进程内缓存，命中时不访问数据库
+        pro_status_cache.sync_invalidations(get_db_connection)
+        hit, user_record = pro_status_cache.get(user_email)
         
-        # 查询用户Pro状态
-        cursor.execute("""
-            SELECT * FROM users 
-            WHERE email = ? AND pro_status = 'active'
-        """, (user_email,))
-        user_record = cursor.fetchone()
+        if not hit:
+            generation = pro_status_cache.generation
+            conn = get_db_connection()
+            try:
+                # 查询用户Pro状态
+                row = conn.execute("""
+                    SELECT u.pro_activated_at, u.pro_expires_at, u.pro_expires_epoch, ac.code_type,
+                           COALESCE(er.revision, 0) AS entitlement_revision
+                    FROM users u
+                    LEFT JOIN activation_codes ac ON ac.code = u.activation_code
+                    LEFT JOIN entitlement_revocations er ON er.user_email = u.email
+                    WHERE u.email = ? AND u.pro_status IN ('active', 'expired')
+                """, (user_email,)).fetchone()
+            finally:
+                conn.close()
+            user_record = dict(row) if row else None
+            
+            pro_status_cache.set(user_email, user_record, generation)
         
         if not user_record:
-            conn.close()
+            log_event('verify', 'failed', user_email, error_code='USER_NOT_FOUND', detail={'cached': hit})
+            log.info('verify_pro', user_email=user_email, is_pro=False, cached=hit)
             return jsonify({
                 'success': False,
                 'message': 'User not found or not active',
@@ -468,38 +626,152 @@ def verify_pro_status():
                 'is_pro': False
             })
         
-        # 检查是否过期（如果不是终身版）
-        is_expired = False
-        if user_record['pro_expires_at']:
-            expires_at = datetime.fromisoformat(user_record['pro_expires_at'])
-            if expires_at < datetime.now():
-                is_expired = True
+        # 检查是否过期（如果不是终身版）；清扫线程标记前后结果一致
+        is_expired = is_pro_expired(user_record['pro_expires_epoch'])
+        log_event('verify', 'success', user_email, detail={'is_pro': not is_expired, 'cached': hit})
+        log.info('verify_pro', user_email=user_email, is_pro=not is_expired, cached=hit)
+        
+        # 更新最后登录时间（写回缓冲，定期批量写入）
+        last_seen_buffer.record(user_email, datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+        
+        response_data = {
+            'is_pro': not is_expired,
+            'pro_type': 'pro',
+            'is_lifetime': user_record['pro_expires_at'] is None,
+            'expires_at': user_record['pro_expires_at'],
+            'activated_at': user_record['pro_activated_at'],
+            'is_expired': is_expired,
+            'last_login': datetime.now().isoformat()
+        }
         
-        # 更新最后登录时间
-        cursor.execute("""
-            UPDATE users 
-            SET updated_at = CURRENT_TIMESTAMP 
-            WHERE email = ?
-        """, (user_email,))
-        conn.commit()
-        conn.close()
+        if not is_expired:
+            entitlement_token, entitlement = issue_entitlement_token(
+                user_email, user_record['code_type'] or 'pro', user_record['pro_expires_at'],
+                user_record['entitlement_revision'])
+            response_data.update({
+                'entitlement_token': entitlement_token,
+                'entitlement_expires_at': entitlement['exp'],
+                'refresh_after': entitlement['refresh_after']
+            })
         
         return jsonify({
             'success': True,
             'message': 'Pro status verified',
-            'data': {
+            'data': response_data
+        })
+        
+    except Exception:
+        log.exception('verify_pro_error')
+        return jsonify({
+            'success': False,
+            'message': 'Internal server error',
+            'error_code': 'INTERNAL_ERROR'
+        }), 500
+
+@app.route('/api/verify_pro/batch', methods=['POST'])
+@verify_api_key
+def verify_pro_status_batch():
+    """批量验证用户Pro状态（支持工具和对账任务使用）"""
+    try:
+        if request.content_length and request.content_length > BATCH_VERIFY_MAX_BYTES:
+            return jsonify({
+                'success': False,
+                'message': f'Request body too large (max {BATCH_VERIFY_MAX_BYTES} bytes)',
+                'error_code': 'REQUEST_TOO_LARGE'
+            }), 413
+        
+        data = request.get_json()
+        if not data or not isinstance(data.get('user_emails'), list):
+            return jsonify({
+                'success': False,
+                'message': 'user_emails must be a list',
+                'error_code': 'INVALID_DATA'
+            }), 400
+        
+        user_emails = []
+        for email in data['user_emails']:
+            if isinstance(email, str) and email.strip():
+                user_emails.append(email.strip().lower())
+        user_emails = list(dict.fromkeys(user_emails))
+        
+        if not user_emails:
+            return jsonify({
+                'success': False,
+                'message': 'User emails are required',
+                'error_code': 'MISSING_USER_EMAIL'
+            }), 400
+        
+        if len(user_emails) > BATCH_VERIFY_MAX_EMAILS:
+            return jsonify({
+                'success': False,
+                'message': f'Too many emails (max {BATCH_VERIFY_MAX_EMAILS})',
+                'error_code': 'TOO_MANY_EMAILS'
+            }), 400
+        
+        # 先取缓存，未命中的邮箱按块用 IN 查询；批量结果不回填缓存，避免挤掉扩展的热点用户
+        pro_status_cache.sync_invalidations(get_db_connection)
+        records = {}
+        missing = []
+        for email in user_emails:
+            hit, user_record = pro_status_cache.get(email)
+            if hit:
+                records[email] = user_record
+            else:
+                missing.append(email)
+        
+        if missing:
+            conn = get_db_connection()
+            try:
+                for start in range(0, len(missing), BATCH_VERIFY_CHUNK_SIZE):
+                    chunk = missing[start:start + BATCH_VERIFY_CHUNK_SIZE]
+                    placeholders = ','.join('?' * len(chunk))
+                    rows = conn.execute(f"""
+                        SELECT u.email, u.pro_activated_at, u.pro_expires_at, u.pro_expires_epoch, ac.code_type 
+                        FROM users u
+                        LEFT JOIN activation_codes ac ON ac.code = u.activation_code
+                        WHERE u.email IN ({placeholders}) AND u.pro_status IN ('active', 'expired')
+                    """, chunk).fetchall()
+                    for row in rows:
+                        records[row['email']] = dict(row)
+            finally:
+                conn.close()
+        
+        results = {}
+        for email in user_emails:
+            user_record = records.get(email)
+            if not user_record:
+                results[email] = {
+                    'is_pro': False,
+                    'error_code': 'USER_NOT_FOUND'
+                }
+                continue
+            
+            is_expired = is_pro_expired(user_record['pro_expires_epoch'])
+            results[email] = {
                 'is_pro': not is_expired,
                 'pro_type': 'pro',
                 'is_lifetime': user_record['pro_expires_at'] is None,
                 'expires_at': user_record['pro_expires_at'],
                 'activated_at': user_record['pro_activated_at'],
-                'is_expired': is_expired,
-                'last_login': datetime.now().isoformat()
+                'is_expired': is_expired
+            }
+        
+        pro_count = sum(1 for result in results.values() if result['is_pro'])
+        log_event('verify', 'success', detail={'batch': len(results), 'pro_count': pro_count})
+        log.info('verify_pro', batch=len(results), pro_count=pro_count)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Pro status verified',
+            'data': {
+                'count': len(results),
+                'pro_count': pro_count,
+                'results': results
             }
         })
         
-    except Exception as e:
-        print(f"Pro status verification error: {str(e)}")
+    except Exception:
+        log.exception('verify_pro_batch_error')
         return jsonify({
             'success': False,
             'message': 'Internal server error',
@@ -512,37 +784,29 @@ def get_stats():
     """获取系统统计信息"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
+        
+        # 读取触发器维护的计数表，不再全表聚合
+        ensure_stats_counters(conn, DB_PATH)
+        code_counts = get_code_counts(conn)
+        user_counts = get_user_status_counts(conn)
         
         # 激活码统计
-        cursor.execute("""
-            SELECT 
-                type,
-                COUNT(*) as total,
-                SUM(CASE WHEN status = 'used' THEN 1 ELSE 0 END) as used,
-                SUM(CASE WHEN status = 'active' THEN 1 ELSE 0 END) as available
-            FROM activation_codes 
-            GROUP BY type
-        """)
-        code_stats = [dict(row) for row in cursor.fetchall()]
+        code_stats = [
+            {'type': code_type, 'total': c['total'], 'used': c['used'], 'available': c['available']}
+            for code_type, c in code_counts.items()
+        ]
         
         # Pro用户统计
-        cursor.execute("""
-            SELECT 
-                'pro' as pro_type,
-                COUNT(*) as total,
-                SUM(CASE WHEN pro_status = 'active' THEN 1 ELSE 0 END) as active,
-                SUM(CASE WHEN pro_status = 'inactive' THEN 1 ELSE 0 END) as inactive
-            FROM users 
-        """)
-        user_stats = [dict(row) for row in cursor.fetchall()]
+        user_stats = [{
+            'pro_type': 'pro',
+            'total': sum(user_counts.values()),
+            'active': user_counts.get('active', 0),
+            'inactive': user_counts.get('inactive', 0)
+        }]
         
         # 总体统计
-        cursor.execute("SELECT COUNT(*) as total FROM activation_codes")
-        total_codes = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) as total FROM users WHERE pro_status = 'active'")
-        total_active_users = cursor.fetchone()[0]
+        total_codes = sum(c['total'] for c in code_counts.values())
+        total_active_users = user_counts.get('active', 0)
         
         conn.close()
         
@@ -558,8 +822,8 @@ def get_stats():
             }
         })
         
-    except Exception as e:
-        print(f"Stats error: {str(e)}")
+    except Exception:
+        log.exception('stats_error')
         return jsonify({
             'success': False,
             'message': 'Internal server error',
@@ -595,14 +859,20 @@ def revoke_pro_status():
         cursor.execute("""
             UPDATE users 
             SET pro_status = 'inactive', updated_at = CURRENT_TIMESTAMP
-            WHERE email = ? AND pro_status = 'active'
+            WHERE email = ? AND pro_status IN ('active', 'expired')
         """, (user_email,))
         
         if cursor.rowcount > 0:
+            pro_status_cache.publish_invalidation(conn, user_email)
+            report_cache.publish_invalidation(conn)
+            record_revocation(conn, user_email)
             conn.commit()
             conn.close()
+            pro_status_cache.invalidate(user_email)
+            report_cache.invalidate()
             
-            print(f"Pro status revoked: {user_email}")
+            log.info('pro_status_revoked', user_email=user_email)
+            log_event('revoke', 'success', user_email, actor='api')
             
             return jsonify({
                 'success': True,
@@ -616,8 +886,93 @@ def revoke_pro_status():
                 'error_code': 'USER_NOT_FOUND'
             }), 404
             
-    except Exception as e:
-        print(f"Revoke error: {str(e)}")
+    except Exception:
+        log.exception('revoke_error')
+        return jsonify({
+            'success': False,
+            'message': 'Internal server error',
+            'error_code': 'INTERNAL_ERROR'
+        }), 500
+
+@app.route('/api/verify_token', methods=['POST'])
+@verify_api_key
+def verify_token():
+    """服务端校验权益令牌（签名、过期时间、撤销列表）"""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid JSON data',
+                'error_code': 'INVALID_DATA'
+            }), 400
+        
+        entitlement_token = data.get('entitlement_token', '').strip()
+        if not entitlement_token:
+            return jsonify({
+                'success': False,
+                'message': 'Entitlement token is required',
+                'error_code': 'MISSING_TOKEN'
+            }), 400
+        
+        conn = get_db_connection()
+        try:
+            claims = verify_entitlement_token(
+                entitlement_token, revision_lookup=lambda email: get_revision(conn, email))
+        finally:
+            conn.close()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Entitlement token verified',
+            'data': claims
+        })
+        
+    except EntitlementTokenError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e),
+            'error_code': e.error_code,
+            'is_pro': False
+        }), 401
+    except Exception:
+        log.exception('verify_token_error')
+        return jsonify({
+            'success': False,
+            'message': 'Internal server error',
+            'error_code': 'INTERNAL_ERROR'
+        }), 500
+
+@app.route('/api/entitlements/revocations', methods=['GET'])
+@verify_api_key
+def entitlement_revocations():
+    """权益令牌撤销列表，since 为上次拉取时间戳"""
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid since parameter',
+            'error_code': 'INVALID_DATA'
+        }), 400
+    
+    try:
+        conn = get_db_connection()
+        try:
+            revocations = list_revocations(conn, since)
+        finally:
+            conn.close()
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'revocations': revocations,
+                'server_time': int(datetime.now().timestamp())
+            }
+        })
+        
+    except Exception:
+        log.exception('revocation_list_error')
         return jsonify({
             'success': False,
             'message': 'Internal server error',
@@ -651,62 +1006,25 @@ def internal_error(error):
 @app.route('/admin/statistics')
 @login_required
 def statistics():
-    """统计报表页面"""
+    """统计报表页面（数据经报表缓存，?refresh=1 强制重新计算）"""
     try:
-        # 导入统计模块
-        import sys
-        sys.path.append(os.path.dirname(__file__))
-        from statistics_report import ActivationStatistics
-        
-        stats = ActivationStatistics()
-        
-        # 获取各种统计数据
-        activation_overview = stats.get_activation_overview()
-        user_stats = stats.get_user_statistics()
-        daily_trends = stats.get_daily_activation_trend(days=30)
-        revenue_estimation = stats.get_revenue_estimation()
-        
-        # 计算总收入
-        total_revenue = revenue_estimation.get('total_estimated_revenue', 0)
-        
-        # 获取最近激活用户
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT user_email, pro_type, activated_at 
-            FROM pro_users 
-            ORDER BY activated_at DESC 
-            LIMIT 10
-        """)
-        recent_users = cursor.fetchall()
-        
-        # 获取即将过期用户
-        cursor.execute("""
-            SELECT 
-                user_email,
-                pro_type,
-                expires_at,
-                CAST((julianday(expires_at) - julianday('now')) AS INTEGER) as days_until_expiry
-            FROM pro_users 
-            WHERE expires_at IS NOT NULL 
-                AND expires_at > datetime('now')
-                AND is_active = 1
-            ORDER BY expires_at ASC
-            LIMIT 10
-        """)
-        expiring_users = cursor.fetchall()
-        
-        conn.close()
+        report, generated_at, is_stale = get_statistics_page_data(
+            days=30, force_refresh=request.args.get('refresh') == '1'
+        )
         
         return render_template('statistics.html',
-                             activation_overview=activation_overview,
-                             user_stats=user_stats,
-                             daily_trends=daily_trends,
-                             revenue_estimation=revenue_estimation,
-                             total_revenue=total_revenue,
-                             recent_users=recent_users,
-                             expiring_users=expiring_users)
+                             activation_overview=report['activation_overview'],
+                             user_stats=report['user_stats'],
+                             daily_trends=report['daily_trends'],
+                             revenue_estimation=report['revenue_estimation'].get('revenue_by_type', []),
+                             total_revenue=report['total_revenue'],
+                             recent_users=report['recent_users'],
+                             expiring_users=report['expiring_users'],
+                             report_generated_at=datetime.fromtimestamp(generated_at),
+                             report_age_seconds=int(time.time() - generated_at),
+                             report_is_stale=is_stale)
     except Exception as e:
+        log.exception('statistics_page_error')
         flash(f'获取统计数据失败: {str(e)}', 'error')
         return render_template('statistics.html')
 
@@ -742,6 +1060,7 @@ def debug_pro_users():
         })
         
     except Exception as e:
+        log.exception('debug_pro_users_error')
         return jsonify({
             'status': 'error',
             'message': str(e)
@@ -776,46 +1095,27 @@ def admin_dashboard():
         # 获取统计数据
         stats = {}
         
-        # 激活码统计
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total,
-                SUM(CASE WHEN is_used = 1 THEN 1 ELSE 0 END) as used,
-                SUM(CASE WHEN is_used = 0 AND is_disabled = 0 THEN 1 ELSE 0 END) as unused
-            FROM activation_codes
-        """)
-        code_result = cursor.fetchone()
-        stats['total_codes'] = code_result[0] if code_result else 0
-        stats['used_codes'] = code_result[1] if code_result else 0
-        stats['unused_codes'] = code_result[2] if code_result else 0
+        # 激活码与用户统计读取触发器维护的计数表
+        ensure_stats_counters(conn, DB_PATH)
+        code_counts = get_code_counts(conn)
+        user_counts = get_user_status_counts(conn)
         
-        # Pro用户统计
-        cursor.execute("SELECT COUNT(*) FROM users WHERE pro_status = 'active'")
-        pro_users_result = cursor.fetchone()
-        stats['pro_users'] = pro_users_result[0] if pro_users_result else 0
+        stats['total_codes'] = sum(c['total'] for c in code_counts.values())
+        stats['used_codes'] = sum(c['used'] for c in code_counts.values())
+        stats['unused_codes'] = sum(c['available'] for c in code_counts.values())
+        stats['pro_users'] = user_counts.get('active', 0)
         
         # 激活码分类统计
-        cursor.execute("""
-            SELECT 
-                code_type,
-                COUNT(*) as total,
-                SUM(CASE WHEN is_used = 1 THEN 1 ELSE 0 END) as used,
-                SUM(CASE WHEN is_used = 0 AND is_disabled = 0 THEN 1 ELSE 0 END) as available
-            FROM activation_codes 
-            GROUP BY code_type
-        """)
-        code_stats = cursor.fetchall()
+        code_stats = [
+            {'code_type': code_type, 'total': c['total'], 'used': c['used'], 'available': c['available']}
+            for code_type, c in code_counts.items()
+        ]
         
         # Pro用户分类统计
-        cursor.execute("""
-            SELECT 
-                pro_status,
-                COUNT(*) as total,
-                SUM(CASE WHEN pro_status = 'active' THEN 1 ELSE 0 END) as active
-            FROM users 
-            GROUP BY pro_status
-        """)
-        user_stats = cursor.fetchall()
+        user_stats = [
+            {'pro_status': pro_status, 'total': count, 'active': count if pro_status == 'active' else 0}
+            for pro_status, count in user_counts.items()
+        ]
         
         # 最近激活记录
         cursor.execute("""
@@ -835,6 +1135,7 @@ def admin_dashboard():
                              user_stats=user_stats,
                              recent_activations=recent_activations)
     except Exception as e:
+        log.exception('dashboard_error')
         flash(f'获取统计数据失败: {str(e)}', 'error')
         # 返回空的统计数据以避免模板错误
         empty_stats = {
@@ -945,12 +1246,12 @@ def codes():
     """激活码管理"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
         
-        # 获取查询参数
-        page = int(request.args.get('page', 1))
-        per_page = 20
-        code_type = request.args.get('type', '')
+        # 获取查询参数（模板表单使用 code_type / unused）
+        per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+        after = request.args.get('after') or None
+        before = request.args.get('before') or None
+        code_type = request.args.get('type') or request.args.get('code_type', '')
         status = request.args.get('status', '')
         
         # 构建查询条件
@@ -963,39 +1264,45 @@ def codes():
         
         if status == 'used':
             where_conditions.append("is_used = 1")
-        elif status == 'available':
+        elif status in ('available', 'unused'):
             where_conditions.append("is_used = 0 AND is_disabled = 0")
         elif status == 'disabled':
             where_conditions.append("is_disabled = 1")
         
-        where_clause = " WHERE " + " AND ".join(where_conditions) if where_conditions else ""
-        
-        # 获取总数
-        cursor.execute(f"SELECT COUNT(*) FROM activation_codes{where_clause}", params)
-        total = cursor.fetchone()[0]
-        
-        # 获取分页数据
-        offset = (page - 1) * per_page
-        cursor.execute(f"""
-            SELECT * FROM activation_codes{where_clause} 
-            ORDER BY created_at DESC 
-            LIMIT ? OFFSET ?
-        """, params + [per_page, offset])
-        codes = cursor.fetchall()
-        
+        # 按 (created_at, id) 游标翻页
+        ensure_list_indexes(conn, DB_PATH)
+        result = keyset_page(conn, 'activation_codes', where_conditions, params, 'created_at',
+                             after=after, before=before, per_page=per_page)
         conn.close()
         
-        # 计算分页信息
-        total_pages = (total + per_page - 1) // per_page
+        if request.args.get('format') == 'json':
+            return jsonify({
+                'success': True,
+                'data': {
+                    'codes': [dict(row) for row in result['rows']],
+                    'next_cursor': result['next_cursor'],
+                    'prev_cursor': result['prev_cursor'],
+                    'per_page': result['per_page'],
+                    'total': result['total'],
+                    'count_cached_at': result['count_cached_at'],
+                }
+            })
         
         return render_template('codes.html', 
-                             codes=codes,
-                             page=page,
-                             total_pages=total_pages,
-                             total=total,
+                             codes=result['rows'],
+                             next_cursor=result['next_cursor'],
+                             prev_cursor=result['prev_cursor'],
+                             per_page=result['per_page'],
+                             total=result['total'],
                              code_type=code_type,
                              status=status)
+    except ValueError as e:
+        if request.args.get('format') == 'json':
+            return jsonify({'success': False, 'message': str(e), 'error_code': 'INVALID_DATA'}), 400
+        flash(f'获取激活码列表失败: {str(e)}', 'error')
+        return render_template('codes.html', codes=[])
     except Exception as e:
+        log.exception('codes_list_error')
         flash(f'获取激活码列表失败: {str(e)}', 'error')
         return render_template('codes.html', codes=[])
 
@@ -1005,11 +1312,11 @@ def users():
     """用户管理"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
         
         # 获取查询参数
-        page = int(request.args.get('page', 1))
-        per_page = 20
+        per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+        after = request.args.get('after') or None
+        before = request.args.get('before') or None
         pro_type = request.args.get('pro_type', '')
         status = request.args.get('status', '')
         
@@ -1026,34 +1333,40 @@ def users():
         elif status == 'inactive':
             where_conditions.append("is_active = 0")
         
-        where_clause = " WHERE " + " AND ".join(where_conditions) if where_conditions else ""
-        
-        # 获取总数
-        cursor.execute(f"SELECT COUNT(*) FROM pro_users{where_clause}", params)
-        total = cursor.fetchone()[0]
-        
-        # 获取分页数据
-        offset = (page - 1) * per_page
-        cursor.execute(f"""
-            SELECT * FROM pro_users{where_clause} 
-            ORDER BY activated_at DESC 
-            LIMIT ? OFFSET ?
-        """, params + [per_page, offset])
-        users = cursor.fetchall()
-        
+        # 按 (activated_at, id) 游标翻页
+        ensure_list_indexes(conn, DB_PATH)
+        result = keyset_page(conn, 'pro_users', where_conditions, params, 'activated_at',
+                             after=after, before=before, per_page=per_page)
         conn.close()
         
-        # 计算分页信息
-        total_pages = (total + per_page - 1) // per_page
+        if request.args.get('format') == 'json':
+            return jsonify({
+                'success': True,
+                'data': {
+                    'users': [dict(row) for row in result['rows']],
+                    'next_cursor': result['next_cursor'],
+                    'prev_cursor': result['prev_cursor'],
+                    'per_page': result['per_page'],
+                    'total': result['total'],
+                    'count_cached_at': result['count_cached_at'],
+                }
+            })
         
         return render_template('users_list.html', 
-                             users=users,
-                             page=page,
-                             total_pages=total_pages,
-                             total=total,
+                             users=result['rows'],
+                             next_cursor=result['next_cursor'],
+                             prev_cursor=result['prev_cursor'],
+                             per_page=result['per_page'],
+                             total=result['total'],
                              pro_type=pro_type,
                              status=status)
+    except ValueError as e:
+        if request.args.get('format') == 'json':
+            return jsonify({'success': False, 'message': str(e), 'error_code': 'INVALID_DATA'}), 400
+        flash(f'获取用户列表失败: {str(e)}', 'error')
+        return render_template('users_list.html', users=[])
     except Exception as e:
+        log.exception('users_list_error')
         flash(f'获取用户列表失败: {str(e)}', 'error')
         return render_template('users_list.html', users=[])
 
@@ -1068,35 +1381,70 @@ def admin_generate():
             batch_name = request.form.get('batch_name', '')
             notes = request.form.get('notes', '')
             
-            if not code_type or count <= 0 or count > 1000:
+            if not code_type or count <= 0 or count > MAX_BULK_CODES:
                 flash('参数错误', 'error')
-                return render_template('generate.html')
+                return render_template('generate.html', max_bulk_codes=MAX_BULK_CODES)
             
             if not batch_name:
                 batch_name = generate_batch_id()
             
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            # 大批量生成转为后台任务，页面轮询任务进度后下载CSV
+            if count > BACKGROUND_GENERATE_THRESHOLD:
+                job_id = job_runner.enqueue('generate_codes', {
+                    'count': count,
+                    'code_type': code_type,
+                    'batch_name': batch_name,
+                    'notes': notes,
+                }, created_by=current_admin_name())
+                flash(f'已提交后台任务，正在生成 {count} 个激活码', 'success')
+                return render_template('generate.html', job_id=job_id,
+                                       max_bulk_codes=MAX_BULK_CODES)
             
-            generated_codes = []
-            for _ in range(count):
-                code = generate_activation_code()
-                cursor.execute("""
-                    INSERT INTO activation_codes (code, code_type, batch_name, notes)
-                    VALUES (?, ?, ?, ?)
-                """, (code, code_type, batch_name, notes))
-                generated_codes.append(code)
+            conn = get_db_connection()
+            try:
+                # 报表缓存失效记录与激活码在同一事务中写入
+                generated_codes = generate_codes_bulk(conn, count, code_type, batch_name, notes,
+                                                      before_commit=report_cache.publish_invalidation)
+            finally:
+                conn.close()
+            report_cache.invalidate()
+            log_event('generate', 'success', actor=current_admin_name(),
+                      detail={'count': count, 'code_type': code_type, 'batch_name': batch_name})
             
-            conn.commit()
-            conn.close()
+            # 数量较多或选择下载时以CSV流式返回，不在页面中渲染
+            if request.form.get('output') == 'csv' or count > GENERATE_DISPLAY_LIMIT:
+                return codes_csv_response(generated_codes, code_type, batch_name)
             
             flash(f'成功生成 {count} 个激活码', 'success')
-            return render_template('generate.html', generated_codes=generated_codes)
+            return render_template('generate.html', generated_codes=generated_codes,
+                                   max_bulk_codes=MAX_BULK_CODES)
             
         except Exception as e:
+            log.exception('generate_codes_error')
             flash(f'生成激活码失败: {str(e)}', 'error')
     
-    return render_template('generate.html')
+    return render_template('generate.html', max_bulk_codes=MAX_BULK_CODES)
+
+@app.route('/api/export-report', methods=['POST'])
+@login_required
+def export_report():
+    """导出统计报告（后台任务执行，通过 status_url 查询进度）"""
+    try:
+        job_id = job_runner.enqueue('export_report', {}, created_by=current_admin_name())
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': url_for('jobs.job_status', job_id=job_id),
+            'download_url': url_for('jobs.job_download', job_id=job_id),
+            'message': '报告导出任务已提交'
+        }), 202
+    except Exception as e:
+        log.exception('export_report_error')
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': '报告导出失败'
+        }), 500
 
 if __name__ == '__main__':
     # 初始化数据库
@@ -1120,8 +1468,11 @@ if __name__ == '__main__':
         print("  GET  /api/health - 健康检查")
         print("  POST /api/activate - 激活码验证")
         print("  POST /api/verify_pro - 验证Pro状态")
+        print("  POST /api/verify_pro/batch - 批量验证Pro状态")
         print("  GET  /api/stats - 获取统计信息")
         print("  POST /api/revoke_pro - 撤销Pro状态")
+        print("  POST /api/verify_token - 校验权益令牌")
+        print("  GET  /api/entitlements/revocations - 权益令牌撤销列表")
         print("\n🔧 管理后台:")
         print("  GET  /admin - 管理仪表板")
         print("  GET  /admin/login - 管理员登录")
@@ -7,18 +7,39 @@ MoziBang 激活码管理后台 - SQLite版本
 
 from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
 from flask_cors import CORS
-import sqlite3
-import secrets
-import string
 import hashlib
 from datetime import datetime, timedelta
 import uuid
 import os
+import time
 from functools import wraps
+from sqlite_pool import get_pool
+from pro_status_cache import pro_status_cache
+from entitlement_tokens import record_revocation
+from stats_counters import (
+    ensure_schema as ensure_stats_counters, code_counts as get_code_counts,
+    pro_user_counts as get_pro_user_counts
+)
+from report_cache import report_cache, get_statistics_page_data
+from streaming_export import exports_bp, configure as configure_exports
+from query_profiler import profiler_bp, install as install_query_profiler
+from event_log import events_bp, log_event, configure as configure_event_log
+from code_filter import code_filter
+from daily_rollup import ensure_schema as ensure_rollup_schema
+from pagination import keyset_page, DEFAULT_PER_PAGE, ensure_indexes as ensure_list_indexes
+from code_generator import (
+    generate_codes_bulk, codes_csv_response, require_signing_keys,
+    MAX_BULK_CODES, GENERATE_DISPLAY_LIMIT
+)
+from job_queue import job_runner, jobs_bp, current_admin_name, BACKGROUND_GENERATE_THRESHOLD
 
 app = Flask(__name__)
 app.secret_key = 'mozibang-admin-secret-key-2024'  # 生产环境应使用环境变量
 CORS(app)
+app.register_blueprint(jobs_bp)
+app.register_blueprint(exports_bp)
+app.register_blueprint(events_bp)
+app.register_blueprint(profiler_bp)
 
 # 添加moment模板过滤器和全局函数
 @app.template_filter('moment')
@@ -41,10 +62,27 @@ def inject_datetime():
 # SQLite数据库文件路径
 DB_PATH = os.path.join(os.path.dirname(__file__), 'mozibang_activation.db')
 
+# 后台任务与Web应用共用同一个数据库
+job_runner.configure(lambda: DB_PATH)
+configure_exports(lambda: DB_PATH)
+configure_event_log(lambda: DB_PATH)
+code_filter.configure(lambda: DB_PATH)
+install_query_profiler()
+
+# 激活码校验位只用专用的签名密钥，未配置时拒绝启动
+require_signing_keys()
+
 def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # 使结果可以像字典一样访问
+    """
+    获取数据库连接（从进程内连接池借出，close() 即归还）
+    管理后台也会写入 pro_users（撤销），借出时补齐每日汇总触发器（就绪后只是一次集合查找）
+    """
+    conn = get_pool(DB_PATH).connection()
+    try:
+        ensure_rollup_schema(conn, DB_PATH)
+    except Exception:
+        conn.close()
+        raise
     return conn
 
 def login_required(f):
@@ -79,11 +117,6 @@ def verify_password(stored_password, provided_password):
     except:
         return False
 
-def generate_activation_code():
-    """生成激活码"""
-    chars = string.ascii_uppercase + string.digits
-    return ''.join(secrets.choice(chars) for _ in range(16))
-
 def generate_batch_id():
     """生成批次ID"""
     return f"BATCH_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
@@ -100,46 +133,27 @@ def admin_dashboard():
         # 获取统计数据
         stats = {}
         
-        # 激活码统计
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total,
-                SUM(CASE WHEN is_used = 1 THEN 1 ELSE 0 END) as used,
-                SUM(CASE WHEN is_used = 0 AND is_disabled = 0 THEN 1 ELSE 0 END) as unused
-            FROM activation_codes
-        """)
-        code_result = cursor.fetchone()
-        stats['total_codes'] = code_result[0] if code_result else 0
-        stats['used_codes'] = code_result[1] if code_result else 0
-        stats['unused_codes'] = code_result[2] if code_result else 0
+        # 激活码与Pro用户统计读取触发器维护的计数表
+        ensure_stats_counters(conn, DB_PATH)
+        code_counts = get_code_counts(conn)
+        pro_counts = get_pro_user_counts(conn)
         
-        # Pro用户统计
-        cursor.execute("SELECT COUNT(*) FROM pro_users WHERE is_active = 1")
-        pro_users_result = cursor.fetchone()
-        stats['pro_users'] = pro_users_result[0] if pro_users_result else 0
+        stats['total_codes'] = sum(c['total'] for c in code_counts.values())
+        stats['used_codes'] = sum(c['used'] for c in code_counts.values())
+        stats['unused_codes'] = sum(c['available'] for c in code_counts.values())
+        stats['pro_users'] = sum(c['active'] for c in pro_counts.values())
         
         # 激活码分类统计
-        cursor.execute("""
-            SELECT 
-                code_type,
-                COUNT(*) as total,
-                SUM(CASE WHEN is_used = 1 THEN 1 ELSE 0 END) as used,
-                SUM(CASE WHEN is_used = 0 AND is_disabled = 0 THEN 1 ELSE 0 END) as available
-            FROM activation_codes 
-            GROUP BY code_type
-        """)
-        code_stats = cursor.fetchall()
+        code_stats = [
+            {'code_type': code_type, 'total': c['total'], 'used': c['used'], 'available': c['available']}
+            for code_type, c in code_counts.items()
+        ]
         
         # Pro用户分类统计
-        cursor.execute("""
-            SELECT 
-                pro_type,
-                COUNT(*) as total,
-                SUM(CASE WHEN is_active = 1 THEN 1 ELSE 0 END) as active
-            FROM pro_users 
-            GROUP BY pro_type
-        """)
-        user_stats = cursor.fetchall()
+        user_stats = [
+            {'pro_type': pro_type, 'total': c['total'], 'active': c['active']}
+            for pro_type, c in pro_counts.items()
+        ]
         
         # 最近激活记录
         cursor.execute("""
@@ -226,61 +240,23 @@ def logout():
 @app.route('/statistics')
 @login_required
 def statistics():
-    """统计报表页面"""
+    """统计报表页面（数据经报表缓存，?refresh=1 强制重新计算）"""
     try:
-        # 导入统计模块
-        import sys
-        sys.path.append(os.path.dirname(__file__))
-        from statistics_report import ActivationStatistics
-        
-        stats = ActivationStatistics()
-        
-        # 获取各种统计数据
-        activation_overview = stats.get_activation_overview()
-        user_stats = stats.get_user_statistics()
-        daily_trends = stats.get_daily_activation_trend()
-        revenue_estimation = stats.get_revenue_estimation()
-        
-        # 计算总收入
-        total_revenue = revenue_estimation.get('total_estimated_revenue', 0)
-        
-        # 获取最近激活用户
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT user_email, pro_type, activated_at 
-            FROM pro_users 
-            ORDER BY activated_at DESC 
-            LIMIT 10
-        """)
-        recent_users = cursor.fetchall()
-        
-        # 获取即将过期用户
-        cursor.execute("""
-            SELECT 
-                user_email,
-                pro_type,
-                expires_at,
-                CAST((julianday(expires_at) - julianday('now')) AS INTEGER) as days_until_expiry
-            FROM pro_users 
-            WHERE expires_at IS NOT NULL 
-                AND expires_at > datetime('now')
-                AND is_active = 1
-            ORDER BY expires_at ASC
-            LIMIT 10
-        """)
-        expiring_users = cursor.fetchall()
-        
-        conn.close()
+        report, generated_at, is_stale = get_statistics_page_data(
+            force_refresh=request.args.get('refresh') == '1'
+        )
         
         return render_template('statistics.html',
-                             activation_overview=activation_overview,
-                             user_stats=user_stats,
-                             daily_trends=daily_trends,
-                             revenue_estimation=revenue_estimation.get('revenue_by_type', []),
-                             total_revenue=total_revenue,
-                             recent_users=recent_users,
-                             expiring_users=expiring_users)
+                             activation_overview=report['activation_overview'],
+                             user_stats=report['user_stats'],
+                             daily_trends=report['daily_trends'],
+                             revenue_estimation=report['revenue_estimation'].get('revenue_by_type', []),
+                             total_revenue=report['total_revenue'],
+                             recent_users=report['recent_users'],
+                             expiring_users=report['expiring_users'],
+                             report_generated_at=datetime.fromtimestamp(generated_at),
+                             report_age_seconds=int(time.time() - generated_at),
+                             report_is_stale=is_stale)
     except Exception as e:
         flash(f'获取统计数据失败: {str(e)}', 'error')
         return render_template('statistics.html')
@@ -288,21 +264,17 @@ def statistics():
 @app.route('/api/export-report', methods=['POST'])
 @login_required
 def export_report():
-    """导出统计报告API"""
+    """导出统计报告API（后台任务执行，通过 status_url 查询进度）"""
     try:
-        # 导入统计模块
-        import sys
-        sys.path.append(os.path.dirname(__file__))
-        from statistics_report import ActivationStatistics
-        
-        stats = ActivationStatistics()
-        filepath = stats.export_report_to_json()
+        job_id = job_runner.enqueue('export_report', {}, created_by=current_admin_name())
         
         return jsonify({
             'success': True,
-            'filepath': filepath,
-            'message': '报告导出成功'
-        })
+            'job_id': job_id,
+            'status_url': url_for('jobs.job_status', job_id=job_id),
+            'download_url': url_for('jobs.job_download', job_id=job_id),
+            'message': '报告导出任务已提交'
+        }), 202
     except Exception as e:
         return jsonify({
             'success': False,
@@ -316,12 +288,12 @@ def codes():
     """激活码管理"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
         
-        # 获取查询参数
-        page = int(request.args.get('page', 1))
-        per_page = 20
-        code_type = request.args.get('type', '')
+        # 获取查询参数（模板表单使用 code_type / unused）
+        per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+        after = request.args.get('after') or None
+        before = request.args.get('before') or None
+        code_type = request.args.get('type') or request.args.get('code_type', '')
         status = request.args.get('status', '')
         
         # 构建查询条件
@@ -334,38 +306,43 @@ def codes():
         
         if status == 'used':
             where_conditions.append("is_used = 1")
-        elif status == 'available':
+        elif status in ('available', 'unused'):
             where_conditions.append("is_used = 0 AND is_disabled = 0")
         elif status == 'disabled':
             where_conditions.append("is_disabled = 1")
         
-        where_clause = " WHERE " + " AND ".join(where_conditions) if where_conditions else ""
-        
-        # 获取总数
-        cursor.execute(f"SELECT COUNT(*) FROM activation_codes{where_clause}", params)
-        total = cursor.fetchone()[0]
-        
-        # 获取分页数据
-        offset = (page - 1) * per_page
-        cursor.execute(f"""
-            SELECT * FROM activation_codes{where_clause} 
-            ORDER BY created_at DESC 
-            LIMIT ? OFFSET ?
-        """, params + [per_page, offset])
-        codes = cursor.fetchall()
-        
+        # 按 (created_at, id) 游标翻页
+        ensure_list_indexes(conn, DB_PATH)
+        result = keyset_page(conn, 'activation_codes', where_conditions, params, 'created_at',
+                             after=after, before=before, per_page=per_page)
         conn.close()
         
-        # 计算分页信息
-        total_pages = (total + per_page - 1) // per_page
+        if request.args.get('format') == 'json':
+            return jsonify({
+                'success': True,
+                'data': {
+                    'codes': [dict(row) for row in result['rows']],
+                    'next_cursor': result['next_cursor'],
+                    'prev_cursor': result['prev_cursor'],
+                    'per_page': result['per_page'],
+                    'total': result['total'],
+                    'count_cached_at': result['count_cached_at'],
+                }
+            })
         
         return render_template('codes.html', 
-                             codes=codes,
-                             page=page,
-                             total_pages=total_pages,
-                             total=total,
+                             codes=result['rows'],
+                             next_cursor=result['next_cursor'],
+                             prev_cursor=result['prev_cursor'],
+                             per_page=result['per_page'],
+                             total=result['total'],
                              code_type=code_type,
                              status=status)
+    except ValueError as e:
+        if request.args.get('format') == 'json':
+            return jsonify({'success': False, 'message': str(e), 'error_code': 'INVALID_DATA'}), 400
+        flash(f'获取激活码列表失败: {str(e)}', 'error')
+        return render_template('codes.html', codes=[])
     except Exception as e:
         flash(f'获取激活码列表失败: {str(e)}', 'error')
         return render_template('codes.html', codes=[])
@@ -381,35 +358,48 @@ def generate():
             batch_name = request.form.get('batch_name', '')
             notes = request.form.get('notes', '')
             
-            if not code_type or count <= 0 or count > 1000:
+            if not code_type or count <= 0 or count > MAX_BULK_CODES:
                 flash('参数错误', 'error')
-                return render_template('generate.html')
+                return render_template('generate.html', max_bulk_codes=MAX_BULK_CODES)
             
             if not batch_name:
                 batch_name = generate_batch_id()
             
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            # 大批量生成转为后台任务，页面轮询任务进度后下载CSV
+            if count > BACKGROUND_GENERATE_THRESHOLD:
+                job_id = job_runner.enqueue('generate_codes', {
+                    'count': count,
+                    'code_type': code_type,
+                    'batch_name': batch_name,
+                    'notes': notes,
+                }, created_by=current_admin_name())
+                flash(f'已提交后台任务，正在生成 {count} 个激活码', 'success')
+                return render_template('generate.html', job_id=job_id,
+                                       max_bulk_codes=MAX_BULK_CODES)
             
-            generated_codes = []
-            for _ in range(count):
-                code = generate_activation_code()
-                cursor.execute("""
-                    INSERT INTO activation_codes (code, code_type, batch_name, notes)
-                    VALUES (?, ?, ?, ?)
-                """, (code, code_type, batch_name, notes))
-                generated_codes.append(code)
+            conn = get_db_connection()
+            try:
+                # 报表缓存失效记录与激活码在同一事务中写入
+                generated_codes = generate_codes_bulk(conn, count, code_type, batch_name, notes,
+                                                      before_commit=report_cache.publish_invalidation)
+            finally:
+                conn.close()
+            report_cache.invalidate()
+            log_event('generate', 'success', actor=current_admin_name(),
+                      detail={'count': count, 'code_type': code_type, 'batch_name': batch_name})
             
-            conn.commit()
-            conn.close()
+            # 数量较多或选择下载时以CSV流式返回，不在页面中渲染
+            if request.form.get('output') == 'csv' or count > GENERATE_DISPLAY_LIMIT:
+                return codes_csv_response(generated_codes, code_type, batch_name)
             
             flash(f'成功生成 {count} 个激活码', 'success')
-            return render_template('generate.html', generated_codes=generated_codes)
+            return render_template('generate.html', generated_codes=generated_codes,
+                                   max_bulk_codes=MAX_BULK_CODES)
             
         except Exception as e:
             flash(f'生成激活码失败: {str(e)}', 'error')
     
-    return render_template('generate.html')
+    return render_template('generate.html', max_bulk_codes=MAX_BULK_CODES)
 
 @app.route('/users')
 @login_required
@@ -417,11 +407,11 @@ def users():
     """Pro用户管理"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
         
         # 获取查询参数
-        page = int(request.args.get('page', 1))
-        per_page = 20
+        per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+        after = request.args.get('after') or None
+        before = request.args.get('before') or None
         pro_type = request.args.get('type', '')
         status = request.args.get('status', '')
         
@@ -438,33 +428,38 @@ def users():
         elif status == 'inactive':
             where_conditions.append("is_active = 0")
         
-        where_clause = " WHERE " + " AND ".join(where_conditions) if where_conditions else ""
-        
-        # 获取总数
-        cursor.execute(f"SELECT COUNT(*) FROM pro_users{where_clause}", params)
-        total = cursor.fetchone()[0]
-        
-        # 获取分页数据
-        offset = (page - 1) * per_page
-        cursor.execute(f"""
-            SELECT * FROM pro_users{where_clause} 
-            ORDER BY activated_at DESC 
-            LIMIT ? OFFSET ?
-        """, params + [per_page, offset])
-        users = cursor.fetchall()
-        
+        # 按 (activated_at, id) 游标翻页
+        ensure_list_indexes(conn, DB_PATH)
+        result = keyset_page(conn, 'pro_users', where_conditions, params, 'activated_at',
+                             after=after, before=before, per_page=per_page)
         conn.close()
         
-        # 计算分页信息
-        total_pages = (total + per_page - 1) // per_page
+        if request.args.get('format') == 'json':
+            return jsonify({
+                'success': True,
+                'data': {
+                    'users': [dict(row) for row in result['rows']],
+                    'next_cursor': result['next_cursor'],
+                    'prev_cursor': result['prev_cursor'],
+                    'per_page': result['per_page'],
+                    'total': result['total'],
+                    'count_cached_at': result['count_cached_at'],
+                }
+            })
         
         return render_template('users.html', 
-                             users=users,
-                             page=page,
-                             total_pages=total_pages,
-                             total=total,
+                             users=result['rows'],
+                             next_cursor=result['next_cursor'],
+                             prev_cursor=result['prev_cursor'],
+                             per_page=result['per_page'],
+                             total=result['total'],
                              pro_type=pro_type,
                              status=status)
+    except ValueError as e:
+        if request.args.get('format') == 'json':
+            return jsonify({'success': False, 'message': str(e), 'error_code': 'INVALID_DATA'}), 400
+        flash(f'获取用户列表失败: {str(e)}', 'error')
+        return render_template('users.html', users=[])
     except Exception as e:
         flash(f'获取用户列表失败: {str(e)}', 'error')
         return render_template('users.html', users=[])
@@ -491,8 +486,12 @@ def disable_code():
         """, (reason, code))
         
         if cursor.rowcount > 0:
+            report_cache.publish_invalidation(conn)
             conn.commit()
             conn.close()
+            report_cache.invalidate()
+            log_event('disable', 'success', activation_code=code, actor=current_admin_name(),
+                      detail={'reason': reason})
             return jsonify({'success': True, 'message': '激活码已禁用'})
         else:
             conn.close()
@@ -521,10 +520,26 @@ def revoke_user():
             SET is_active = 0, revoked_at = CURRENT_TIMESTAMP, revoked_reason = ?
             WHERE user_email = ? AND is_active = 1
         """, (reason, user_email))
+        revoked = cursor.rowcount
         
-        if cursor.rowcount > 0:
+        # verify_pro 读取的是 users.pro_status，必须在同一事务中一并撤销
+        cursor.execute("""
+            UPDATE users 
+            SET pro_status = 'inactive', updated_at = CURRENT_TIMESTAMP
+            WHERE email = ? AND pro_status IN ('active', 'expired')
+        """, (user_email,))
+        revoked += cursor.rowcount
+        
+        if revoked > 0:
+            # 通知API进程失效该用户的Pro状态缓存
+            pro_status_cache.publish_invalidation(conn, user_email)
+            report_cache.publish_invalidation(conn)
+            record_revocation(conn, user_email)
             conn.commit()
             conn.close()
+            pro_status_cache.invalidate(user_email)
+            report_cache.invalidate()
+            log_event('revoke', 'success', user_email, actor=current_admin_name(), detail={'reason': reason})
             return jsonify({'success': True, 'message': '用户Pro状态已撤销'})
         else:
             conn.close()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - SQLite数据库引导配置
+统一设置 WAL 日志模式、同步级别、缓存/内存映射大小、临时存储和忙等待超时，
+供 init_database() 和连接池创建连接时使用
+"""
+
+import os
+import sqlite3
+import threading
+
+# PRAGMA配置（可通过环境变量覆盖）
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL').upper()
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -16000))  # 负数表示KiB，约16MB
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 64 * 1024 * 1024))
+SQLITE_TEMP_STORE = os.environ.get('SQLITE_TEMP_STORE', 'MEMORY').upper()
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+_JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+_SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+_TEMP_STORES = ('DEFAULT', 'FILE', 'MEMORY')
+
+_bootstrapped = set()
+_bootstrap_lock = threading.Lock()
+
+
+def _choice(value, allowed, name):
+    if value not in allowed:
+        raise ValueError(f'Invalid {name}: {value} (allowed: {", ".join(allowed)})')
+    return value
+
+
+def configure_connection(conn):
+    """设置每个连接级别的PRAGMA"""
+    conn.execute(f'PRAGMA busy_timeout = {int(SQLITE_BUSY_TIMEOUT_MS)}')
+    conn.execute(f'PRAGMA synchronous = {_choice(SQLITE_SYNCHRONOUS, _SYNCHRONOUS_LEVELS, "synchronous")}')
+    conn.execute(f'PRAGMA cache_size = {int(SQLITE_CACHE_SIZE)}')
+    conn.execute(f'PRAGMA mmap_size = {int(SQLITE_MMAP_SIZE)}')
+    conn.execute(f'PRAGMA temp_store = {_choice(SQLITE_TEMP_STORE, _TEMP_STORES, "temp_store")}')
+    # INSERT OR REPLACE 删除旧行时也触发 DELETE 触发器，统计计数才不会重复累加
+    conn.execute('PRAGMA recursive_triggers = ON')
+    return conn
+
+
+def bootstrap_database(db_path, conn=None):
+    """
+    设置数据库文件级别的日志模式（WAL会持久化到数据库文件中）
+    返回实际生效的 journal_mode
+    """
+    journal_mode = _choice(SQLITE_JOURNAL_MODE, _JOURNAL_MODES, 'journal_mode')
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+    try:
+        effective = conn.execute(f'PRAGMA journal_mode = {journal_mode}').fetchone()[0]
+    finally:
+        if own_conn:
+            conn.close()
+    with _bootstrap_lock:
+        _bootstrapped.add(os.path.abspath(db_path))
+    return effective
+
+
+def connect(db_path, **kwargs):
+    """创建已完成PRAGMA配置的SQLite连接，每个进程首次连接某个数据库文件时执行引导"""
+    kwargs.setdefault('timeout', SQLITE_BUSY_TIMEOUT_MS / 1000)
+    conn = sqlite3.connect(db_path, **kwargs)
+    try:
+        configure_connection(conn)
+        if os.path.abspath(db_path) not in _bootstrapped:
+            bootstrap_database(db_path, conn)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def get_effective_settings(conn):
+    """读取连接上实际生效的PRAGMA，用于健康检查"""
+    synchronous_names = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}
+    temp_store_names = {0: 'DEFAULT', 1: 'FILE', 2: 'MEMORY'}
+
+    def pragma(name):
+        return conn.execute(f'PRAGMA {name}').fetchone()[0]
+
+    return {
+        'journal_mode': pragma('journal_mode'),
+        'synchronous': synchronous_names.get(pragma('synchronous')),
+        'cache_size': pragma('cache_size'),
+        'mmap_size': pragma('mmap_size'),
+        'temp_store': temp_store_names.get(pragma('temp_store')),
+        'busy_timeout_ms': pragma('busy_timeout'),
+        'recursive_triggers': bool(pragma('recursive_triggers')),
+    }
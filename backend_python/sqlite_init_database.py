@@ -5,12 +5,13 @@ MoziBang 激活码系统 - SQLite数据库初始化脚本
 使用SQLite数据库，无需额外配置
 """
 
-import sqlite3
 import hashlib
 import secrets
 import sys
 from datetime import datetime, timedelta
 import os
+from sqlite_bootstrap import connect
+from code_filter import notify_codes_added
 
 # SQLite数据库文件路径
 DB_PATH = os.path.join(os.path.dirname(__file__), 'mozibang_activation.db')
@@ -25,7 +26,7 @@ def create_database_and_tables():
     """创建数据库和表"""
     try:
         # 连接SQLite数据库
-        connection = sqlite3.connect(DB_PATH)
+        connection = connect(DB_PATH)
         cursor = connection.cursor()
         
         print("正在创建数据库表结构...")
@@ -172,6 +173,7 @@ def create_database_and_tables():
             """, (code, code_type, batch, notes))
         
         connection.commit()
+        notify_codes_added(DB_PATH)
         
         print("✅ SQLite数据库初始化完成！")
         print(f"\n📁 数据库文件位置: {DB_PATH}")
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - SQLite连接池
+每个进程（gunicorn worker）按数据库文件维护一个线程安全的连接池，
+借出的连接调用 close() 时归还连接池而不是真正关闭。
+通过 add_query_observer() 注册观察者后，借出连接上的 execute/fetch/commit 会计时并回调；
+没有观察者时直接调用底层连接，不增加开销
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from sqlite_bootstrap import connect
+
+# 连接池配置
+POOL_MAX_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 8))
+POOL_TIMEOUT = float(os.environ.get('SQLITE_POOL_TIMEOUT', 10))
+POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get('SQLITE_POOL_HEALTH_CHECK_INTERVAL', 30))
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """连接池在超时时间内没有可用连接"""
+
+
+# 一次计时：phase 为 execute / executemany / executescript / fetch / commit，
+# parameters 为 execute 的参数（其后的 fetch 沿用），db_path 为所属连接池的数据库文件
+QueryTiming = namedtuple('QueryTiming', 'sql parameters phase elapsed db_path')
+
+# 查询观察者 observer(timing)
+_query_observers = []
+
+
+def add_query_observer(observer):
+    """注册查询观察者，在执行SQL的线程上同步调用，应尽量轻量"""
+    if observer not in _query_observers:
+        _query_observers.append(observer)
+
+
+def remove_query_observer(observer):
+    if observer in _query_observers:
+        _query_observers.remove(observer)
+
+
+def _notify(timing):
+    for observer in _query_observers:
+        try:
+            observer(timing)
+        except Exception:
+            pass
+
+
+class TimedCursor:
+    """计时游标：execute 和 fetch 的耗时都计入（SQLite在取行时才真正执行）"""
+
+    # 直接迭代游标时每次取出的行数
+    ITER_CHUNK = 256
+
+    def __init__(self, cursor, db_path=None):
+        self._cursor = cursor
+        self._db_path = db_path
+        self._sql = None
+        self._parameters = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _timed(self, phase, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            _notify(QueryTiming(self._sql, self._parameters, phase, time.perf_counter() - started, self._db_path))
+
+    def execute(self, sql, parameters=()):
+        self._sql, self._parameters = sql, parameters
+        self._timed('execute', self._cursor.execute, sql, parameters)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql, self._parameters = sql, None
+        self._timed('executemany', self._cursor.executemany, sql, seq_of_parameters)
+        return self
+
+    def executescript(self, script):
+        self._sql, self._parameters = script, None
+        self._timed('executescript', self._cursor.executescript, script)
+        return self
+
+    def fetchone(self):
+        return self._timed('fetch', self._cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed('fetch', self._cursor.fetchmany, size or self._cursor.arraysize)
+
+    def fetchall(self):
+        return self._timed('fetch', self._cursor.fetchall)
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(self.ITER_CHUNK)
+            if not rows:
+                return
+            yield from rows
+
+
+class PooledConnection:
+    """连接代理，除 close() 外的属性和方法都转发给底层 sqlite3 连接"""
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+
+    def _raw(self):
+        conn = self._conn
+        if conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a connection returned to the pool.')
+        return conn
+
+    def __getattr__(self, name):
+        return getattr(self._raw(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def _timed_cursor(self):
+        return TimedCursor(self._raw().cursor(), self._pool.db_path)
+
+    def cursor(self, *args):
+        if not _query_observers:
+            return self._raw().cursor(*args)
+        return TimedCursor(self._raw().cursor(*args), self._pool.db_path)
+
+    def execute(self, sql, parameters=()):
+        if not _query_observers:
+            return self._raw().execute(sql, parameters)
+        return self._timed_cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not _query_observers:
+            return self._raw().executemany(sql, seq_of_parameters)
+        return self._timed_cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        if not _query_observers:
+            return self._raw().executescript(script)
+        return self._timed_cursor().executescript(script)
+
+    def commit(self):
+        if not _query_observers:
+            return self._raw().commit()
+        started = time.perf_counter()
+        try:
+            return self._raw().commit()
+        finally:
+            _notify(QueryTiming('COMMIT', None, 'commit', time.perf_counter() - started, self._pool.db_path))
+
+    def close(self):
+        """归还连接池"""
+        conn = self._conn
+        if conn is not None:
+            object.__setattr__(self, '_conn', None)
+            self._pool.release(conn)
+
+    def __del__(self):
+        # 处理异常路径中忘记 close() 的连接
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class SQLiteConnectionPool:
+    """SQLite连接池"""
+
+    def __init__(self, db_path, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                 health_check_interval=POOL_HEALTH_CHECK_INTERVAL):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.pid = os.getpid()
+
+        self._lock = threading.Condition(threading.Lock())
+        self._idle = []  # [(连接, 归还时间)]
+        self._in_use = 0
+        self._metrics = {
+            'connections_created': 0,
+            'connections_closed': 0,
+            'checkouts': 0,
+            'reused': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'peak_in_use': 0,
+        }
+
+    def _create_connection(self):
+        """创建新的底层连接"""
+        conn = connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # 使结果可以像字典一样访问
+        self._metrics['connections_created'] += 1
+        return conn
+
+    def _close_connection(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        self._metrics['connections_closed'] += 1
+
+    def _is_healthy(self, conn, idle_since):
+        """空闲超过检查间隔的连接在借出前执行一次 SELECT 1"""
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            self._metrics['health_check_failures'] += 1
+            return False
+
+    def connection(self):
+        """借出一个连接，返回 PooledConnection"""
+        deadline = None
+        with self._lock:
+            while True:
+                while self._idle:
+                    conn, idle_since = self._idle.pop()
+                    if self._is_healthy(conn, idle_since):
+                        self._metrics['reused'] += 1
+                        return self._checkout(conn)
+                    self._close_connection(conn)
+
+                if self._in_use < self.max_size:
+                    # 先占位再建连，避免并发建连超过上限
+                    self._in_use += 1
+                    break
+
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.timeout
+                    self._metrics['waits'] += 1
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._metrics['timeouts'] += 1
+                    raise PoolTimeoutError(
+                        f'No SQLite connection available within {self.timeout}s '
+                        f'(max_size={self.max_size})'
+                    )
+                started = time.monotonic()
+                self._lock.wait(remaining)
+                self._metrics['wait_time_total'] += time.monotonic() - started
+
+        try:
+            conn = self._create_connection()
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+                self._lock.notify()
+            raise
+
+        with self._lock:
+            self._in_use -= 1
+            return self._checkout(conn)
+
+    def _checkout(self, conn):
+        # 调用方需持有锁
+        self._in_use += 1
+        self._metrics['checkouts'] += 1
+        self._metrics['peak_in_use'] = max(self._metrics['peak_in_use'], self._in_use)
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """归还连接，未提交的事务会被回滚"""
+        reusable = os.getpid() == self.pid
+        if reusable:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.row_factory = sqlite3.Row
+            except sqlite3.Error:
+                reusable = False
+
+        with self._lock:
+            self._in_use -= 1
+            if reusable:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._close_connection(conn)
+            self._lock.notify()
+
+    def close_all(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._close_connection(conn)
+
+    def stats(self):
+        """连接池指标"""
+        with self._lock:
+            stats = dict(self._metrics)
+            stats.update({
+                'db_path': self.db_path,
+                'pid': self.pid,
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'avg_wait_ms': round(stats['wait_time_total'] * 1000 / stats['waits'], 3) if stats['waits'] else 0,
+            })
+            stats['wait_time_total'] = round(stats['wait_time_total'], 6)
+            return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def get_pool(db_path):
+    """获取当前进程中指定数据库文件的连接池"""
+    global _pools_pid
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # fork 后的子进程不能复用父进程的连接
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = SQLiteConnectionPool(db_path)
+            _pools[key] = pool
+        return pool
+
+
+def get_pool_stats():
+    """当前进程所有连接池的指标"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
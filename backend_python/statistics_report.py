@@ -5,21 +5,22 @@ MoziBang 激活码系统统计报表模块
 提供详细的激活码使用统计和报表功能
 """
 
-import sqlite3
 import pymysql
 import json
 import datetime
 from collections import defaultdict
 import os
+from sqlite_pool import get_pool
+import stats_counters
+import daily_rollup
+import pro_expiry
 
 # 数据库路径
 DB_PATH = os.path.join(os.path.dirname(__file__), 'mozibang_activation.db')
 
 def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """获取数据库连接（从进程内连接池借出，close() 即归还）"""
+    return get_pool(DB_PATH).connection()
 
 class ActivationStatistics:
     """激活码统计类"""
@@ -40,6 +41,21 @@ class ActivationStatistics:
     
     def get_activation_overview(self):
         """获取激活码总览统计"""
+        if not self.is_mysql:
+            # SQLite读取触发器维护的计数表
+            stats_counters.ensure_schema(self.conn, DB_PATH)
+            return [
+                {
+                    'code_type': code_type,
+                    'total_codes': c['total'],
+                    'used_codes': c['used'],
+                    'available_codes': c['available'],
+                    'disabled_codes': c['disabled'],
+                    'usage_rate': round((c['used'] / c['total']) * 100, 2) if c['total'] > 0 else 0
+                }
+                for code_type, c in stats_counters.code_counts(self.conn).items()
+            ]
+        
         cursor = self.conn.cursor()
         
         # 激活码总体统计
@@ -70,6 +86,22 @@ class ActivationStatistics:
     
     def get_user_statistics(self):
         """获取用户统计"""
+        if not self.is_mysql:
+            # SQLite读取计数表，仅到期人数按 expires_at 索引实时统计
+            stats_counters.ensure_schema(self.conn, DB_PATH)
+            return [
+                {
+                    'pro_type': pro_type,
+                    'total_users': c['total'],
+                    'active_users': c['active'],
+                    'inactive_users': c['inactive'],
+                    'lifetime_users': c['lifetime'],
+                    'valid_users': c['valid'],
+                    'expired_users': c['expired']
+                }
+                for pro_type, c in stats_counters.pro_user_counts(self.conn).items()
+            ]
+        
         cursor = self.conn.cursor()
         
         # Pro用户统计
@@ -103,47 +135,31 @@ class ActivationStatistics:
     
     def get_daily_activation_trend(self, days=30):
         """获取每日激活趋势（最近N天）"""
+        if not self.is_mysql:
+            # SQLite读取触发器维护的每日汇总表（表和触发器在启动和借出连接时创建）
+            return daily_rollup.daily_trend(self.conn, days)
+        
         cursor = self.conn.cursor()
         
-        if self.is_mysql:
-            # MySQL语法
-            cursor.execute("""
-                SELECT 
-                    DATE(activated_at) as activation_date,
-                    COUNT(*) as activation_count,
-                    COUNT(DISTINCT user_email) as unique_users
-                FROM pro_users 
-                WHERE activated_at >= DATE_SUB(NOW(), INTERVAL %s DAY)
-                GROUP BY DATE(activated_at)
-                ORDER BY activation_date DESC
-            """, (days,))
-        else:
-            # SQLite语法
-            cursor.execute("""
-                SELECT 
-                    DATE(activated_at) as activation_date,
-                    COUNT(*) as activation_count,
-                    COUNT(DISTINCT user_email) as unique_users
-                FROM pro_users 
-                WHERE activated_at >= datetime('now', '-{} days')
-                GROUP BY DATE(activated_at)
-                ORDER BY activation_date DESC
-            """.format(days))
+        # MySQL语法
+        cursor.execute("""
+            SELECT 
+                DATE(activated_at) as activation_date,
+                COUNT(*) as activation_count,
+                COUNT(DISTINCT user_email) as unique_users
+            FROM pro_users 
+            WHERE activated_at >= DATE_SUB(NOW(), INTERVAL %s DAY)
+            GROUP BY DATE(activated_at)
+            ORDER BY activation_date DESC
+        """, (days,))
         
         trend_data = []
         for row in cursor.fetchall():
-            if self.is_mysql:
-                trend_data.append({
-                    'date': str(row['activation_date']),
-                    'activations': row['activation_count'],
-                    'unique_users': row['unique_users']
-                })
-            else:
-                trend_data.append({
-                    'date': row['activation_date'],
-                    'activations': row['activation_count'],
-                    'unique_users': row['unique_users']
-                })
+            trend_data.append({
+                'date': str(row['activation_date']),
+                'activations': row['activation_count'],
+                'unique_users': row['unique_users']
+            })
         
         return trend_data
     
@@ -209,23 +225,11 @@ class ActivationStatistics:
                 'last_login': row['last_login']
             })
         
-        # 即将过期的用户
-        cursor.execute("""
-            SELECT 
-                user_email,
-                user_name,
-                pro_type,
-                expires_at,
-                (julianday(expires_at) - julianday('now')) as days_until_expiry
-            FROM pro_users 
-            WHERE expires_at IS NOT NULL 
-            AND expires_at > datetime('now')
-            AND expires_at <= datetime('now', '+30 days')
-            ORDER BY expires_at ASC
-        """)
-        
+        # 即将过期的用户（30天内，按到期时间戳索引范围扫描）
+        pro_expiry.ensure_schema(self.conn, DB_PATH)
         expiring_soon = []
-        for row in cursor.fetchall():
+        for row in pro_expiry.expiring_users(self.conn, within_days=30,
+                                             columns='user_email, user_name, pro_type, expires_at'):
             expiring_soon.append({
                 'user_email': row['user_email'],
                 'user_name': row['user_name'],
@@ -239,6 +243,29 @@ class ActivationStatistics:
             'expiring_soon': expiring_soon
         }
     
+    def get_statistics_page_activity(self, limit=10):
+        """统计页面的最近激活用户与即将过期用户"""
+        cursor = self.conn.cursor()
+        
+        cursor.execute("""
+            SELECT user_email, pro_type, activated_at 
+            FROM pro_users 
+            ORDER BY activated_at DESC 
+            LIMIT ?
+        """, (limit,))
+        recent_users = [dict(row) for row in cursor.fetchall()]
+        
+        pro_expiry.ensure_schema(self.conn, DB_PATH)
+        expiring_users = [
+            dict(row, days_until_expiry=int(row['days_until_expiry']))
+            for row in pro_expiry.expiring_users(self.conn, active_only=True, limit=limit)
+        ]
+        
+        return {
+            'recent_users': recent_users,
+            'expiring_users': expiring_users
+        }
+    
     def get_revenue_estimation(self):
         """获取收入估算（基于激活码类型）"""
         # 假设的价格映射
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - 统计计数器
+stats_counters 表按 (范围, 分组, 状态) 保存行数，由触发器随
+activation_codes / users / pro_users 的增删改在同一事务内增量维护，
+仪表板读取几行计数即可，无需每次全表聚合。
+
+计数出现偏差（例如手工改库、触发器安装前的历史数据）时可重建：
+    python stats_counters.py rebuild
+"""
+
+import os
+import sys
+
+import pro_expiry
+
+# 各统计范围：源表、分组表达式、状态表达式（{row} 替换为 NEW / OLD 或表名）
+COUNTER_SCOPES = {
+    # 激活码：按类型分组，状态为 "is_used:is_disabled"
+    'codes': {
+        'table': 'activation_codes',
+        'bucket': "{row}.code_type",
+        'state': "(CASE WHEN {row}.is_used THEN '1' ELSE '0' END) || ':' || "
+                 "(CASE WHEN {row}.is_disabled THEN '1' ELSE '0' END)",
+        'columns': 'code_type, is_used, is_disabled',
+    },
+    # 扩展用户：按 pro_status 分组
+    'users': {
+        'table': 'users',
+        'bucket': "'all'",
+        'state': "COALESCE({row}.pro_status, 'inactive')",
+        'columns': 'pro_status',
+    },
+    # Pro用户：按 pro_type 分组，状态为 "is_active:lifetime|term"
+    'pro_users': {
+        'table': 'pro_users',
+        'bucket': "{row}.pro_type",
+        'state': "(CASE WHEN {row}.is_active THEN '1' ELSE '0' END) || ':' || "
+                 "(CASE WHEN {row}.expires_at IS NULL THEN 'lifetime' ELSE 'term' END)",
+        'columns': 'pro_type, is_active, expires_at',
+    },
+}
+
+_ready_paths = set()
+
+
+def _table_exists(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+
+def _trigger_exists(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def _bump_sql(scope, spec, row, delta):
+    bucket = spec['bucket'].format(row=row)
+    state = spec['state'].format(row=row)
+    return f"""
+        INSERT INTO stats_counters (scope, bucket, state, value)
+        VALUES ('{scope}', {bucket}, {state}, {delta})
+        ON CONFLICT(scope, bucket, state) DO UPDATE SET value = value + ({delta});
+    """
+
+
+def _install_triggers(conn, scope, spec):
+    table = spec['table']
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_{scope}_insert AFTER INSERT ON {table}
+        BEGIN {_bump_sql(scope, spec, 'NEW', 1)} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_{scope}_delete AFTER DELETE ON {table}
+        BEGIN {_bump_sql(scope, spec, 'OLD', -1)} END
+    """)
+    # 只在分组或状态真正变化时更新，last_login 等高频字段的更新不触发
+    old_key = f"{spec['bucket'].format(row='OLD')} || '|' || {spec['state'].format(row='OLD')}"
+    new_key = f"{spec['bucket'].format(row='NEW')} || '|' || {spec['state'].format(row='NEW')}"
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_{scope}_update
+        AFTER UPDATE OF {spec['columns']} ON {table}
+        WHEN ({old_key}) IS NOT ({new_key})
+        BEGIN {_bump_sql(scope, spec, 'OLD', -1)} {_bump_sql(scope, spec, 'NEW', 1)} END
+    """)
+
+
+def _rebuild_scope(conn, scope, spec):
+    conn.execute("DELETE FROM stats_counters WHERE scope = ?", (scope,))
+    table = spec['table']
+    conn.execute(f"""
+        INSERT INTO stats_counters (scope, bucket, state, value)
+        SELECT '{scope}', {spec['bucket'].format(row=table)}, {spec['state'].format(row=table)}, COUNT(*)
+        FROM {table}
+        GROUP BY 2, 3
+    """)
+
+
+def ensure_schema(conn, db_path=None):
+    """
+    创建计数表，为已存在的源表安装触发器；新装触发器的范围会立即重建一次，
+    保证历史数据计入。pro_users 由 auto_create_pro_users 稍后创建时需再次调用
+    """
+    if db_path is not None and db_path in _ready_paths:
+        return
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            scope TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            state TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, bucket, state)
+        ) WITHOUT ROWID
+    """)
+    all_ready = True
+    for scope, spec in COUNTER_SCOPES.items():
+        if not _table_exists(conn, spec['table']):
+            all_ready = False
+            continue
+        if not _trigger_exists(conn, f'trg_stats_{scope}_insert'):
+            _install_triggers(conn, scope, spec)
+            _rebuild_scope(conn, scope, spec)
+    # 到期统计依赖当前时间，无法用触发器维护，改为按到期时间戳的索引范围查询
+    pro_expiry.ensure_schema(conn)
+    conn.commit()
+    if db_path is not None and all_ready:
+        _ready_paths.add(db_path)
+
+
+def rebuild(conn):
+    """按源表重新计算全部计数（单个事务）"""
+    ensure_schema(conn)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for scope, spec in COUNTER_SCOPES.items():
+            if _table_exists(conn, spec['table']):
+                _rebuild_scope(conn, scope, spec)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _load(conn, scope):
+    buckets = {}
+    for row in conn.execute(
+        "SELECT bucket, state, value FROM stats_counters WHERE scope = ? AND value != 0", (scope,)
+    ):
+        buckets.setdefault(row[0], {})[row[1]] = row[2]
+    return buckets
+
+
+def row_count(conn, table):
+    """源表总行数；该表没有计数范围或触发器尚未安装时返回 None"""
+    for scope, spec in COUNTER_SCOPES.items():
+        if spec['table'] == table and _trigger_exists(conn, f'trg_stats_{scope}_insert'):
+            return conn.execute(
+                "SELECT COALESCE(SUM(value), 0) FROM stats_counters WHERE scope = ?", (scope,)
+            ).fetchone()[0]
+    return None
+
+
+def code_counts(conn):
+    """
+    激活码按类型的计数
+    返回 {code_type: {'total', 'used', 'available', 'disabled'}}，按类型排序
+    """
+    result = {}
+    for code_type, states in sorted(_load(conn, 'codes').items()):
+        result[code_type] = {
+            'total': sum(states.values()),
+            'used': states.get('1:0', 0) + states.get('1:1', 0),
+            'available': states.get('0:0', 0),
+            'disabled': states.get('0:1', 0) + states.get('1:1', 0),
+        }
+    return result
+
+
+def user_status_counts(conn):
+    """扩展用户按 pro_status 的计数 {pro_status: count}"""
+    return dict(sorted(_load(conn, 'users').get('all', {}).items()))
+
+
+def pro_user_counts(conn):
+    """
+    Pro用户按类型的计数
+    返回 {pro_type: {'total', 'active', 'inactive', 'lifetime', 'valid', 'expired'}}
+    """
+    expired = pro_expiry.expired_counts(conn)
+
+    result = {}
+    for pro_type, states in sorted(_load(conn, 'pro_users').items()):
+        active = states.get('1:lifetime', 0) + states.get('1:term', 0)
+        inactive = states.get('0:lifetime', 0) + states.get('0:term', 0)
+        lifetime = states.get('1:lifetime', 0) + states.get('0:lifetime', 0)
+        term = states.get('1:term', 0) + states.get('0:term', 0)
+        result[pro_type] = {
+            'total': active + inactive,
+            'active': active,
+            'inactive': inactive,
+            'lifetime': lifetime,
+            'valid': term - expired.get(pro_type, 0),
+            'expired': expired.get(pro_type, 0),
+        }
+    return result
+
+
+if __name__ == '__main__':
+    from sqlite_bootstrap import connect
+
+    db_path = os.environ.get('DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mozibang_activation.db'))
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print("用法: python stats_counters.py rebuild")
+        sys.exit(1)
+
+    conn = connect(db_path)
+    rebuild(conn)
+    print(f"✅ 统计计数已重建: {db_path}")
+    for code_type, counts in code_counts(conn).items():
+        print(f"  {code_type}: {counts}")
+    conn.close()
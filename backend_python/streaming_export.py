@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - 流式数据导出
+激活码、Pro用户和激活记录以 CSV 或 JSON Lines 分块流式下载。
+按 id 游标分批读取，每批借出一次连接后立即归还，
+导出期间不长时间占用连接或读事务，内存占用与表大小无关
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+from urllib.parse import quote
+
+from flask import Blueprint, Response, jsonify, request, session
+
+from sqlite_pool import get_pool
+
+# 每批读取的行数
+EXPORT_CHUNK_SIZE = 1000
+
+# 可导出的数据集：表、列、支持的筛选参数 -> SQL 条件
+EXPORT_DATASETS = {
+    'codes': {
+        'table': 'activation_codes',
+        'columns': ['id', 'code', 'code_type', 'batch_name', 'notes', 'is_used', 'used_by', 'used_at',
+                    'is_disabled', 'disabled_at', 'disabled_reason', 'created_at'],
+        'filters': {
+            'code_type': 'code_type = ?',
+            'batch_name': 'batch_name = ?',
+        },
+        'where': [],
+    },
+    'users': {
+        'table': 'pro_users',
+        'columns': ['id', 'user_email', 'user_name', 'pro_type', 'activation_code', 'activated_at',
+                    'expires_at', 'is_lifetime', 'is_active', 'last_login', 'revoked_at', 'revoked_reason'],
+        'filters': {
+            'pro_type': 'pro_type = ?',
+            # 与用户列表页相同：active / inactive，其他值不筛选
+            'status': "CASE ? WHEN 'active' THEN is_active = 1 WHEN 'inactive' THEN is_active = 0 ELSE 1 END",
+        },
+        'where': [],
+    },
+    # 激活记录：已使用的激活码
+    'activations': {
+        'table': 'activation_codes',
+        'columns': ['id', 'code', 'code_type', 'batch_name', 'used_by', 'used_at'],
+        'filters': {
+            'code_type': 'code_type = ?',
+            'since': 'used_at >= ?',
+            'until': 'used_at < ?',
+        },
+        'where': ['is_used = 1'],
+    },
+}
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+_db_path_getter = None
+
+
+def configure(db_path_getter):
+    """设置数据库路径的获取函数"""
+    global _db_path_getter
+    _db_path_getter = db_path_getter
+
+
+def iter_rows(dataset, filters=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """按 id 升序分批读取数据集，逐行返回 sqlite3.Row"""
+    spec = EXPORT_DATASETS[dataset]
+    conditions = list(spec['where'])
+    params = []
+    for name, value in (filters or {}).items():
+        conditions.append(spec['filters'][name])
+        params.append(value)
+    conditions.append('id > ?')
+    sql = f"""
+        SELECT {', '.join(spec['columns'])} FROM {spec['table']}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY id
+        LIMIT ?
+    """
+
+    last_id = 0
+    while True:
+        conn = get_pool(_db_path_getter()).connection()
+        try:
+            rows = conn.execute(sql, params + [last_id, chunk_size]).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1]['id']
+
+
+def iter_csv(columns, rows, flush_every=EXPORT_CHUNK_SIZE):
+    """逐块生成CSV内容，带BOM便于Excel识别UTF-8"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(columns)
+    for index, row in enumerate(rows, 1):
+        writer.writerow(['' if row[column] is None else row[column] for column in columns])
+        if index % flush_every == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+def iter_jsonl(columns, rows, flush_every=EXPORT_CHUNK_SIZE):
+    """逐块生成 JSON Lines 内容，每行一个对象"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({column: row[column] for column in columns}, ensure_ascii=False))
+        if len(lines) >= flush_every:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def export_response(dataset, export_format, filters=None):
+    """以附件形式流式返回导出内容"""
+    columns = EXPORT_DATASETS[dataset]['columns']
+    rows = iter_rows(dataset, filters)
+    if export_format == 'csv':
+        body = iter_csv(columns, rows)
+    else:
+        body = iter_jsonl(columns, rows)
+
+    filename = f"{dataset}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    return Response(
+        body,
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={
+            'Content-Disposition': f"attachment; filename={filename}; filename*=UTF-8''{quote(filename)}",
+            'X-Accel-Buffering': 'no',
+        }
+    )
+
+
+# 流式导出接口
+exports_bp = Blueprint('exports', __name__, url_prefix='/admin/export')
+
+
+@exports_bp.before_request
+def require_admin():
+    if 'admin_user' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Login required',
+            'error_code': 'LOGIN_REQUIRED'
+        }), 401
+
+
+@exports_bp.route('/<dataset>', methods=['GET'])
+def export_dataset(dataset):
+    """
+    导出数据集
+    GET /admin/export/codes?format=csv&code_type=pro_1year
+    GET /admin/export/users?format=jsonl&pro_type=pro_lifetime&status=active
+    GET /admin/export/activations?format=csv&since=2024-01-01&until=2024-02-01
+    """
+    if dataset not in EXPORT_DATASETS:
+        return jsonify({'success': False, 'message': 'Unknown dataset', 'error_code': 'INVALID_DATA'}), 404
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': 'Format must be csv or jsonl', 'error_code': 'INVALID_DATA'}), 400
+
+    filters = {
+        name: request.args[name]
+        for name in EXPORT_DATASETS[dataset]['filters']
+        if request.args.get(name)
+    }
+    return export_response(dataset, export_format, filters)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - 结构化日志
+请求线程只把日志记录放入有界队列（QueueHandler），由 QueueListener 后台线程
+格式化为单行JSON并写到标准输出，请求处理不再因 stdout 写入而串行等待。
+
+- 每个请求分配请求ID（沿用客户端的 X-Request-ID），写入日志并在响应头返回；
+- 高频事件按 LOG_SAMPLE_RATES 采样，按请求ID哈希决定，同一请求的日志要么全留要么全丢；
+  WARNING 及以上级别不采样；
+- 队列满时丢弃新记录并计数，不阻塞请求。
+
+用法：
+    log = get_logger('mozibang.api')
+    setup_logging(app)
+    log.info('activation_success', user_email=user_email, activation_code=code)
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_ACCESS = os.environ.get('LOG_ACCESS', '1') != '0'
+# 采样率，格式 "事件=比例,事件:端点=比例"
+LOG_SAMPLE_RATES = os.environ.get(
+    'LOG_SAMPLE_RATES',
+    'verify_pro=0.01,http_request:verify_pro_status=0.01,http_request:verify_pro_status_batch=0.01'
+)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+ROOT_LOGGER = 'mozibang'
+
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message'}
+
+
+def parse_sample_rates(spec):
+    """解析 "verify_pro=0.01,http_request:verify_pro_status=0.1" 为字典"""
+    rates = {}
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        key, value = item.split('=', 1)
+        rates[key.strip()] = max(0.0, min(float(value), 1.0))
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """单行JSON格式，结构化字段平铺到顶层"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """在调用线程上补充请求ID并按采样率过滤"""
+
+    def __init__(self, sample_rates):
+        super().__init__()
+        self.sample_rates = sample_rates
+
+    def filter(self, record):
+        request_id = getattr(record, 'request_id', None)
+        endpoint = None
+        if has_request_context():
+            request_id = request_id or g.get('request_id')
+            endpoint = request.endpoint
+            record.request_id = request_id
+        if record.levelno >= logging.WARNING or not self.sample_rates:
+            return True
+
+        event = record.msg
+        rate = self.sample_rates.get(f'{event}:{getattr(record, "endpoint", endpoint)}',
+                                     self.sample_rates.get(event))
+        if rate is None or rate >= 1:
+            return True
+        record.sample_rate = rate
+        key = request_id or uuid.uuid4().hex
+        return zlib.crc32(key.encode()) % 10000 < rate * 10000
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃记录；格式化留给监听线程，这里只固定消息和异常文本"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StructuredLogger:
+    """log.info('事件名', 字段=值) 形式的轻量封装"""
+
+    def __init__(self, logger):
+        self._logger = logger
+
+    def _log(self, level, event, exc_info=False, **fields):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, exc_info=exc_info, extra=fields)
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, **fields)
+
+    def error(self, event, exc_info=False, **fields):
+        self._log(logging.ERROR, event, exc_info=exc_info, **fields)
+
+    def exception(self, event, **fields):
+        self._log(logging.ERROR, event, exc_info=True, **fields)
+
+
+_lock = threading.Lock()
+_handler = None
+_listener = None
+
+
+def _ensure_listener():
+    """进程内只创建一个队列和监听线程"""
+    global _handler, _listener
+    with _lock:
+        if _listener is not None:
+            return
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter())
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        _handler = NonBlockingQueueHandler(log_queue)
+        _handler.addFilter(ContextFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+        _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+        _listener.start()
+        atexit.register(shutdown)
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(LOG_LEVEL)
+        root.addHandler(_handler)
+        root.propagate = False
+
+
+def shutdown():
+    """停止监听线程，写出队列中剩余的记录"""
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def get_logger(name=ROOT_LOGGER):
+    """返回 mozibang 命名空间下的结构化日志对象"""
+    if name != ROOT_LOGGER and not name.startswith(ROOT_LOGGER + '.'):
+        name = f'{ROOT_LOGGER}.{name}'
+    _ensure_listener()
+    return StructuredLogger(logging.getLogger(name))
+
+
+def current_request_id():
+    """当前请求ID，不在请求上下文中时返回 None"""
+    return g.get('request_id') if has_request_context() else None
+
+
+def stats():
+    """日志队列状态（健康检查用）"""
+    return {
+        'queue_size': _handler.queue.qsize() if _handler else 0,
+        'queue_capacity': LOG_QUEUE_SIZE,
+        'dropped': _handler.dropped if _handler else 0,
+        'level': LOG_LEVEL,
+        'sample_rates': parse_sample_rates(LOG_SAMPLE_RATES),
+    }
+
+
+def setup_logging(app):
+    """为 Flask 应用注册请求ID和访问日志"""
+    access_log = get_logger('mozibang.access')
+
+    @app.before_request
+    def assign_request_id():
+        incoming = request.headers.get(REQUEST_ID_HEADER, '')
+        g.request_id = incoming[:64] if incoming.isprintable() and incoming else uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        if LOG_ACCESS and 'request_started' in g:
+            # rate_limiter 依赖本模块，在此处导入避免循环导入
+            from rate_limiter import client_ip
+
+            duration_ms = round((time.perf_counter() - g.request_started) * 1000, 2)
+            fields = {
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'duration_ms': duration_ms,
+                'remote_addr': client_ip(),
+            }
+            if response.status_code >= 500:
+                access_log.warning('http_request', **fields)
+            else:
+                access_log.info('http_request', **fields)
+        return response
+
+    return app
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MoziBang 激活码系统 - 写回缓冲
+在内存中按键合并高频的"最后访问时间"更新，由后台线程每隔 N 秒
+或累计 M 条时通过一次 executemany 事务批量写入，进程退出时自动刷新
+"""
+
+import atexit
+import os
+import threading
+import time
+
+from structured_logging import get_logger
+
+LAST_SEEN_FLUSH_INTERVAL = float(os.environ.get('LAST_SEEN_FLUSH_INTERVAL', 5))
+LAST_SEEN_FLUSH_MAX_ENTRIES = int(os.environ.get('LAST_SEEN_FLUSH_MAX_ENTRIES', 500))
+
+log = get_logger('mozibang.write_behind')
+
+
+class WriteBehindBuffer:
+    """
+    写回缓冲
+    flush_fn 接收 [(key, value), ...]，需在一个事务中完成写入；
+    写入失败时条目会合并回缓冲区等待下次刷新
+    """
+
+    def __init__(self, name, flush_fn, flush_interval=LAST_SEEN_FLUSH_INTERVAL,
+                 max_entries=LAST_SEEN_FLUSH_MAX_ENTRIES):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = self._empty_pending()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._pid = None
+        self._metrics = {
+            'recorded': 0,
+            'coalesced': 0,
+            'flushes': 0,
+            'flushed_entries': 0,
+            'flush_errors': 0,
+            'last_flush_ms': 0,
+        }
+        atexit.register(self.stop)
+
+    def record(self, key, value):
+        """记录一次更新，同一键只保留最新值"""
+        self._ensure_thread()
+        with self._lock:
+            if key in self._pending:
+                self._metrics['coalesced'] += 1
+            self._pending[key] = value
+            self._metrics['recorded'] += 1
+            full = len(self._pending) >= self.max_entries
+        if full:
+            self._wakeup.set()
+
+    def _empty_pending(self):
+        return {}
+
+    def _take_pending(self):
+        """取出待写入条目（调用方持有 _lock）"""
+        entries = list(self._pending.items())
+        self._pending = self._empty_pending()
+        return entries
+
+    def _restore_pending(self, entries):
+        """写入失败时放回条目（调用方持有 _lock），刷新期间产生的新值优先"""
+        for key, value in entries:
+            self._pending.setdefault(key, value)
+
+    def _ensure_thread(self):
+        # fork 后的子进程需要重新启动刷新线程
+        if self._pid == os.getpid() or self._stopped:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._pending = self._empty_pending()
+            self._thread = threading.Thread(target=self._run, name=f'{self.name}-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """立即写入缓冲区中的所有条目，返回写入条数"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                entries = self._take_pending()
+
+            started = time.perf_counter()
+            try:
+                self.flush_fn(entries)
+            except Exception as e:
+                log.error('write_behind_flush_error', buffer=self.name, entries=len(entries), error=str(e))
+                with self._lock:
+                    self._metrics['flush_errors'] += 1
+                    self._restore_pending(entries)
+                return 0
+
+            with self._lock:
+                self._metrics['flushes'] += 1
+                self._metrics['flushed_entries'] += len(entries)
+                self._metrics['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            return len(entries)
+
+    def stop(self):
+        """停止后台线程并刷新剩余条目"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._pid == os.getpid():
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+            stats.update({
+                'pending': len(self._pending),
+                'flush_interval_seconds': self.flush_interval,
+                'max_entries': self.max_entries,
+            })
+            return stats
+
+
+class AppendBuffer(WriteBehindBuffer):
+    """
+    追加缓冲：条目不按键合并，按记录顺序批量写入
+    flush_fn 接收 [条目, ...]；积压超过 max_pending 时丢弃新条目并计数，避免数据库故障时内存无限增长
+    """
+
+    def __init__(self, name, flush_fn, flush_interval=1.0, max_entries=500, max_pending=100000):
+        self.max_pending = max_pending
+        super().__init__(name, flush_fn, flush_interval, max_entries)
+        self._metrics['dropped'] = 0
+
+    def append(self, entry):
+        self._ensure_thread()
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self._metrics['dropped'] += 1
+                return
+            self._pending.append(entry)
+            self._metrics['recorded'] += 1
+            full = len(self._pending) >= self.max_entries
+        if full:
+            self._wakeup.set()
+
+    def _empty_pending(self):
+        return []
+
+    def _take_pending(self):
+        entries = self._pending
+        self._pending = []
+        return entries
+
+    def _restore_pending(self, entries):
+        # 失败的批次放回队首，保持顺序
+        self._pending[:0] = entries[:max(0, self.max_pending - len(self._pending))]